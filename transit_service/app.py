@@ -1,20 +1,17 @@
-import os #operating system 
 import logging 
-from logging.handlers import RotatingFileHandler #logging events 
-from dotenv import load_dotenv #load environment variables from .env 
-import requests #to make HTTP requests to MTA API, talk 
-from google.transit import gtfs_realtime_pb2 #to parse Google Transit Feed Messages, containing real-time transit information
-from flask import Flask, request, jsonify #framework to build REST api service, create web api for send and receive
-from geopy.geocoders import Nominatim #geographical calculations, coordinate distance
+import time #to measure startup phases
+from flask import Blueprint, Flask, current_app, g, has_app_context, request, jsonify #framework to build REST api service, create web api for send and receive
 import datetime #to work with dat and time 
-import geopy.distance
-from geopy.geocoders import Nominatim
-geolocator = Nominatim(user_agent="my_geocoder")
-
-#used for testing with a known set of coordinates
-#reverses geocodes of coordinates (latitude, longitude) into a human-readable address
-location = geolocator.reverse("40.7128, -74.0060", exactly_one=True)
-print(location) #printing to verify 
+from .feeds import FeedUnavailableError, StaleFeedError #feed snapshots are polled in the background
+from .fetch import run_inline #in-memory modes run on the request thread
+from .logs import setup_logging #queued, one-line JSON records, rate-limited debug output
+from .metrics import CONTENT_TYPE, PROFILE_HEADER, Profile #latency histograms, counters, per-request stage breakdown
+from .responses import Answer, etag_for, response_key #answers cached per query and feed versions, ETags
+from .schedules import find_departures, merge_departures, stops_for_agency #next departures shared by subway, LIRR and Metro North
+from .timetable import realtime_trip_key #static trip ids -> realtime ones
+from .services import TransitServices, load_config #config + shared fetcher, feed store, station registry
+
+#built-in stations, the station registry adds every GTFS stops.txt listed in STATION_STOPS
 stations = [
     {"name": "City Hall", "latitude": 40.7127, "longitude": -74.0059, "station_id": "CH01", "gtfs_stops": ["S25", "S26", "S27"], "alternative_ids": ["R16"]},
     {"name": "Times Square", "latitude": 40.7580, "longitude": -73.9855, "station_id": "TSQ01", "gtfs_stops": ["S29", "S30", "S31"]},
@@ -23,104 +20,275 @@ stations = [
     {"name": "Penn Station", "latitude": 40.7505, "longitude": -73.9934, "station_id": "PS01", "gtfs_stops": ["S15", "S16", "S17"]}
 ]#each station is as a dict with: name, latitude, longitude, primary station ID
 
-#configures comprehensive logging 
-def setup_logging():
-    #creates a logger named 'transit_api' to record messages at various levels
-    logger = logging.getLogger('transit_api')
-    logger.setLevel(logging.DEBUG)
-
-    #console handler, will show log in console
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    console_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    console_handler.setFormatter(console_formatter)
-    logger.addHandler(console_handler)
-
-    #file handler, shows logs in transit_api.log 
-    file_handler = RotatingFileHandler('transit_api.log', maxBytes=10*1024*1024, backupCount=5)
-    file_handler.setLevel(logging.DEBUG)
-    file_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(file_formatter)
-    logger.addHandler(file_handler)
-
-    return logger
-
-load_dotenv()  #load environment variables from .env file
-
-app = Flask(__name__) #starts web application
-
-#setup logging
-logger = setup_logging()
-
-
-# Read subway API URLs from .env and split into a list
-SUBWAY_API_URLS = os.getenv('SUBWAY_API_URLS').split(',')
-
-BUS_API_KEY = os.getenv('BUS_API_KEY')
-
-#initialize Nominatim geocoder. Object used to convert coordinates into addresses and find the nearest stations
-geolocator = Nominatim(user_agent="my_geocoder")
-
-@app.route('/api/transit', methods=['POST']) #triggered when a POST request is made to the /api/transit endpoint
+#configured by create_app(), importing this module starts no threads and opens no files
+logger = logging.getLogger('transit_api')
+
+api = Blueprint('transit', __name__) #the API routes, registered on every app create_app() builds
+
+#builds the Flask app. Nothing slow happens here: no network calls, no data files, config comes from
+#the environment (.env) with `config` entries taking precedence. Call warm_up() before taking traffic.
+#Logging is set up with the LOG_* settings unless configure_logging is False or it already is
+def create_app(config=None, configure_logging=True):
+    started = time.perf_counter()
+    if configure_logging:
+        setup_logging()
+    app = Flask(__name__) #starts web application
+    app.config.update(load_config(config))
+    services = TransitServices(app.config, stations)
+    app.extensions['transit'] = services
+    app.register_blueprint(api)
+    services.timings['create_app'] = time.perf_counter() - started
+    return app
+
+#gets a created app ready for traffic: station index built, feeds fetched once, polling started. Sets
+#up logging if nothing did yet (ex: the module-level app)
+def warm_up(app, start_polling=True):
+    setup_logging()
+    timings = app.extensions['transit'].warm_up(start_polling)
+    logger.info("Warm-up finished in %.2fs", timings['warm_up'])
+    return timings
+
+#services of the app handling the current request, or of the module-level app outside of one
+def get_services():
+    return (current_app if has_app_context() else app).extensions['transit']
+
+#every request is timed per endpoint; one sending the profile header gets a stage breakdown
+@api.before_request
+def start_request_timer():
+    g.started = time.perf_counter()
+    g.profile = Profile() if request.headers.get(PROFILE_HEADER) else None
+
+@api.after_request
+def record_request(response):
+    elapsed = time.perf_counter() - g.started
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics = get_services().metrics
+    metrics.requests.observe(elapsed, endpoint)
+    metrics.responses.inc(endpoint, str(response.status_code))
+    if g.profile is not None:
+        g.profile.add('total', elapsed)
+        response.headers['Server-Timing'] = g.profile.server_timing()
+    return response
+
+#Prometheus scrape endpoint
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    return current_app.response_class(get_services().metrics.render(), mimetype=CONTENT_TYPE)
+
+@api.route('/api/transit', methods=['POST']) #triggered when a POST request is made to the /api/transit endpoint
 def get_transit_schedules(): #processes input data, coordinates, station IDs, returns transit schedules
-    logger.info("Received transit schedule request")
-    
+    logger.debug("Received transit schedule request")
+    services = get_services()
+    #allow_stale overrides FEED_STALE_POLICY for this request
+    answer = answer_queries([request.json], default_allow_stale(services), services, g.profile)[0]
+    return send_answer(answer, services)
+
+#many origin/destination pairs in one call, ex: a dashboard polling dozens of station pairs. Body:
+#{"queries": [{"coordinates": ..., "origin_station_id": ..., "destination_station_id": ...}, ...]},
+#answered from one set of feed snapshots; results come back in query order, each with its own status
+@api.route('/api/transit/batch', methods=['POST'])
+def get_transit_schedules_batch():
+    services = get_services()
     data = request.json
+    queries = data.get('queries') if isinstance(data, dict) else None
+    if not isinstance(queries, list) or not queries:
+        return jsonify({"error": "queries must be a non-empty list"}), 400
+    if len(queries) > services.config['MAX_BATCH_QUERIES']:
+        return jsonify({"error": f"At most {services.config['MAX_BATCH_QUERIES']} queries per batch"}), 400
+    logger.debug("Received batch of %s transit queries", len(queries))
+
+    answers = answer_queries(queries, bool(data.get('allow_stale', default_allow_stale(services))), services, g.profile)
+    with services.metrics.stage('etag', g.profile):
+        payload = {"results": [dict(answer.payload, status=answer.status) for answer in answers]}
+        etag = etag_for(payload)
+    return send_answer(Answer(200, payload, etag, min(answer.max_age for answer in answers)), services)
+
+#request default for allow_stale, from FEED_STALE_POLICY
+def default_allow_stale(services):
+    return services.config['FEED_STALE_POLICY'] != 'fail'
+
+#JSON answer with its caching headers. A client sending the answer's ETag back in If-None-Match gets
+#304 Not Modified without a body
+def send_answer(answer, services):
+    with services.metrics.stage('serialize', g.profile):
+        if answer.etag is None: #errors aren't cacheable
+            return jsonify(answer.payload), answer.status
+        if answer.etag in request.if_none_match:
+            response = current_app.response_class(status=304)
+        else:
+            response = jsonify(answer.payload)
+            response.status_code = answer.status
+    response.set_etag(answer.etag)
+    response.headers['Cache-Control'] = f"max-age={answer.max_age}" if answer.max_age else "no-cache"
+    return response
+
+#request body of one query -> dict with the parsed coordinates, raises ValueError with the message for the client
+def parse_query(data, allow_stale):
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object")
     coordinates = data.get('coordinates')
     origin_station_id = data.get('origin_station_id')
     destination_station_id = data.get('destination_station_id')
     #here we extract coordinates, origin_station_id, and destination_station_id from the request data
 
-    logger.debug(f"Request details - Origin: {origin_station_id}, Destination: {destination_station_id}, Coordinates: {coordinates}")
+    logger.debug("Request details - Origin: %s, Destination: %s, Coordinates: %s", origin_station_id, destination_station_id, coordinates)
 
     if not coordinates: #didn't provide coordinates 
         logger.error("Coordinates are required")
-        return jsonify({"error": "Coordinates are required"}), 400 #logs error, 400 is bad req
+        raise ValueError("Coordinates are required") #400, bad req
 
     try:
         latitude = float(coordinates.get('latitude'))
         longitude = float(coordinates.get('longitude'))
-    except (ValueError, TypeError):
-        logger.error(f"Invalid coordinates format: {coordinates}")
-        return jsonify({"error": "Invalid coordinates format"}), 400
-
+    except (ValueError, TypeError, AttributeError):
+        logger.error("Invalid coordinates format: %s", coordinates)
+        raise ValueError("Invalid coordinates format")
+    return {"latitude": latitude, "longitude": longitude,
+            "origin_station_id": str(origin_station_id) if origin_station_id else None,
+            "destination_station_id": str(destination_station_id) if destination_station_id else None,
+            "allow_stale": bool(data.get('allow_stale', allow_stale))}
+
+#origin and destination station of a query, the nearest ones when not given
+def resolve_stations(query, services, profile=None):
+    latitude, longitude = query['latitude'], query['longitude']
+    metrics = services.metrics
     #if origin_station_id or destination_station_id is not provided, call find_closest_station() to find nearest stations based on the coordinates
-    #find closest stations if not provided
-    if not origin_station_id:
-        closest_origin_station_id = find_closest_station(latitude, longitude)
+    if not query['origin_station_id']:
+        #the gazetteer knows when the coordinates are at a station (no remote call), otherwise nearest station
+        with metrics.stage('geocode', profile):
+            station = services.geocoder.station_for(latitude, longitude, extract=extract_station_id)
+        if station:
+            closest_origin_station_id = station['station_id']
+        else:
+            with metrics.stage('closest_station', profile):
+                closest_origin_station_id = find_closest_station(latitude, longitude, services=services)
     else:
-        closest_origin_station_id = origin_station_id
+        closest_origin_station_id = query['origin_station_id']
 
-    if not destination_station_id:
+    if not query['destination_station_id']:
         #exclude_stations makes sure origin station isn't used as destination
-        closest_destination_station_id = find_closest_station(latitude, longitude, exclude_station=closest_origin_station_id)
+        with metrics.stage('closest_station', profile):
+            closest_destination_station_id = find_closest_station(latitude, longitude, exclude_station=closest_origin_station_id, services=services)
     else:
-        closest_destination_station_id = destination_station_id
-
-    logger.debug(f"Closest stations - Origin: {closest_origin_station_id}, Destination: {closest_destination_station_id}")
-
-    # Fetch subway data
-    logger.info("Fetching subway data")
-    #get rt subway schedules
-    subway_data = get_subway_data(closest_origin_station_id, closest_destination_station_id)
-    
-    logger.info("Fetching bus data")
-    #get rt bus schedules
-    bus_data = get_bus_data()
-
-    logger.info("Fetching LIRR data")
-    #get LIRR and Metro N data
-    lirr_data = get_lirr_data()
-
-    logger.info("Fetching Metro North data")
-    #get Metro N data
-    metro_north_data = get_metro_north_data()
+        closest_destination_station_id = query['destination_station_id']
+
+    logger.debug("Closest stations - Origin: %s, Destination: %s", closest_origin_station_id, closest_destination_station_id)
+    return closest_origin_station_id, closest_destination_station_id
+
+#modes that call out to the network, the others read feed snapshots and the timetable in memory
+UPSTREAM_MODES = ("bus",)
+
+#the subway, bus, LIRR and Metro North lookups of one query, plus journey planning when there is a
+#timetable, as calls for Fetcher.run_all / run_inline. services and the feed view are passed along
+#explicitly, the pool threads have no app context
+def mode_calls(query, origin, destination, view, services):
+    latitude, longitude, allow_stale = query['latitude'], query['longitude'], query['allow_stale']
+    calls = {
+        "subway": lambda: get_subway_data(origin, destination, allow_stale, services, view),
+        "bus": lambda: get_bus_data(latitude, longitude, destination, services),
+        "lirr": lambda: get_lirr_data(origin, destination, allow_stale, services, view),
+        "metro_north": lambda: get_metro_north_data(origin, destination, allow_stale, services, view),
+    }
+    if services.journey_planner is not None:
+        calls["journeys"] = lambda: get_journeys(origin, destination, services, view)
+    return calls
+
+#answers queries (request bodies) against one view of the feed store. Answers come from the response
+#cache when the same query was answered on the same feed versions; the rest get all their modes, of
+#every query at once, in a single fan-out, so a slow mode only costs its own time. Identical queries
+#are computed once. Returns one Answer per query, in order. Stage times go to the metrics and `profile`
+def answer_queries(queries, allow_stale, services, profile=None):
+    feed_store, cache, metrics = services.feed_store, services.response_cache, services.metrics
+    view = feed_store.view() #one consistent set of snapshots for every query
+    versions = feed_store.versions(view)
+    answers = [None] * len(queries)
+    pending = {} #cache key -> (query, indexes of the queries asking it)
+    for i, data in enumerate(queries):
+        try:
+            with metrics.stage('parse', profile):
+                query = parse_query(data, allow_stale)
+        except ValueError as e:
+            answers[i] = Answer(400, {"error": str(e)}, None, 0)
+            continue
+        key = response_key(query, versions, services.config['GEOCODER_PRECISION'])
+        if key in pending:
+            pending[key][1].append(i)
+            continue
+        if not query['allow_stale']: #a feed is behind and the caller asked not to get stale data, fail fast
+            stale = [snapshot for snapshot in view.values() if feed_store.is_stale(snapshot)]
+            if stale:
+                error = StaleFeedError(stale[0].name, feed_store.age(stale[0]))
+                logger.warning("Refusing stale data: %s", error)
+                answers[i] = Answer(503, {"error": str(error)}, None, 0)
+                continue
+        with metrics.stage('cache', profile):
+            cached = cache.get(key)
+        if cached is not None:
+            logger.debug("Cached answer for %s -> %s", query['origin_station_id'], query['destination_station_id'])
+            answers[i] = Answer(200, cached.payload, cached.etag, cache.max_age(cached))
+            continue
+        pending[key] = (query, [i])
+
+    #bus calls of every query go out at once on the fetcher, subway, LIRR, Metro N and journeys are
+    #matched on this thread meanwhile. anything that fails or misses REQUEST_DEADLINE is reported in
+    #"errors" and the rest is still returned
+    upstream, local, stations, modes = {}, {}, {}, {}
+    for n, (key, (query, _)) in enumerate(pending.items()):
+        stations[key] = resolve_stations(query, services, profile)
+        query_calls = mode_calls(query, *stations[key], view, services)
+        modes[key] = list(query_calls)
+        for mode, call in query_calls.items():
+            (upstream if mode in UPSTREAM_MODES else local)[f"{mode}:{n}" if len(pending) > 1 else mode] = call
+    results = {}
+    if upstream or local:
+        logger.debug("Fetching subway, bus, LIRR and Metro North data for %s queries", len(pending))
+        batch = services.fetcher.submit_all(upstream)
+        results.update(run_inline(local))
+        results.update(services.fetcher.collect(batch))
+
+    for n, (key, (query, indexes)) in enumerate(pending.items()):
+        query_results = {mode: results[f"{mode}:{n}" if len(pending) > 1 else mode] for mode in modes[key]}
+        for mode, result in query_results.items(): #each mode's own time
+            metrics.record_stage(mode, result.elapsed, profile)
+            if not result.ok:
+                metrics.upstream_failure(mode, result.error)
+        with metrics.stage('build', profile):
+            status, payload, cacheable = build_response(query_results, *stations[key])
+        if status != 200:
+            answer = Answer(status, payload, None, 0)
+        elif cacheable:
+            cached = cache.put(key, payload)
+            answer = Answer(200, payload, cached.etag, cache.max_age(cached))
+        else: #a mode failed or timed out, the next request should try again
+            answer = Answer(200, payload, etag_for(payload), 0)
+        for i in indexes:
+            answers[i] = answer
+    return answers
+
+#FetchResults of the modes of one query -> (HTTP status, response body, whether it can be cached)
+def build_response(results, closest_origin_station_id, closest_destination_station_id):
+    errors = {}
+    cacheable = True
+    for mode, result in results.items():
+        if isinstance(result.exception, StaleFeedError): #a feed went stale since the check, fail fast
+            logger.warning("Refusing stale data: %s", result.exception)
+            return 503, {"error": str(result.exception)}, False
+        if not result.ok:
+            errors[mode] = result.error
+            cacheable = False
+        elif result.value is None: #helper ran but had nothing to serve (feed not fetched yet, no BUS_API_KEY)
+            errors[mode] = "unavailable"
+
+    subway_data = results["subway"].value or []
+    bus_data = results["bus"].value
+    lirr_data = results["lirr"].value
+    metro_north_data = results["metro_north"].value
 
     #initialize the response list
     next_schedules = []
 
     # process subway data
-    logger.info(f"Processing {len(subway_data)} subway schedules")
+    logger.debug("Processing %s subway schedules", len(subway_data))
     for subway in subway_data:
         next_schedules.append({
             "transit_mode": "subway",
@@ -129,14 +297,13 @@ def get_transit_schedules(): #processes input data, coordinates, station IDs, re
         })
 
     #process bus data
-    logger.info("Processing bus data")
-    for bus in bus_data.get('schedules', []):
-        if bus['origin_station_id'] == closest_origin_station_id and bus['destination_station_id'] == closest_destination_station_id:
-            next_schedules.append({
-                "transit_mode": "bus",
-                "eta_origin": bus['eta_origin'],
-                "eta_destination": bus['eta_destination']
-            })
+    logger.debug("Processing bus data")
+    for bus in (bus_data or {}).get('schedules', []): #already limited to buses between origin and destination
+        next_schedules.append({
+            "transit_mode": "bus",
+            "eta_origin": bus['eta_origin'],
+            "eta_destination": bus['eta_destination']
+        })
 
     #process LIRR data
     if lirr_data:
@@ -161,30 +328,22 @@ def get_transit_schedules(): #processes input data, coordinates, station IDs, re
     response = {
         "next_schedules": next_schedules
     }
+    if "journeys" in results and results["journeys"].value is not None: #itineraries with transfers, see get_journeys
+        response["journeys"] = results["journeys"].value
+    if errors: #per-mode error markers, ex: {"bus": "timeout"}
+        response["errors"] = errors
 
-    logger.info(f"Returning {len(next_schedules)} transit schedules")
-    return jsonify(response) #puts schedules into JSON resp and sends back
+    #one structured line per answer computed, the details above are debug output
+    logger.info("Returning %s transit schedules", len(next_schedules),
+                extra={"origin": closest_origin_station_id, "destination": closest_destination_station_id, "errors": errors})
+    return 200, response, cacheable
 
 #helper func, finds closest station to the given coordinates
-def find_closest_station(latitude, longitude, exclude_station=None):
-    closest_station = None
-    min_distance = float('inf')  #initialize with a large value, any dist will be smaller than this
-    #used to keep track of the closest station and distance
-
-    #iterate through stations list, calculate distance between each station and provided coordinates using geopy.distance.distance()
-    for station in stations:
-        #skip the excluded station (default is None) if provided
-        if exclude_station and station['station_id'] == exclude_station: #if exclude_station provided. Skips over current startion
-            continue
-
-        #create tuples because the func expects two tuples
-        station_coords = (station['latitude'], station['longitude'])
-        user_coords = (latitude, longitude)
-        
-        distance = geopy.distance.distance(user_coords, station_coords).km #find distance between and store in km
-        if distance < min_distance: #is current dist less than mindistance? 
-            min_distance = distance
-            closest_station = station #update to current closest station
+def find_closest_station(latitude, longitude, exclude_station=None, services=None):
+    #KD-tree lookup in the station registry, the excluded station (default is None) is skipped during the search
+    exclude = [exclude_station] if exclude_station else []
+    matches = (services or get_services()).station_registry.nearest(latitude, longitude, k=1, exclude=exclude)
+    closest_station = matches[0][1] if matches else None
     
     if closest_station:
         return closest_station['station_id'] #if found, return id
@@ -195,14 +354,14 @@ def find_closest_station(latitude, longitude, exclude_station=None):
 
 #for extracting station ID from address
 def extract_station_id(address):
-    logger.debug(f"Extracting station ID from address: {address}")
+    logger.debug("Extracting station ID from address: %s", address)
     #look for common station keywords in the address
     station_keywords = ["Station", "Subway", "Train", "Metro"]
     for keyword in station_keywords:
         if keyword in address:
             #if keyword found, extract part of the address before the keyword as station ID, else return None
             station_id = address.split(keyword)[0].strip()
-            logger.info(f"Extracted station ID: {station_id}")
+            logger.info("Extracted station ID: %s", station_id)
             return station_id
     logger.warning("No station found in address")
     return None
@@ -211,156 +370,146 @@ def extract_station_id(address):
 #tell the system which stops are relevant to certain station, stops that a service will pass through
 #to identify routes from origin_station_id -> destination_station_id, need to know stops corresponding to stations
 #using these stop patterns, identify if subway trip involves origin and destination stations
-def get_gtfs_stops_for_station(station_id): #get stop pattern for input station
-    for station in stations:
-        #loop through stations, if station_id matches or is substring of station's ID
-        if station_id == station['station_id'] or station_id in station.get('alternative_ids', []):
-            return station.get('gtfs_stops', []) #return stop patterns for station 
+def get_gtfs_stops_for_station(station_id, services=None): #get stop pattern for input station
+    #registry lookup by station ID or one of its alternative IDs
+    station = (services or get_services()).station_registry.get(station_id)
+    if station:
+        return station.get('gtfs_stops', []) #return stop patterns for station 
     return [] #return list of stops
 
-def get_subway_data(origin_station_id, destination_station_id): #gets subway scheds
-    subway_data = [] #will hold final result
-    logger.info(f"Searching for subway routes between {origin_station_id} and {destination_station_id}")
+#returns the newest snapshot of a feed, or None if it hasn't been fetched yet.
+#raises StaleFeedError when the snapshot is too old and allow_stale is False
+def get_feed_snapshot(name, allow_stale=True, view=None, services=None):
+    try:
+        return (services or get_services()).feed_store.get(name, allow_stale=allow_stale, view=view)
+    except StaleFeedError:
+        raise
+    except FeedUnavailableError as e:
+        logger.warning("%s", e)
+        return None
 
-    #get GTFS stop patterns for each station
-    origin_stops = get_gtfs_stops_for_station(origin_station_id)
-    destination_stops = get_gtfs_stops_for_station(destination_station_id)
+#shared by subway, LIRR and Metro North: the next departures from origin to destination station
+#across every feed of the agency, as response entries sorted by departure. view is the feed store
+#view to read, the current one by default
+def get_rail_data(agency, origin_station_id, destination_station_id, allow_stale=True, services=None, now=None, view=None):
+    services = services or get_services()
+    logger.debug("Searching for %s trips between %s and %s", agency, origin_station_id, destination_station_id)
+
+    #the agency's GTFS stop ids for each station, co-located stations of the agency included
+    registry, radius_km = services.station_registry, services.config['STATION_TRANSFER_RADIUS_KM']
+    origin_stops = stops_for_agency(registry, origin_station_id, agency, radius_km) if origin_station_id else []
+    destination_stops = stops_for_agency(registry, destination_station_id, agency, radius_km) if destination_station_id else []
+    logger.debug("%s stops - Origin: %s, Destination: %s", agency, origin_stops, destination_stops)
+
+    feed_store = services.feed_store
+    view = feed_store.view() if view is None else view #one consistent set of snapshots for the whole request
+    snapshots = []
+    for config in feed_store.configs(agency): #every feed of the agency, ex: all subway lines
+        snapshot = get_feed_snapshot(config.name, allow_stale, view, services)
+        if snapshot is not None:
+            snapshots.append(snapshot)
+    #scheduled departures fill in trips the realtime feeds leave out, or everything while they're down
+    timetable = services.timetable.get(agency) if services.timetable is not None else None
+    if not snapshots and timetable is None: #nothing fetched yet
+        return None
 
-    #logging for debugging
-    logger.info(f"Origin stop patterns: {origin_stops}")
-    logger.info(f"Destination stop patterns: {destination_stops}")
+    now = time.time() if now is None else now
+    limit = services.config['MAX_SCHEDULES']
+    with services.metrics.stage('match'):
+        departures = find_departures(snapshots, origin_stops, destination_stops, now, limit)
+        if timetable is not None:
+            #realtime delays laid over the schedule, trips already past the origin left out
+            scheduled = timetable.find_departures(origin_stops, destination_stops, now, now + services.config['TIMETABLE_HORIZON'],
+                                                  limit, timetable.overlay(snapshots, now))
+            departures = merge_departures(departures, scheduled, limit, realtime_trip_key)
+    logger.debug("Found %s %s trips", len(departures), agency)
+    rail_schedules = []
+    for departure in departures:
+        #per-trip detail, rate-limited per message by the logging setup
+        logger.debug("Matched %s trip %s (route %s): %s -> %s", agency, departure.trip_id, departure.route_id,
+                     departure.origin_stop, departure.destination_stop)
+        rail_schedules.append({
+            "transit_mode": agency,
+            "eta_origin": datetime.datetime.fromtimestamp(departure.departure).strftime('%Y-%m-%d %H:%M:%S'), #converts timestamp into a human readable date+time
+            "eta_destination": datetime.datetime.fromtimestamp(departure.arrival).strftime('%Y-%m-%d %H:%M:%S')
+        })
+    return rail_schedules
 
-    for url in SUBWAY_API_URLS: #loop over subway feed 
-        try:
-            response = requests.get(url) #send get req to get subway data
-            if response.status_code == 200: #200 means success 
-                feed = gtfs_realtime_pb2.FeedMessage() 
-                feed.ParseFromString(response.content) #decode the raw rt feed into readable data with func
-
-                for entity in feed.entity:
-                    if entity.HasField('trip_update'): #trip_update has updates on subway
-                        trip_update = entity.trip_update
-                        stop_time_updates = trip_update.stop_time_update #list of stop updates
-                        
-                        for origin_idx, origin_stop in enumerate(stop_time_updates):
-                            #if stop ID in origin_stops match that of stop ID in stop_time_updates, subway passes through origin. Any stop ID of origin matches current
-                            origin_match = any(stop_pattern in origin_stop.stop_id for stop_pattern in origin_stops)
-                            
-                            #once origin stop matched, look for dest stop
-                            #look at all next stops after origin stop
-                            if origin_match:
-                                for dest_idx, dest_stop in enumerate(stop_time_updates[origin_idx+1:], start=origin_idx+1):
-                                    dest_match = any(stop_pattern in dest_stop.stop_id for stop_pattern in destination_stops)
-                                    
-                                    #if both match, get arrival time for both 
-                                    if dest_match:
-                                        try:
-                                            origin_time = origin_stop.arrival.time if origin_stop.HasField('arrival') else None
-                                            dest_time = dest_stop.arrival.time if dest_stop.HasField('arrival') else None
-                                            
-                                            #when you get both times, create a fict with required result info  
-                                            if origin_time and dest_time:
-                                                subway_data.append({ #append info to have multiple options
-                                                    "transit_mode": "subway",
-                                                    "eta_origin": datetime.datetime.fromtimestamp(origin_time).strftime('%Y-%m-%d %H:%M:%S'),
-                                                    "eta_destination": datetime.datetime.fromtimestamp(dest_time).strftime('%Y-%m-%d %H:%M:%S')
-                                                })
-                                        except Exception as time_error: #error handling: if error faced in processing times, log it
-                                            logger.error(f"Time parsing error: {time_error}")
-                        
-        except Exception as e: #error handling: any error when processing url, like invalid data, log it
-            logger.error(f"Error processing {url}: {e}") 
-
-    logger.info(f"Found {len(subway_data)} subway routes") #log # of routes 
-    return subway_data #return list with scheds
-
-
-def get_bus_data():
-    bus_api_url = "https://bustime.mta.info/api/where/routes-for-agency/MTA%20NYCT.json"
-    api_key = os.getenv('BUS_API_KEY') #getting key from .env
-
-    logger.info("Fetching bus routes")
-
-    # Add the API key as a query parameter
-    response = requests.get(f"{bus_api_url}?key={api_key}") #send get req to bus endpt. How key is passed to api
-    
-    if response.status_code == 200: #if success 
-        try:
-            bus_data = response.json() #parse json resp, convert it into python dict
-            logger.info(f"Retrieved bus data successfully")
-            return bus_data #has route info
-        except ValueError: #error handling: issue parsing data, ex html format
-            logger.error(f"Invalid JSON response from {bus_api_url}")
-            return None
-    else: #other failure 
-        logger.error(f"Failed to fetch bus data, Status code: {response.status_code}")
-        return None
+def get_subway_data(origin_station_id, destination_station_id, allow_stale=True, services=None, view=None): #gets subway scheds
+    return get_rail_data('subway', origin_station_id, destination_station_id, allow_stale, services, view=view) or [] #list with scheds
 
-# Read LIRR and Metro North API URLs from .env
-LIRR_API_URL = os.getenv('LIRR_API_URL')
-METRO_NORTH_API_URL = os.getenv('METRO_NORTH_API_URL')
 
-def get_lirr_data():
-    logger.info("Fetching LIRR data") 
-    try:
-        response = requests.get(LIRR_API_URL) #sends GET request URL, endpoint
-        if response.status_code == 200: #if success
-            feed = gtfs_realtime_pb2.FeedMessage()
-            feed.ParseFromString(response.content) #takes raw resp content, converts it into structured object, feed
-            
-            lirr_schedules = []
-            for entity in feed.entity: #loop through each entity in feed.entity collection
-                if entity.HasField('trip_update'): #if has field trip_update, entity is related to train trip update
-                    #store in trip_update
-                    trip_update = entity.trip_update
-            return {"schedules": lirr_schedules} #lirr_schedules list returned as a dict 
-        else: #not success, then log error
-            logger.error(f"Failed to fetch LIRR data, Status code: {response.status_code}")
-            return None
-    except Exception as e: #log exceptions
-        logger.error(f"LIRR data fetch error: {e}")
+#buses from the stops near the coordinates that later reach a stop near the destination station.
+#Only the few nearby stops are asked (SIRI StopMonitoring), through a short-lived cache
+def get_bus_data(latitude, longitude, destination_station_id=None, services=None):
+    services = services or get_services()
+    bus_service = services.bus_service
+    if bus_service is None: #no BUS_API_KEY configured
+        logger.warning("Bus data unavailable: BUS_API_KEY is not set")
         return None
 
-def get_metro_north_data():
-    logger.info("Fetching Metro North data")
-    try:
-        response = requests.get(METRO_NORTH_API_URL) #send GET req to api endpt
-        if response.status_code == 200: #if success 
-            feed = gtfs_realtime_pb2.FeedMessage()
-            feed.ParseFromString(response.content) #parse to convert raw binary response into a structured feed object
-            
-            metro_north_schedules = []
-            for entity in feed.entity: #loop over feed.entity
-                if entity.HasField('trip_update'): #entity contains trip_update data, extract trip_update and stop_time_update
-                    trip_update = entity.trip_update
-                    stop_time_updates = trip_update.stop_time_update
-                    
-                    #loops over each stop_time_update, compares every pair of origin and destination stp
-                    for origin_idx, origin_stop in enumerate(stop_time_updates): #iterating over origin_stop
-                        for dest_idx, dest_stop in enumerate(stop_time_updates[origin_idx+1:], start=origin_idx+1): #iterating over dest_stop
-                            try:
-                                #extract arrival time for origin_stop and dest_stop
-                                origin_time = origin_stop.arrival.time if origin_stop.HasField('arrival') else None
-                                dest_time = dest_stop.arrival.time if dest_stop.HasField('arrival') else None
-                                
-                                if origin_time and dest_time: #if success for both 
-                                    metro_north_schedules.append({ #append for multiple sched
-                                        "transit_mode": "metro_north",
-                                        "eta_origin": datetime.datetime.fromtimestamp(origin_time).strftime('%Y-%m-%d %H:%M:%S'), #converts timestamp into a human readable date+time 
-                                        "eta_destination": datetime.datetime.fromtimestamp(dest_time).strftime('%Y-%m-%d %H:%M:%S')
-                                    })
-                            except Exception as time_error: #error handling: ex, invalid timestamp, log it
-                                logger.error(f"Metro North time parsing error: {time_error}")
-            
-            return {"schedules": metro_north_schedules} #returns dict w key schedules
-        else: #no success, log it
-            logger.error(f"Failed to fetch Metro North data, Status code: {response.status_code}")
-            return None
-    except Exception as e: #log exceptions, ex parsing error
-        logger.error(f"Metro North data fetch error: {e}")
+    logger.debug("Fetching bus arrivals")
+    station = services.station_registry.get(destination_station_id) if destination_station_id else None
+    destination = (station['latitude'], station['longitude']) if station else None
+    departures = bus_service.departures(latitude, longitude, destination, limit=services.config['MAX_SCHEDULES'])
+    if departures is None: #the stop catalogue is still loading in the background
+        logger.warning("Bus data unavailable: bus stop catalogue not loaded yet")
         return None
-
+    bus_schedules = []
+    for origin, arrival in departures:
+        bus_schedules.append({
+            "transit_mode": "bus",
+            "route": origin.route,
+            "eta_origin": datetime.datetime.fromtimestamp(origin.expected).strftime('%Y-%m-%d %H:%M:%S'),
+            "eta_destination": datetime.datetime.fromtimestamp(arrival.expected).strftime('%Y-%m-%d %H:%M:%S') if arrival else None
+        })
+    logger.debug("Found %s buses", len(bus_schedules))
+    return {"schedules": bus_schedules}
+
+def get_lirr_data(origin_station_id=None, destination_station_id=None, allow_stale=True, services=None, view=None):
+    logger.debug("Fetching LIRR data")
+    schedules = get_rail_data('lirr', origin_station_id, destination_station_id, allow_stale, services, view=view)
+    return None if schedules is None else {"schedules": schedules} #None while the feed hasn't been fetched
+
+def get_metro_north_data(origin_station_id=None, destination_station_id=None, allow_stale=True, services=None, view=None):
+    logger.debug("Fetching Metro North data")
+    schedules = get_rail_data('metro_north', origin_station_id, destination_station_id, allow_stale, services, view=view)
+    return None if schedules is None else {"schedules": schedules}
+
+
+#Pareto-optimal journeys from origin to destination station leaving now: the fastest one for each number
+#of transfers, fewest transfers first, across subway, LIRR and Metro North with realtime delays
+def get_journeys(origin_station_id, destination_station_id, services=None, view=None, now=None):
+    services = services or get_services()
+    planner = services.journey_planner
+    if planner is None or not origin_station_id or not destination_station_id:
+        return None
+    now = time.time() if now is None else now
+    journeys = planner.plan(origin_station_id, destination_station_id, now, services.journey_snapshots(view))
+    if journeys is None: #the network is being built in the background
+        logger.warning("Journeys unavailable: journey network not built yet")
+        return None
+    logger.debug("Planned %s journeys between %s and %s", len(journeys), origin_station_id, destination_station_id)
+    return [{
+        "eta_origin": datetime.datetime.fromtimestamp(journey.departure).strftime('%Y-%m-%d %H:%M:%S'),
+        "eta_destination": datetime.datetime.fromtimestamp(journey.arrival).strftime('%Y-%m-%d %H:%M:%S'),
+        "transfers": journey.transfers,
+        "legs": [{
+            "transit_mode": leg.mode,
+            "route": leg.route_id,
+            "origin_stop": leg.origin_stop,
+            "destination_stop": leg.destination_stop,
+            "eta_origin": datetime.datetime.fromtimestamp(leg.departure).strftime('%Y-%m-%d %H:%M:%S'),
+            "eta_destination": datetime.datetime.fromtimestamp(leg.arrival).strftime('%Y-%m-%d %H:%M:%S'),
+        } for leg in journey.legs],
+    } for journey in journeys]
+
+
+#module-level app for `flask run`, tests and imports. Creating it is cheap and makes no network calls,
+#logging waits for warm_up() or the process's own setup
+app = create_app(configure_logging=False)
 
 if __name__ == '__main__': #runs when script is run directly 
     logger.info("Starting Transit API application")
-    app.run(debug=True) #runs Flask server w debug mode
+    warm_up(app) #fill the feed store and station index before taking requests, then keep polling in the background
+    app.run(debug=True, use_reloader=False) #runs Flask server w debug mode, reloader would start a second poller
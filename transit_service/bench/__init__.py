@@ -0,0 +1,23 @@
+#benchmarks, run each one from the repo root, ex: python -m transit_service.bench.bench_stop_index
+import statistics
+import time
+
+
+#runs fn `number` times per round for `repeat` rounds, returns the median time of one call in ms
+def measure(fn, number=10, repeat=5):
+    rounds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        rounds.append((time.perf_counter() - started) / number)
+    return statistics.median(rounds) * 1000
+
+
+#prints rows of (label, value...) as an aligned table
+def report(title, header, rows):
+    print(title)
+    widths = [max(len(str(cell)) for cell in column) for column in zip(header, *rows)]
+    for row in [header] + rows:
+        print("  ".join(str(cell).ljust(width) for cell, width in zip(row, widths)))
+    print()
@@ -0,0 +1,92 @@
+#decoding feeds: full gtfs_realtime_pb2 parse + StopIndex (what the poller used to do) against the
+#projected decoder + columnar index, CPU time per feed version and memory held per retained snapshot.
+#Runs on synthetic feeds at ACE/BDFM scale and 10x, or on recorded payloads passed as arguments:
+#python -m transit_service.bench.bench_decoding feeds/gtfs-ace.pb feeds/lirr.pb
+import gc
+import os
+import sys
+
+from . import measure, report
+from ..decoding import decode_trip_updates
+from ..feeds import decode_feed
+from ..stop_index import StopEvent, StopIndex, base_stop_id
+from ..testing import make_synthetic_feed
+
+T = 1700000000
+RETAINED = 50 #snapshots held at once for the memory measurement
+
+
+#resident set size in bytes, None where /proc isn't available
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+#bytes of RSS one retained snapshot of the payload costs, averaged over RETAINED copies
+def retained_bytes(build, payload):
+    gc.collect()
+    before = rss_bytes()
+    held = [build(payload) for _ in range(RETAINED)]
+    gc.collect()
+    after = rss_bytes()
+    del held
+    return None if before is None else max(0, after - before) / RETAINED
+
+
+#the per-event index StopIndex.from_feed built before the columnar index
+def event_index(feed):
+    trips, stops = [], {}
+    for entity in feed.entity:
+        if not entity.HasField('trip_update'):
+            continue
+        trips.append((entity.trip_update.trip.trip_id, entity.trip_update.trip.route_id))
+        for position, update in enumerate(entity.trip_update.stop_time_update):
+            arrival = update.arrival.time if update.HasField('arrival') else 0
+            departure = update.departure.time if update.HasField('departure') else 0
+            event = StopEvent(len(trips) - 1, position, update.stop_id, arrival, departure)
+            stops.setdefault(base_stop_id(update.stop_id), []).append(event)
+    return trips, stops
+
+
+def full_parse(payload):
+    feed = decode_feed(payload)
+    return feed, event_index(feed)
+
+
+def projected(payload):
+    columns = decode_trip_updates(payload)
+    return columns, StopIndex.from_columns(columns)
+
+
+def payloads(paths):
+    if paths:
+        for path in paths:
+            with open(path, 'rb') as payload_file:
+                yield os.path.basename(path), payload_file.read()
+    else:
+        for trip_count in (130, 1300):
+            yield f"synthetic {trip_count} trips", make_synthetic_feed(T, trip_count=trip_count).SerializeToString()
+
+
+def main(paths):
+    rows = []
+    for label, payload in payloads(paths):
+        full_ms = measure(lambda: full_parse(payload), number=5)
+        projected_ms = measure(lambda: projected(payload), number=5)
+        decode_ms = measure(lambda: decode_trip_updates(payload), number=5)
+        #projected first: pages freed by the bigger full parse would otherwise be reused and hide its cost
+        projected_kb = retained_bytes(projected, payload)
+        full_kb = retained_bytes(full_parse, payload)
+        memory = "n/a" if full_kb is None else f"{full_kb / 1024:.0f} -> {projected_kb / 1024:.0f}"
+        rows.append((label, f"{len(payload) / 1024:.0f}", f"{full_ms:.2f}", f"{projected_ms:.2f}",
+                     f"{decode_ms:.2f}", f"{full_ms / projected_ms:.1f}x", memory))
+    report("feed decode + index per feed version (ms)",
+           ("feed", "payload KB", "full parse + index", "projected + index", "projected decode only", "speedup",
+            "retained KB per snapshot"), rows)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
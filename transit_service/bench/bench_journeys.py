@@ -0,0 +1,147 @@
+#journey planning at the size of the real NYCT subway + LIRR + Metro North timetables: 30 subway lines of
+#30 stops on a grid (about 9k weekday trips, 270k stop_times rows a day, Saturday and Sunday services in
+#the file too), 10 LIRR branches out of Penn Station and 5 Metro North lines out of Grand Central (about
+#750 and 700 weekday trips), with 600 subway trips running late in the realtime feed. Times the cold
+#network build, the rebuild for a new realtime version and the one that moves the window ahead, what
+#the rebuilds cost a worker per hour with 30 s feed versions, and RAPTOR queries between random stations
+import datetime
+import os
+import random
+import tempfile
+import time
+
+from . import report
+from .bench_replay import percentile
+from ..decoding import decode_trip_updates
+from ..feeds import FeedSnapshot
+from ..journeys import DEFAULT_REBUILD_INTERVAL, JourneyPlanner
+from ..stations import StationRegistry
+from ..testing import build_feed, write_gtfs
+from ..timetable import Timetable, build_timetable
+
+GRID = 30 #subway lines run along the even rows and columns of a GRID x GRID grid
+HEADWAYS = {"WK": 480, "SA": 600, "SU": 720} #seconds between subway trips of a line and direction
+RAIL_HEADWAYS = {"lirr": {"WK": 1900, "SA": 3600, "SU": 3600}, "metro_north": {"WK": 1000, "SA": 1800, "SU": 1800}}
+CALENDAR = {"WK": ("1111100", 20260101, 20261231), "SA": ("0000010", 20260101, 20261231), "SU": ("0000001", 20260101, 20261231)}
+FEED_INTERVAL = 30 #seconds between realtime feed versions
+DELAYED_TRIPS = 600
+PAIRS = 300
+
+
+#GTFS clock time of seconds since the start of the service day
+def _clock(seconds):
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+#trips of one line both ways between 05:00 and 01:00 for every service, `hop` seconds between stops
+def _line_trips(route, stops, headways, hop):
+    trips = []
+    for service, headway in headways.items():
+        for direction, ordered in (("N", stops), ("S", stops[::-1])):
+            for run, start in enumerate(range(5 * 3600, 25 * 3600, headway)):
+                times = [start + position * hop for position in range(len(ordered))]
+                trips.append((f"{route}-{service}-{direction}-{run:04d}", route, service,
+                              [(stop + direction, _clock(moment), _clock(moment + 20)) for stop, moment in zip(ordered, times)]))
+    return trips
+
+
+def _position(row, column):
+    return 40.55 + row * 0.01, -74.10 + column * 0.012
+
+
+def synthetic_network():
+    subway, stations = [], []
+    lines = [(f"H{row:02d}", [(row, column) for column in range(GRID)]) for row in range(0, GRID, 2)]
+    lines += [(f"V{column:02d}", [(row, column) for row in range(GRID)]) for column in range(0, GRID, 2)]
+    platforms = {} #grid cell -> stop ids of the lines through it
+    for route, cells in lines:
+        stops = [f"{route}{row if route[0] == 'V' else column:02d}" for row, column in cells]
+        subway += _line_trips(route, stops, HEADWAYS, 100)
+        for cell, stop in zip(cells, stops):
+            platforms.setdefault(cell, []).append(stop)
+    for (row, column), stops in platforms.items():
+        latitude, longitude = _position(row, column)
+        stations.append({"station_id": f"G{row:02d}{column:02d}", "name": f"Grid {row} {column}",
+                         "latitude": latitude, "longitude": longitude, "gtfs_stops": stops})
+
+    #rail stations are 200 m off the grid stations they pass, so changing there is a short walk. Branches
+    #share their trunk stations like the real ones do
+    branches = [("lirr", f"L{k}", [(14, column) for column in range(0, 14, 2)] + [(2 * k, GRID + j) for j in range(5)]) for k in range(10)]
+    branches += [("metro_north", f"M{k}", [(10, 14), (8, 14), (6, 14), (4, 14)] + [(-1 - j, 4 + 5 * k) for j in range(12)]) for k in range(5)]
+    rail, seen = {"lirr": [], "metro_north": []}, set()
+    for agency, route, cells in branches:
+        stops = [f"R{row:+03d}{column:02d}" for row, column in cells]
+        rail[agency] += _line_trips(route, stops, RAIL_HEADWAYS[agency], 240)
+        for (row, column), stop in zip(cells, stops):
+            if (agency, stop) not in seen:
+                seen.add((agency, stop))
+                latitude, longitude = _position(row, column)
+                stations.append({"station_id": f"{agency}:{stop}", "name": stop, "agency": agency,
+                                 "latitude": latitude + 0.0018, "longitude": longitude, "gtfs_stops": [stop]})
+    return subway, rail, stations
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def main():
+    subway, rail, stations = synthetic_network()
+    registry = StationRegistry(stations)
+    with tempfile.TemporaryDirectory() as directory:
+        sources = [("subway", write_gtfs(os.path.join(directory, "subway"), subway, CALENDAR))]
+        sources += [(agency, write_gtfs(os.path.join(directory, agency), trips, CALENDAR)) for agency, trips in rail.items()]
+        output = os.path.join(directory, "timetable.bin")
+        build_timetable(sources, output)
+        timetable = Timetable.open(output)
+
+    planner = JourneyPlanner(timetable, registry)
+    day_start = timetable.get('subway').day_start(datetime.date(2026, 3, 2)) #a Monday
+    now = day_start + 8 * 3600
+    network, cold_seconds = _timed(lambda: planner.warm([], now))
+
+    #a realtime feed with the weekday subway trips running around now 4 minutes late
+    seconds = lambda clock: sum(int(part) * unit for part, unit in zip(clock.split(':'), (3600, 60, 1)))
+    running = [trip for trip in subway if trip[2] == "WK" and now - 5400 <= day_start + seconds(trip[3][0][1]) <= now][:DELAYED_TRIPS]
+    feed = build_feed(now, [(trip_id, route, [(stop, 0, day_start + seconds(departure) + 240) for stop, _, departure in stops])
+                            for trip_id, route, _, stops in running])
+    snapshot = FeedSnapshot("s", "subway", 1, now, now, decode_trip_updates(feed.SerializeToString()), None)
+    timetable.get('subway').trips_for("") #the trip key table is built once per process
+    #what the background rebuilds do: a new realtime version in the same window, then the next window
+    realtime_network, realtime_seconds = _timed(lambda: planner.build([snapshot], now + FEED_INTERVAL, network.start, network.end))
+    _, window_seconds = _timed(lambda: planner.build([snapshot], now + planner.window / 2))
+    planner._install(realtime_network)
+
+    rng = random.Random(0)
+    pairs = [tuple(station['station_id'] for station in rng.sample(stations, 2)) for _ in range(PAIRS)]
+    planner.plan(*pairs[0], now, [snapshot]) #warm
+    timings, found = [], 0
+    for origin, destination in pairs:
+        departure = now + rng.randint(0, 3600)
+        journeys, elapsed = _timed(lambda: planner.plan(origin, destination, departure, [snapshot]))
+        timings.append(elapsed * 1000)
+        found += bool(journeys)
+    timings.sort()
+
+    #each window move every window / 2, plus one realtime rebuild per feed version or per rebuild interval
+    window_moves = 3600 / (planner.window / 2)
+    per_version = 3600 / FEED_INTERVAL * realtime_seconds + window_moves * window_seconds
+    debounced = 3600 / max(FEED_INTERVAL, DEFAULT_REBUILD_INTERVAL) * realtime_seconds + window_moves * window_seconds
+    rows = [
+        ("timetable trips / stop_times rows", f"{len(subway) + sum(map(len, rail.values()))} / {sum(len(trip[3]) for trip in subway + rail['lirr'] + rail['metro_north'])}"),
+        ("network stops / routes / trips in the window", f"{len(network)} / {len(network.route_stops)} / {sum(len(trips) for trips in network.route_trips)}"),
+        ("cold build (warm-up)", f"{cold_seconds * 1000:.0f} ms"),
+        (f"rebuild for a realtime version, {len(running)} delayed trips", f"{realtime_seconds * 1000:.0f} ms"),
+        ("rebuild moving the window ahead", f"{window_seconds * 1000:.0f} ms"),
+        ("rebuild CPU per worker-hour, every version", f"{per_version:.1f} s"),
+        (f"rebuild CPU per worker-hour, every {DEFAULT_REBUILD_INTERVAL} s", f"{debounced:.1f} s"),
+        (f"query p50 / p99 ({PAIRS} random pairs)", f"{percentile(timings, 0.5):.2f} ms / {percentile(timings, 0.99):.2f} ms"),
+        ("pairs with a journey", f"{found} of {PAIRS}"),
+    ]
+    report("Journey planning (RAPTOR), NYCT + LIRR + Metro North timetable size", ("measured", "value"), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#request latency under each logging setup: the old synchronous one (console + rotating file written
+#on the request thread, DEBUG to the file), and the queued JSON setup with LOG_LEVEL=DEBUG and INFO.
+#Requests go through the Flask test client against subway, LIRR and Metro North feeds from a stub server
+import os
+import tempfile
+import time
+
+from . import measure, report
+from ..app import create_app, warm_up
+from ..logs import setup_logging, stop_logging
+from ..testing import StubServer, make_rail_feed, make_synthetic_feed
+
+REQUESTS = 250
+BODY = {"origin_station_id": "CH01", "destination_station_id": "TSQ01", "coordinates": {"latitude": 40.7128, "longitude": -74.0060}}
+
+
+#the setup_logging app.py had before: DEBUG file handler and INFO console handler on the request thread
+def legacy_logging(path, stream):
+    import logging
+    from logging.handlers import RotatingFileHandler
+    stop_logging()
+    logger = logging.getLogger('transit_api')
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    console_handler = logging.StreamHandler(stream)
+    console_handler.setLevel(logging.INFO)
+    file_handler = RotatingFileHandler(path, maxBytes=10 * 1024 * 1024, backupCount=5)
+    file_handler.setLevel(logging.DEBUG)
+    for handler in (console_handler, file_handler):
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+
+
+def main():
+    now = int(time.time())
+    rows = []
+    with StubServer() as server, tempfile.TemporaryDirectory() as directory, open(os.devnull, 'w') as console:
+        setup_logging('INFO', log_file='', force=True, stream=console) #keeps warm-up lines off the table
+        server.route('/feeds/s', make_synthetic_feed(now, trip_count=130, routes="S").SerializeToString())
+        server.route('/feeds/lirr', make_rail_feed(now).SerializeToString())
+        server.route('/feeds/mnr', make_rail_feed(now, trip_count=500, stop_count=100).SerializeToString())
+        app = create_app({"SUBWAY_API_URLS": [server.url('/feeds/s')], "LIRR_API_URL": server.url('/feeds/lirr'),
+                          "METRO_NORTH_API_URL": server.url('/feeds/mnr'), "BUS_API_KEY": ""})
+        warm_up(app, start_polling=False)
+        client = app.test_client()
+        log_path = os.path.join(directory, "api.log")
+        setups = [
+            ("synchronous file + console, DEBUG (before)", lambda: legacy_logging(log_path, console)),
+            ("queued JSON, LOG_LEVEL=DEBUG", lambda: setup_logging('DEBUG', 'json', log_path, force=True, stream=console)),
+            ("queued JSON, LOG_LEVEL=INFO", lambda: setup_logging('INFO', 'json', log_path, force=True, stream=console)),
+        ]
+        for label, configure in setups:
+            configure()
+            client.post('/api/transit', json=BODY) #warm
+            start_size = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+            request_ms = measure(lambda: client.post('/api/transit', json=BODY), number=REQUESTS // 5, repeat=5)
+            stop_logging() #flush what's queued before measuring the file
+            written = (os.path.getsize(log_path) - start_size) / REQUESTS
+            rows.append((label, f"{request_ms:.2f}", f"{written:.0f}"))
+        app.extensions['transit'].close()
+    setup_logging(force=True)
+    report("POST /api/transit latency per logging setup", ("logging", "ms per request", "log bytes per request"), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#what the instrumentation costs: one timed stage and one histogram sample on their own, and
+#POST /api/transit (response cache off, so every stage runs) with the metrics swapped for no-ops,
+#with the metrics on, and with the profile header on top
+import time
+
+from . import measure, report
+from ..app import create_app, warm_up
+from ..logs import setup_logging
+from ..metrics import Metrics
+from ..testing import StubServer, make_rail_feed, make_synthetic_feed
+
+BODY = {"origin_station_id": "CH01", "destination_station_id": "TSQ01", "coordinates": {"latitude": 40.7128, "longitude": -74.0060}}
+
+
+class _NoTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+#the instrumented code paths without any recording, the "uninstrumented" baseline
+class NullMetrics(Metrics):
+    def stage(self, name, profile=None):
+        return _NoTimer()
+
+    def record_stage(self, name, seconds, profile=None):
+        pass
+
+
+def main():
+    setup_logging('ERROR', log_file='', force=True)
+    metrics = Metrics()
+    rows = [("one histogram sample", f"{measure(lambda: metrics.stages.observe(0.002, 'subway'), number=10000) * 1000:.2f} us"),
+            ("one timed stage (with block)", f"{measure(lambda: metrics.stage('subway').__enter__().__exit__(), number=10000) * 1000:.2f} us")]
+
+    now = int(time.time())
+    with StubServer() as server:
+        server.route('/feeds/s', make_synthetic_feed(now, trip_count=130, routes="S").SerializeToString())
+        server.route('/feeds/lirr', make_rail_feed(now).SerializeToString())
+        server.route('/feeds/mnr', make_rail_feed(now, trip_count=500, stop_count=100).SerializeToString())
+        app = create_app({"SUBWAY_API_URLS": [server.url('/feeds/s')], "LIRR_API_URL": server.url('/feeds/lirr'),
+                          "METRO_NORTH_API_URL": server.url('/feeds/mnr'), "BUS_API_KEY": "", "RESPONSE_CACHE_TTL": 0})
+        warm_up(app, start_polling=False)
+        services = app.extensions['transit']
+        client = app.test_client()
+        instrumented = services.metrics
+        for label, request_metrics, headers in [("POST /api/transit, metrics off", NullMetrics(), {}),
+                                                ("POST /api/transit, metrics on", instrumented, {}),
+                                                ("POST /api/transit, metrics on + profile header", instrumented, {"X-Transit-Profile": "1"})]:
+            services.metrics = request_metrics
+            client.post('/api/transit', json=BODY, headers=headers) #warm
+            rows.append((label, f"{measure(lambda: client.post('/api/transit', json=BODY, headers=headers), number=50):.3f} ms"))
+        services.metrics = instrumented
+        services.close()
+    report("Instrumentation overhead", ("measured", "time"), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#rail schedule matching per agency: the old Metro North loop (every origin/destination pair of every
+#trip, no station filter) against the shared engine (index lookup, next MAX_SCHEDULES departures),
+#request CPU time and response size on synthetic subway, LIRR and Metro North feeds
+import json
+from collections import namedtuple
+
+from . import measure, report
+from ..schedules import DEFAULT_SCHEDULE_LIMIT, find_departures
+from ..stop_index import StopIndex
+from ..testing import make_rail_feed, make_synthetic_feed
+
+T = 1700000000
+
+Snapshot = namedtuple('Snapshot', ['agency', 'index'])
+
+#(agency, feed, origin stops, destination stops)
+CASES = [
+    ("subway", make_synthetic_feed(T, trip_count=130), ["A10", "C10", "E10"], ["A25", "C25", "E25"]),
+    ("lirr", make_rail_feed(T, trip_count=300, stop_count=60, seed=1), ["1"], ["12"]),
+    ("metro_north", make_rail_feed(T, trip_count=500, stop_count=100, seed=2), ["1"], ["30"]),
+]
+
+
+#get_metro_north_data before the engine
+def all_pairs(feed):
+    schedules = []
+    for entity in feed.entity:
+        if entity.HasField('trip_update'):
+            stop_time_updates = entity.trip_update.stop_time_update
+            for origin_idx, origin_stop in enumerate(stop_time_updates):
+                for dest_stop in stop_time_updates[origin_idx + 1:]:
+                    origin_time = origin_stop.arrival.time if origin_stop.HasField('arrival') else None
+                    dest_time = dest_stop.arrival.time if dest_stop.HasField('arrival') else None
+                    if origin_time and dest_time:
+                        schedules.append({"eta_origin": origin_time, "eta_destination": dest_time})
+    return schedules
+
+
+def engine(snapshots, origin_stops, destination_stops):
+    return [{"eta_origin": d.departure, "eta_destination": d.arrival}
+            for d in find_departures(snapshots, origin_stops, destination_stops, now=T, limit=DEFAULT_SCHEDULE_LIMIT)]
+
+
+def main():
+    rows = []
+    for agency, feed, origin_stops, destination_stops in CASES:
+        snapshots = [Snapshot(agency, StopIndex.from_feed(feed))]
+        old, new = all_pairs(feed), engine(snapshots, origin_stops, destination_stops)
+        old_ms = measure(lambda: all_pairs(feed), number=2, repeat=3)
+        new_ms = measure(lambda: engine(snapshots, origin_stops, destination_stops), number=50)
+        rows.append((agency, len(feed.entity), len(old), f"{len(json.dumps(old)) / 1024:.0f}", f"{old_ms:.2f}",
+                     len(new), f"{len(json.dumps(new)) / 1024:.1f}", f"{new_ms:.3f}", f"{old_ms / new_ms:.0f}x"))
+    report("rail matching per request",
+           ("agency", "entities", "all pairs: entries", "KB", "ms", "engine: entries", "KB", "ms", "speedup"), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+#offline benchmark suite over replayed upstream traffic: feed refreshes, the rail data functions and
+#POST /api/transit (response cache off and on) run against a capture, reporting p50/p99 latency,
+#throughput and peak memory. Without --capture a synthetic capture is used (ACE/BDFM/NQRW subway feeds
+#plus LIRR and Metro North, 10 versions each); a real one comes from `python -m transit_service.replay
+#record` and is replayed with the feed URLs of the environment. --save writes the results as JSON,
+#--baseline compares against a saved run, so a regression in a hot path shows up as a percentage
+#    python -m transit_service.bench.bench_replay [--capture DIR] [--requests 500] [--save run.json] [--baseline run.json]
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+
+from . import report
+from ..app import create_app, get_lirr_data, get_metro_north_data, get_subway_data, warm_up
+from ..testing import make_rail_feed, make_synthetic_feed, write_capture
+
+SUBWAY_FEEDS = {"ace": "ACE", "bdfm": "BDFM", "nqrw": "NQRW"}
+VERSIONS = 10 #feed versions per url in the synthetic capture, 30 s apart
+STOPS_PER_ROUTE = 40
+RAIL_STOPS = 60
+URL = "https://replay.invalid"
+
+
+#capture, stops.txt files and config of a synthetic run, written into `directory`
+def synthetic_setup(directory):
+    now = int(time.time())
+    responses = []
+    for version in range(VERSIONS):
+        timestamp = now + 30 * version
+        for name, routes in SUBWAY_FEEDS.items():
+            feed = make_synthetic_feed(timestamp, routes=routes, stops_per_route=STOPS_PER_ROUTE, seed=version)
+            responses.append((30 * version, f"{URL}/feeds/{name}", feed.SerializeToString()))
+        responses.append((30 * version, f"{URL}/lirr", make_rail_feed(timestamp, stop_count=RAIL_STOPS, seed=version).SerializeToString()))
+        responses.append((30 * version, f"{URL}/mnr", make_rail_feed(timestamp, stop_count=RAIL_STOPS, seed=version + 1).SerializeToString()))
+    capture = write_capture(os.path.join(directory, "capture"), responses)
+
+    rng = random.Random(0)
+    stops = {"subway": [(f"{route}{stop:02d}", f"{route} {stop}") for route in "".join(SUBWAY_FEEDS.values()) for stop in range(1, STOPS_PER_ROUTE + 1)],
+             "lirr": [(str(stop), f"LIRR {stop}") for stop in range(1, RAIL_STOPS + 1)],
+             "metro_north": [(str(stop), f"Metro North {stop}") for stop in range(1, RAIL_STOPS + 1)]}
+    sources = []
+    for agency, rows in stops.items():
+        path = os.path.join(directory, f"{agency}.txt")
+        with open(path, 'w') as stops_file:
+            stops_file.write("stop_id,stop_name,stop_lat,stop_lon\n")
+            for stop_id, name in rows:
+                stops_file.write(f"{stop_id},{name},{rng.uniform(40.55, 40.90):.6f},{rng.uniform(-74.05, -73.75):.6f}\n")
+        sources.append(f"{agency}={path}")
+    config = {"SUBWAY_API_URLS": [f"{URL}/feeds/{name}" for name in SUBWAY_FEEDS], "LIRR_API_URL": f"{URL}/lirr",
+              "METRO_NORTH_API_URL": f"{URL}/mnr", "BUS_API_KEY": "", "STATION_STOPS": ",".join(sources)}
+    return capture, config
+
+
+#origin/destination pairs along one line, like most real queries
+def synthetic_queries(count, seed=0):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        kind = rng.choice(["subway", "subway", "lirr", "metro_north"])
+        first, second = sorted(rng.sample(range(1, (STOPS_PER_ROUTE if kind == "subway" else RAIL_STOPS) + 1), 2))
+        if kind == "subway":
+            route = rng.choice("".join(SUBWAY_FEEDS.values()))
+            origin, destination = f"{route}{first:02d}", f"{route}{second:02d}"
+        else:
+            origin, destination = f"{kind}:{first}", f"{kind}:{second}"
+        queries.append({"origin_station_id": origin, "destination_station_id": destination})
+    return queries
+
+
+#times fn over items, returns sorted latencies in ms and the wall time in seconds
+def timed(fn, items):
+    latencies = []
+    started = time.perf_counter()
+    for item in items:
+        call_started = time.perf_counter()
+        fn(item)
+        latencies.append((time.perf_counter() - call_started) * 1000)
+    return sorted(latencies), time.perf_counter() - started
+
+
+def percentile(latencies, fraction):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+
+#(p50 ms, p99 ms, calls per second) of one benchmark
+def summary(latencies, seconds):
+    return {"p50_ms": percentile(latencies, 0.5), "p99_ms": percentile(latencies, 0.99), "per_second": len(latencies) / seconds}
+
+
+def run(capture, config, queries, requests):
+    app = create_app(dict(config, UPSTREAM_REPLAY=capture, UPSTREAM_REPLAY_SPEED=0, RESPONSE_CACHE_TTL=0))
+    services = app.extensions['transit']
+    warm_up(app, start_polling=False)
+    registry = services.station_registry
+    bodies = []
+    for query in queries:
+        station = registry.get(query['origin_station_id'])
+        if station is not None:
+            bodies.append(dict(query, coordinates={"latitude": station['latitude'], "longitude": station['longitude']}))
+    bodies = [bodies[n % len(bodies)] for n in range(requests)]
+    results = {}
+
+    #one refresh per replayed version: fetch, decode, index every feed
+    latencies, seconds = timed(lambda _: services.feed_poller.refresh_all(), range(VERSIONS))
+    results["feed refresh (all feeds)"] = summary(latencies, seconds)
+
+    for name, fn in (("get_subway_data", get_subway_data), ("get_lirr_data", get_lirr_data), ("get_metro_north_data", get_metro_north_data)):
+        latencies, seconds = timed(lambda body: fn(body['origin_station_id'], body['destination_station_id'], services=services), bodies)
+        results[name] = summary(latencies, seconds)
+
+    client = app.test_client()
+    post = lambda body: client.post('/api/transit', json=body)
+    post(bodies[0]) #first request sets up the blueprint and pools
+    tracemalloc.start()
+    latencies, seconds = timed(post, bodies)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    results["/api/transit, cache off"] = dict(summary(latencies, seconds), peak_mb=peak / 1e6)
+
+    services.close()
+
+    cached_app = create_app(dict(config, UPSTREAM_REPLAY=capture, UPSTREAM_REPLAY_SPEED=0, RESPONSE_CACHE_TTL=3600))
+    warm_up(cached_app, start_polling=False)
+    client = cached_app.test_client()
+    latencies, seconds = timed(lambda body: client.post('/api/transit', json=body), bodies)
+    results["/api/transit, cache on"] = summary(latencies, seconds)
+    cached_app.extensions['transit'].close()
+    results["process peak RSS"] = {"peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    return results
+
+
+def _change(value, before):
+    if before is None or not before:
+        return ""
+    return f" ({(value - before) / before * 100:+.0f}%)"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m transit_service.bench.bench_replay')
+    parser.add_argument('--capture', help="capture directory recorded with transit_service.replay, synthetic when left out")
+    parser.add_argument('--query', action='append', default=[], help="/api/transit request body (JSON) for a real capture, repeatable")
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--save', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="results JSON of an earlier run to compare with")
+    args = parser.parse_args(argv)
+    logging.getLogger('transit_api').setLevel(logging.ERROR) #no per-request log lines in the timings
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.capture:
+            capture, config = args.capture, {}
+            queries = [json.loads(query) for query in args.query] or [
+                {"origin_station_id": "CH01", "destination_station_id": "TSQ01"}, {"origin_station_id": "PS01", "destination_station_id": "GC01"}]
+        else:
+            capture, config = synthetic_setup(directory)
+            queries = synthetic_queries(100)
+        results = run(capture, config, queries, args.requests)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    rows = []
+    for name, values in results.items():
+        before = baseline.get(name, {})
+        cell = lambda key, unit: f"{values[key]:.2f}{unit}{_change(values[key], before.get(key))}" if key in values else ""
+        rows.append((name, cell('p50_ms', " ms"), cell('p99_ms', " ms"), cell('per_second', "/s"), cell('peak_mb', " MB")))
+    report(f"Replayed upstream traffic ({args.requests} requests)", ("benchmark", "p50", "p99", "throughput", "peak memory"), rows)
+    if args.save:
+        with open(args.save, 'w') as save_file:
+            json.dump(results, save_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
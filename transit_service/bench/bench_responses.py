@@ -0,0 +1,54 @@
+#a dashboard polling 30 station pairs: one /api/transit request per pair with the response cache off
+#(how every poll used to be answered), one batch request, and both again with the cache warm. Also the
+#batch re-poll sending its ETag back (304). Flask test client against subway, LIRR and Metro North
+#feeds from a stub server
+import itertools
+import time
+
+from . import measure, report
+from ..app import create_app, stations, warm_up
+from ..logs import setup_logging
+from ..testing import StubServer, make_rail_feed, make_synthetic_feed
+
+PAIRS = 30
+
+
+#distinct queries: every ordered pair of built-in stations, from coordinates a little apart
+def dashboard_queries():
+    queries = []
+    for n, (origin, destination) in enumerate(itertools.islice(itertools.cycle(itertools.permutations(stations, 2)), PAIRS)):
+        queries.append({"origin_station_id": origin['station_id'], "destination_station_id": destination['station_id'],
+                        "coordinates": {"latitude": origin['latitude'] + n * 0.001, "longitude": origin['longitude']}})
+    return queries
+
+
+def main():
+    setup_logging('ERROR', log_file='', force=True) #no per-request bus warnings
+    now = int(time.time())
+    queries = dashboard_queries()
+    rows = []
+    with StubServer() as server:
+        server.route('/feeds/s', make_synthetic_feed(now, trip_count=130, routes="S").SerializeToString())
+        server.route('/feeds/lirr', make_rail_feed(now).SerializeToString())
+        server.route('/feeds/mnr', make_rail_feed(now, trip_count=500, stop_count=100).SerializeToString())
+        for ttl in (0, 15):
+            app = create_app({"SUBWAY_API_URLS": [server.url('/feeds/s')], "LIRR_API_URL": server.url('/feeds/lirr'),
+                              "METRO_NORTH_API_URL": server.url('/feeds/mnr'), "BUS_API_KEY": "", "RESPONSE_CACHE_TTL": ttl})
+            warm_up(app, start_polling=False)
+            client = app.test_client()
+            label = "cache off" if ttl == 0 else "cache warm"
+            client.post('/api/transit/batch', json={"queries": queries}) #fills the cache when it's on
+            single_ms = measure(lambda: [client.post('/api/transit', json=query) for query in queries], number=4)
+            batch_ms = measure(lambda: client.post('/api/transit/batch', json={"queries": queries}), number=4)
+            rows.append((f"{PAIRS} single requests, {label}", f"{single_ms:.1f}"))
+            rows.append((f"1 batch request, {label}", f"{batch_ms:.1f}"))
+            if ttl:
+                etag = client.post('/api/transit/batch', json={"queries": queries}).headers['ETag']
+                repoll_ms = measure(lambda: client.post('/api/transit/batch', json={"queries": queries}, headers={"If-None-Match": etag}), number=4)
+                rows.append(("1 batch re-poll with If-None-Match (304)", f"{repoll_ms:.1f}"))
+            app.extensions['transit'].close()
+    report(f"Dashboard poll of {PAIRS} station pairs", ("requests", "ms per poll"), rows)
+
+
+if __name__ == '__main__':
+    main()
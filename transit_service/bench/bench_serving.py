@@ -0,0 +1,107 @@
+#load test of the production launcher (serve.py): starts it with 1, 2 and 4 workers (or the counts
+#given as arguments) against a local stub feed server and drives POST /api/transit from several client
+#processes, reporting req/s, latency and how many times the MTA feeds were fetched. Every worker
+#count gets the same feed traffic since only the publisher polls.
+#    python -m transit_service.bench.bench_serving [workers ...]
+import http.client
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+from . import report
+from ..testing import StubServer, make_rail_feed, make_synthetic_feed
+
+DURATION = 10 #seconds of load per worker count
+CLIENTS = 8 #client processes, each with one keep-alive connection
+BODY = json.dumps({"origin_station_id": "CH01", "destination_station_id": "TSQ01",
+                   "coordinates": {"latitude": 40.7128, "longitude": -74.0060}}).encode()
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+#one client: POSTs back to back until `duration` is over, returns the latencies of the 200 answers
+def client(port, duration):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    latencies, errors = [], 0
+    ends = time.monotonic() + duration
+    while time.monotonic() < ends:
+        started = time.perf_counter()
+        try:
+            connection.request('POST', '/api/transit', BODY, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            continue
+        if response.status == 200:
+            latencies.append(time.perf_counter() - started)
+        else:
+            errors += 1
+    connection.close()
+    return latencies, errors
+
+
+def wait_until_serving(port, timeout=60):
+    ends = time.monotonic() + timeout
+    while time.monotonic() < ends:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            connection.request('POST', '/api/transit', BODY, {'Content-Type': 'application/json'})
+            if connection.getresponse().status == 200:
+                return
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(0.25)
+    raise RuntimeError("launcher did not come up")
+
+
+def run(workers, feeds_url, root):
+    port = free_port()
+    environment = dict(os.environ, SUBWAY_API_URLS=f"{feeds_url}/feeds/s", LIRR_API_URL=f"{feeds_url}/feeds/lirr",
+                       METRO_NORTH_API_URL=f"{feeds_url}/feeds/mnr", BUS_API_KEY="", FEED_POLL_INTERVAL="5")
+    launcher = subprocess.Popen([sys.executable, '-m', 'transit_service.serve', '--workers', str(workers), '--bind', f"127.0.0.1:{port}"],
+                                cwd=root, env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_serving(port)
+        with multiprocessing.Pool(CLIENTS) as pool:
+            results = pool.starmap(client, [(port, DURATION)] * CLIENTS)
+    finally:
+        launcher.send_signal(signal.SIGINT)
+        launcher.wait(30)
+    latencies = sorted(latency for result in results for latency in result[0])
+    errors = sum(result[1] for result in results)
+    return len(latencies) / DURATION, statistics.median(latencies) * 1000, latencies[int(len(latencies) * 0.99) - 1] * 1000, errors
+
+
+def main(worker_counts):
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    now = int(time.time())
+    rows = []
+    with StubServer() as server:
+        #S line trips serve the built-in City Hall (S25..) and Times Square (S29..) stops
+        routes = {'s': server.route('/feeds/s', make_synthetic_feed(now, trip_count=130, routes="S").SerializeToString()),
+                  'lirr': server.route('/feeds/lirr', make_rail_feed(now, trip_count=300).SerializeToString()),
+                  'mnr': server.route('/feeds/mnr', make_rail_feed(now, trip_count=500, stop_count=100).SerializeToString())}
+        for workers in worker_counts:
+            before = sum(route.hits for route in routes.values())
+            throughput, p50, p99, errors = run(workers, server.url(''), root)
+            fetches = sum(route.hits for route in routes.values()) - before
+            rows.append((workers, f"{throughput:.0f}", f"{p50:.1f}", f"{p99:.1f}", errors, fetches))
+    report(f"POST /api/transit, {CLIENTS} keep-alive clients, {DURATION}s per run ({os.cpu_count()} CPUs)",
+           ("workers", "req/s", "p50 ms", "p99 ms", "errors", "feed fetches"), rows)
+
+
+if __name__ == '__main__':
+    main([int(count) for count in sys.argv[1:]] or [1, 2, 4])
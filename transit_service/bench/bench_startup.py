@@ -0,0 +1,59 @@
+#cold start: how long importing the app takes in a fresh interpreter (what every worker boot, test
+#run and fork pays) and how long create_app() and warm_up() take against a local stub feed server
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from . import report
+from ..app import create_app, warm_up
+from ..testing import StubServer, make_synthetic_feed, random_stations
+
+IMPORT_SNIPPET = "import time; started = time.perf_counter(); import transit_service.app; print(time.perf_counter() - started)"
+FEEDS = ["ace", "bdfm", "g", "jz", "nqrw", "l", "1234567", "si"]
+
+
+#median seconds to import transit_service.app in a new process
+def cold_import_seconds(runs=5):
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=root, capture_output=True, text=True, check=True)
+        samples.append(float(output.stdout.strip().splitlines()[-1]))
+    return statistics.median(samples)
+
+
+#writes a stops.txt with `count` random stations, returns its path
+def write_stops(directory, count=1500):
+    path = os.path.join(directory, "stops.txt")
+    with open(path, "w") as stops_file:
+        stops_file.write("stop_id,stop_name,stop_lat,stop_lon,location_type,parent_station\n")
+        for station in random_stations(count):
+            stops_file.write(f"{station['station_id']},{station['name']},{station['latitude']},{station['longitude']},1,\n")
+    return path
+
+
+def main():
+    rows = [("import transit_service.app (fresh process)", f"{cold_import_seconds() * 1000:.0f}")]
+    with StubServer() as server, tempfile.TemporaryDirectory() as directory:
+        for name in FEEDS:
+            server.route(f"/feeds/{name}", make_synthetic_feed(1700000000, trip_count=130).SerializeToString())
+        app = create_app({
+            "SUBWAY_API_URLS": [server.url(f"/feeds/{name}") for name in FEEDS],
+            "LIRR_API_URL": "", "METRO_NORTH_API_URL": "",
+            "STATION_STOPS": f"subway={write_stops(directory)}",
+        })
+        timings = warm_up(app, start_polling=False)
+        app.extensions['transit'].close()
+    rows += [
+        ("create_app()", f"{timings['create_app'] * 1000:.1f}"),
+        ("warm_up: station registry (1500 stations)", f"{timings['station_registry'] * 1000:.1f}"),
+        (f"warm_up: {len(FEEDS)} feeds fetched, decoded, indexed", f"{timings['feeds'] * 1000:.1f}"),
+        ("warm_up total", f"{timings['warm_up'] * 1000:.1f}"),
+    ]
+    report("startup (ms)", ("phase", "ms"), rows)
+
+
+if __name__ == '__main__':
+    main()
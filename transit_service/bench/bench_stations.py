@@ -0,0 +1,59 @@
+#station registry (KD-tree + haversine) against the old linear geopy.distance scan, for a
+#find_closest_station call pair (origin, then destination excluding the origin).
+#pass GTFS stops.txt paths to use real stations, ex: python -m transit_service.bench.bench_stations subway=stops.txt
+import random
+import sys
+
+import geopy.distance
+
+from . import measure, report
+from ..stations import StationRegistry, parse_stops_setting
+from ..testing import random_stations
+
+
+#the scan find_closest_station used before the registry
+def linear_scan(stations, latitude, longitude, exclude_station=None):
+    closest_station = None
+    min_distance = float('inf')
+    for station in stations:
+        if exclude_station and station['station_id'] == exclude_station:
+            continue
+        distance = geopy.distance.distance((latitude, longitude), (station['latitude'], station['longitude'])).km
+        if distance < min_distance:
+            min_distance = distance
+            closest_station = station
+    return closest_station['station_id'] if closest_station else None
+
+
+def main():
+    rng = random.Random(0)
+    points = [(rng.uniform(40.55, 41.0), rng.uniform(-74.1, -73.7)) for _ in range(20)]
+    if len(sys.argv) > 1:
+        datasets = [("gtfs", StationRegistry.from_gtfs(parse_stops_setting(",".join(sys.argv[1:]))).stations)]
+    else:
+        datasets = [(f"synthetic {count}", random_stations(count)) for count in (4, 500, 1500)]
+
+    rows = []
+    for label, stations in datasets:
+        registry = StationRegistry(stations)
+
+        def scan_pair():
+            for latitude, longitude in points:
+                origin = linear_scan(stations, latitude, longitude)
+                linear_scan(stations, latitude, longitude, exclude_station=origin)
+
+        def registry_pair():
+            for latitude, longitude in points:
+                origin = registry.nearest(latitude, longitude)[0][1]['station_id']
+                registry.nearest(latitude, longitude, exclude=[origin])
+
+        scan_ms = measure(scan_pair, number=1, repeat=3) / len(points)
+        registry_ms = measure(registry_pair, number=5) / len(points)
+        build_ms = measure(lambda: StationRegistry(stations), number=1, repeat=3)
+        rows.append((label, len(stations), f"{scan_ms:.3f}", f"{registry_ms:.4f}", f"{scan_ms / registry_ms:.0f}x", f"{build_ms:.1f}"))
+    report("find_closest_station origin + destination per request (ms)",
+           ("stations", "count", "linear geopy scan", "registry", "speedup", "index build"), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+#stop -> trip index against the old nested substring scan, on synthetic feeds at ACE/BDFM scale
+#(~130 trip entities) and at 10x that size
+from . import measure, report
+from ..stop_index import StopIndex
+from ..testing import make_synthetic_feed
+
+T = 1700000000
+ORIGIN_STOPS = ["A10", "C10", "E10"]
+DESTINATION_STOPS = ["A25", "C25", "E25"]
+
+
+#the matching loop get_subway_data used before the index
+def nested_scan(feed, origin_stops, destination_stops):
+    pairs = []
+    for entity in feed.entity:
+        if entity.HasField('trip_update'):
+            stop_time_updates = entity.trip_update.stop_time_update
+            for origin_idx, origin_stop in enumerate(stop_time_updates):
+                if any(pattern in origin_stop.stop_id for pattern in origin_stops):
+                    for dest_stop in stop_time_updates[origin_idx + 1:]:
+                        if any(pattern in dest_stop.stop_id for pattern in destination_stops):
+                            origin_time = origin_stop.arrival.time if origin_stop.HasField('arrival') else None
+                            dest_time = dest_stop.arrival.time if dest_stop.HasField('arrival') else None
+                            if origin_time and dest_time:
+                                pairs.append((origin_time, dest_time))
+    return pairs
+
+
+def main():
+    rows = []
+    for trip_count in (130, 1300):
+        feed = make_synthetic_feed(T, trip_count=trip_count)
+        index = StopIndex.from_feed(feed)
+        matches = len(index.find_trips(ORIGIN_STOPS, DESTINATION_STOPS))
+        scan_ms = measure(lambda: nested_scan(feed, ORIGIN_STOPS, DESTINATION_STOPS))
+        build_ms = measure(lambda: StopIndex.from_feed(feed), number=3)
+        query_ms = measure(lambda: index.find_trips(ORIGIN_STOPS, DESTINATION_STOPS), number=100)
+        rows.append((trip_count, matches, f"{scan_ms:.3f}", f"{build_ms:.3f}", f"{query_ms:.4f}", f"{scan_ms / query_ms:.0f}x"))
+    report("origin/destination matching per feed (ms)",
+           ("trips", "matches", "nested scan", "index build (once per version)", "index query", "speedup"), rows)
+
+
+if __name__ == '__main__':
+    main()
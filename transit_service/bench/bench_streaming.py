@@ -0,0 +1,124 @@
+#load test of the schedule update stream (streaming.py): thousands of simulated subscribers on a few
+#hundred station pairs hold SSE connections from a separate client process while the synthetic capture
+#of bench_replay is replayed one feed version per second. Reports the memory and threads the idle
+#connections cost the server, pair computations per feed change, and how long an update takes from
+#the feed fetch to a subscriber's socket
+#    python -m transit_service.bench.bench_streaming [subscribers]
+import asyncio
+import json
+import logging
+import multiprocessing
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from . import report
+from .bench_replay import VERSIONS, percentile, synthetic_queries, synthetic_setup
+from ..services import TransitServices, load_config
+from ..streaming import StreamServer
+
+SUBSCRIBERS = 2000
+PAIRS = 200 #unique station pairs the subscribers pick from
+CHANGE_INTERVAL = 1.0 #seconds between replayed feed versions
+
+
+def rss_mb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+#one subscriber: reads events until stopped, (update latencies, events read)
+async def _subscriber(port, pair, stopped, connecting):
+    async with connecting: #don't overrun the listen backlog
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f"GET /api/transit/stream?pair={pair} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        await reader.readuntil(b"\r\n\r\n")
+    latencies, events, event = [], 0, None
+    while not stopped.is_set():
+        try:
+            line = await asyncio.wait_for(reader.readline(), 0.5)
+        except asyncio.TimeoutError:
+            continue
+        if not line:
+            break
+        if line.startswith(b"event: "):
+            event = line[7:].strip()
+        elif line.startswith(b"data: "):
+            events += 1
+            if event == b"update":
+                latencies.append(time.time() - json.loads(line[6:])["published"])
+    writer.close()
+    return latencies, events
+
+
+def _clients(port, pairs, stop, results):
+    async def run():
+        stopped = asyncio.Event()
+        connecting = asyncio.Semaphore(200)
+        tasks = [asyncio.ensure_future(_subscriber(port, pairs[n % len(pairs)], stopped, connecting)) for n in range(SUBSCRIBERS)]
+        await asyncio.get_running_loop().run_in_executor(None, stop.wait)
+        stopped.set()
+        outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+        finished = [outcome for outcome in outcomes if not isinstance(outcome, BaseException)]
+        results.put(([latency for latencies, _ in finished for latency in latencies], sum(events for _, events in finished), len(finished)))
+    asyncio.run(run())
+
+
+def main():
+    global SUBSCRIBERS
+    if len(sys.argv) > 1:
+        SUBSCRIBERS = int(sys.argv[1])
+    logging.getLogger('transit_api').setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory() as directory:
+        capture, config = synthetic_setup(directory)
+        services = TransitServices(load_config(dict(config, UPSTREAM_REPLAY=capture, UPSTREAM_REPLAY_SPEED=0)))
+        services.warm_up(start_polling=False)
+        pairs = [f"{query['origin_station_id']},{query['destination_station_id']}" for query in synthetic_queries(PAIRS)]
+        server = StreamServer(services)
+        server.start_in_thread()
+        rss_before, threads_before = rss_mb(), threading.active_count()
+
+        context = multiprocessing.get_context('spawn') #a clean client process, no copy of the server's state
+        stop, results = context.Event(), context.Queue()
+        clients = context.Process(target=_clients, args=(server.port, pairs, stop, results))
+        started = time.perf_counter()
+        clients.start()
+        while len(server.hub.subscriptions) < SUBSCRIBERS and time.perf_counter() - started < 120:
+            time.sleep(0.05)
+        connect_seconds = time.perf_counter() - started
+        connected = len(server.hub.subscriptions)
+        rss_connected, threads_connected = rss_mb(), threading.active_count()
+
+        computed = []
+        for _ in range(VERSIONS - 1):
+            before = server.hub.computed
+            services.feed_poller.refresh_all()
+            time.sleep(CHANGE_INTERVAL)
+            computed.append(server.hub.computed - before)
+        stop.set()
+        latencies, events, finished = results.get(timeout=60)
+        clients.join(30)
+        pushed = server.hub.pushed
+        server.stop()
+        services.close()
+
+    latencies = sorted(latency * 1000 for latency in latencies) or [0.0]
+    rows = [
+        ("subscribers connected / unique pairs", f"{connected} / {len(set(pairs))}"),
+        ("time to connect everyone (initial schedules included)", f"{connect_seconds:.1f} s"),
+        ("server threads before / with subscribers", f"{threads_before} / {threads_connected}"),
+        ("server memory per idle subscriber", f"{(rss_connected - rss_before) * 1024 / max(connected, 1):.1f} KB"),
+        ("pair computations per feed change", f"{statistics.mean(computed):.0f} (vs {connected} subscribers)"),
+        ("update events pushed / read by clients", f"{pushed} / {events - finished}"),
+        ("fetch to subscriber p50 / p99", f"{percentile(latencies, 0.5):.0f} ms / {percentile(latencies, 0.99):.0f} ms"),
+    ]
+    report(f"Schedule update stream, {SUBSCRIBERS} subscribers, {VERSIONS - 1} feed changes", ("measured", "value"), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#static timetable at subway scale (about 20k trips over 25 lines, 600k stop_times rows): offline build
+#time and file size, startup cost of mapping the compiled file against parsing stop_times.txt, and the
+#"next departures in the next 3 hours" query, with and without a realtime overlay
+import csv
+import datetime
+import os
+import random
+import tempfile
+import time
+
+from . import measure, report
+from ..decoding import decode_trip_updates
+from ..feeds import FeedSnapshot
+from ..testing import build_feed, write_gtfs
+from ..timetable import Timetable, build_timetable
+
+LINES = 25
+STOPS_PER_LINE = 30
+TRIPS_PER_LINE = 800 #both directions, a full weekday
+
+
+#GTFS clock time of seconds since the start of the service day
+def _clock(seconds):
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def synthetic_trips(seed=0):
+    rng = random.Random(seed)
+    trips = []
+    for line in range(LINES):
+        route = f"R{line}"
+        for run in range(TRIPS_PER_LINE):
+            start = 5 * 3600 + run * 90 + rng.randint(0, 60)
+            stops = [f"{route}{stop:02d}" for stop in range(STOPS_PER_LINE)]
+            direction = "N" if run % 2 else "S"
+            if direction == "S":
+                stops.reverse()
+            times = [start + stop * 120 for stop in range(STOPS_PER_LINE)]
+            trips.append((f"WKD-Weekday-00_{start // 60 * 100:06d}_{route}..{direction}{run:04d}", route, "WK",
+                          [(stop + direction, _clock(moment), _clock(moment + 30)) for stop, moment in zip(stops, times)]))
+    return trips
+
+
+def main():
+    trips = synthetic_trips()
+    with tempfile.TemporaryDirectory() as directory:
+        gtfs = write_gtfs(os.path.join(directory, "subway"), trips, {"WK": ("1111111", 20260101, 20261231)})
+        output = os.path.join(directory, "timetable.bin")
+        started = time.perf_counter()
+        build_timetable([("subway", gtfs)], output)
+        build_seconds = time.perf_counter() - started
+        sizes = os.path.getsize(os.path.join(gtfs, "stop_times.txt")), os.path.getsize(output)
+
+        def parse_csv():
+            with open(os.path.join(gtfs, "stop_times.txt"), newline='') as stop_times:
+                return [row for row in csv.DictReader(stop_times)]
+        parse_ms = measure(parse_csv, number=1, repeat=3)
+        open_ms = measure(lambda: Timetable.open(output), number=20)
+
+        subway = Timetable.open(output).get('subway')
+        day_start = subway.day_start(datetime.date(2026, 3, 2))
+        now = day_start + 8 * 3600
+        query = lambda delays=None: subway.find_departures(["R005"], ["R020"], now, now + 3 * 3600, 10, delays)
+        query_ms = measure(query, number=50)
+
+        #a realtime feed with 300 trips of lines R0 and R1 running 4 minutes late
+        running = [trip for trip in trips if trip[1] in ("R0", "R1") and "07:30:00" <= trip[3][0][1] <= "10:00:00"][:300]
+        seconds = lambda clock: sum(int(part) * unit for part, unit in zip(clock.split(':'), (3600, 60, 1)))
+        feed = build_feed(now, [(trip_id.split('_', 1)[1], route, [(stop, 0, day_start + seconds(departure) + 240) for stop, _, departure in stops])
+                                for trip_id, route, _, stops in running])
+        snapshot = FeedSnapshot("s", "subway", 1, now, now, decode_trip_updates(feed.SerializeToString()), None)
+        subway.trips_for("") #the trip key table is built once per process
+        overlay_ms = measure(lambda: subway.overlay([snapshot._replace(version=time.perf_counter())], now), number=5)
+        delays = subway.overlay([snapshot], now)
+        overlay_query_ms = measure(lambda: query(delays), number=50)
+
+    rows = [
+        ("stop_times rows", f"{sum(len(trip[3]) for trip in trips)}"),
+        ("build (offline)", f"{build_seconds:.2f} s"),
+        ("stop_times.txt / timetable file", f"{sizes[0] / 1e6:.1f} MB / {sizes[1] / 1e6:.1f} MB"),
+        ("startup: parse stop_times.txt", f"{parse_ms:.0f} ms"),
+        ("startup: map the timetable", f"{open_ms:.2f} ms"),
+        ("next 10 departures in 3 h", f"{query_ms:.3f} ms"),
+        (f"realtime overlay of {len(running)} trips, per feed version", f"{overlay_ms:.2f} ms"),
+        ("next 10 departures with the overlay", f"{overlay_query_ms:.3f} ms"),
+    ]
+    report("Static timetable, subway scale", ("measured", "value"), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+#bus data from MTA BusTime: a route/stop catalogue loaded once and refreshed on a slow schedule,
+#nearest bus stops through the station registry's KD-tree, and SIRI StopMonitoring calls for just
+#those stops, cached for a few seconds and coalesced so identical concurrent queries share one call
+import datetime
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import quote
+
+from .caching import Coalescer, TTLCache
+from .stations import StationRegistry
+
+logger = logging.getLogger('transit_api')
+
+DEFAULT_BUS_API_URL = "https://bustime.mta.info"
+DEFAULT_BUS_AGENCIES = ("MTA NYCT", "MTABC") #NYC Transit and MTA Bus Company routes
+DEFAULT_CATALOGUE_INTERVAL = 24 * 3600 #routes and stops change with service changes, not by the minute
+DEFAULT_CATALOGUE_RETRY = 60 #seconds before a failed catalogue load is tried again
+DEFAULT_CATALOGUE_WORKERS = 4 #stops-for-route calls in flight during a catalogue load
+DEFAULT_VISITS_TTL = 20 #seconds StopMonitoring answers are reused, BusTime refreshes about every 30s
+DEFAULT_STOP_RADIUS_KM = 0.4 #how far from the coordinates a bus stop may be, about a 5 minute walk
+DEFAULT_STOPS_PER_QUERY = 3 #nearest stops monitored per request
+DEFAULT_MAX_VISITS = 10 #MaximumStopVisits per StopMonitoring call
+
+#one bus due at a stop. journey_id identifies the vehicle's trip across stops, expected is the
+#expected (or scheduled, when there's no prediction) arrival as a posix timestamp
+BusVisit = namedtuple('BusVisit', ['stop_id', 'route', 'journey_id', 'destination', 'expected'])
+
+
+#route and stop catalogue, stops are registry "stations" with agency 'bus' so the KD-tree answers
+#nearest-stop queries. Stop ids are BusTime's, ex: MTA_308209
+class BusCatalogue:
+    def __init__(self, routes, stops):
+        self.routes = routes #route id -> short name, ex: {"MTA NYCT_B63": "B63"}
+        self.registry = StationRegistry(stops)
+
+    def __len__(self):
+        return len(self.registry)
+
+    #up to `count` stops within radius_km of the coordinates as (distance_km, stop), nearest first
+    def nearest_stops(self, latitude, longitude, radius_km=DEFAULT_STOP_RADIUS_KM, count=DEFAULT_STOPS_PER_QUERY):
+        return [match for match in self.registry.nearest(latitude, longitude, k=count) if match[0] <= radius_km]
+
+
+#ISO 8601 SIRI timestamp -> posix timestamp, None when missing or malformed
+def _siri_time(value):
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+#MonitoredStopVisit entries of a StopMonitoring answer -> BusVisits, soonest first
+def parse_stop_monitoring(stop_id, payload):
+    deliveries = payload.get('Siri', {}).get('ServiceDelivery', {}).get('StopMonitoringDelivery', [])
+    visits = []
+    for delivery in deliveries:
+        for visit in delivery.get('MonitoredStopVisit', []):
+            journey = visit.get('MonitoredVehicleJourney', {})
+            call = journey.get('MonitoredCall', {})
+            expected = _siri_time(call.get('ExpectedArrivalTime')) or _siri_time(call.get('AimedArrivalTime'))
+            if expected is None:
+                continue
+            line = journey.get('PublishedLineName')
+            route = (line[0] if isinstance(line, list) else line) or journey.get('LineRef', '')
+            journey_id = journey.get('FramedVehicleJourneyRef', {}).get('DatedVehicleJourneyRef') or journey.get('VehicleRef')
+            destination = journey.get('DestinationName')
+            visits.append(BusVisit(stop_id, route, journey_id, destination[0] if isinstance(destination, list) else destination, expected))
+    visits.sort(key=lambda visit: visit.expected)
+    return visits
+
+
+class BusTimeClient:
+    #catalogue loads run on catalogue_fetcher (the StopMonitoring fetcher when not given), so hundreds of
+    #stops-for-route calls never queue ahead of a request's StopMonitoring calls
+    def __init__(self, fetcher, api_key, base_url=DEFAULT_BUS_API_URL, agencies=DEFAULT_BUS_AGENCIES,
+                 visits_ttl=DEFAULT_VISITS_TTL, max_visits=DEFAULT_MAX_VISITS, catalogue_fetcher=None):
+        self.fetcher = fetcher
+        self.catalogue_fetcher = catalogue_fetcher or fetcher
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.agencies = agencies
+        self.max_visits = max_visits
+        self.visits_cache = TTLCache(4096, visits_ttl)
+        self.coalescer = Coalescer()
+        self.monitoring_calls = 0
+
+    def _get_json(self, path, fetcher=None, **params):
+        return json.loads((fetcher or self.fetcher).get(f"{self.base_url}{path}", params=dict(params, key=self.api_key)))
+
+    #every route of the configured agencies and the stops they serve. One stops-for-route call per
+    #route, run concurrently on the catalogue fetcher; a route whose call fails is logged and left out
+    def load_catalogue(self):
+        fetcher = self.catalogue_fetcher
+        routes = {}
+        for agency in self.agencies:
+            for route in self._get_json(f"/api/where/routes-for-agency/{quote(agency)}.json", fetcher).get('data', {}).get('list', []):
+                routes[route['id']] = route.get('shortName') or route['id']
+
+        calls = {route_id: (lambda route_id=route_id: self._get_json(f"/api/where/stops-for-route/{quote(route_id)}.json", fetcher,
+                                                                      includePolylines='false', version=2))
+                 for route_id in routes}
+        results = fetcher.run_all(calls, deadline=max(fetcher.deadline, 120), call_timeout=max(fetcher.call_timeout, 30))
+        stops = {}
+        for route_id, result in results.items():
+            if not result.ok:
+                logger.error("Bus stops for route %s unavailable: %s", route_id, result.error)
+                continue
+            for stop in result.value.get('data', {}).get('references', {}).get('stops', []):
+                entry = stops.get(stop['id'])
+                if entry is None:
+                    entry = stops[stop['id']] = {"station_id": stop['id'], "name": stop.get('name', ''), "agency": "bus",
+                                                 "latitude": float(stop['lat']), "longitude": float(stop['lon']), "routes": []}
+                entry['routes'].append(routes[route_id])
+        logger.info("Loaded bus catalogue: %s routes, %s stops", len(routes), len(stops))
+        return BusCatalogue(routes, list(stops.values()))
+
+    #buses due at a stop, from the cache when a recent answer exists
+    def stop_visits(self, stop_id):
+        cached = self.visits_cache.get(stop_id)
+        if cached is not None:
+            return cached
+        return self.coalescer.run(stop_id, lambda: self._monitor(stop_id))
+
+    def _monitor(self, stop_id):
+        cached = self.visits_cache.get(stop_id) #filled while we waited to lead
+        if cached is not None:
+            return cached
+        self.monitoring_calls += 1
+        #MonitoringRef is the stop code without the agency prefix, MTA_308209 -> 308209
+        payload = self._get_json("/api/siri/stop-monitoring.json", version=2, MonitoringRef=stop_id.rpartition('_')[2],
+                                 MaximumStopVisits=self.max_visits)
+        visits = parse_stop_monitoring(stop_id, payload)
+        self.visits_cache.set(stop_id, visits)
+        return visits
+
+
+#owns the current catalogue: loaded in warm_up, or in a background thread when a request finds none,
+#and reloaded in the background once it is older than `interval` while requests keep using the
+#previous one. Requests never wait for a load, without a catalogue buses are unavailable
+class BusService:
+    def __init__(self, client, interval=DEFAULT_CATALOGUE_INTERVAL, radius_km=DEFAULT_STOP_RADIUS_KM,
+                 stops_per_query=DEFAULT_STOPS_PER_QUERY, clock=time.time, retry_interval=DEFAULT_CATALOGUE_RETRY):
+        self.client = client
+        self.interval = interval
+        self.radius_km = radius_km
+        self.stops_per_query = stops_per_query
+        self.clock = clock
+        self.retry_interval = retry_interval
+        self._catalogue = None
+        self._loaded_at = 0.0
+        self._attempted_at = float('-inf')
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    #loads the catalogue on this thread, for warm_up
+    def load(self):
+        self._attempted_at = self.clock()
+        self._catalogue, self._loaded_at = self.client.load_catalogue(), self.clock()
+        return self._catalogue
+
+    #the current catalogue, None until the first load finished
+    def catalogue(self):
+        catalogue = self._catalogue
+        now = self.clock()
+        if (catalogue is None or now - self._loaded_at >= self.interval) and now - self._attempted_at >= self.retry_interval:
+            self._refresh_in_background()
+        return catalogue
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name='bus-catalogue', daemon=True).start()
+
+    def _refresh(self):
+        try:
+            self.load()
+        except Exception as e: #keep serving the old catalogue (or none), try again after retry_interval
+            logger.error("Bus catalogue load failed: %s", e)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    #buses leaving from the stops near the origin, soonest first. With destination coordinates only
+    #journeys that later reach a stop near the destination are kept, and their arrival there is filled in.
+    #Returns a list of (BusVisit at origin, BusVisit at destination or None), None while the catalogue loads
+    def departures(self, latitude, longitude, destination=None, now=None, limit=DEFAULT_MAX_VISITS):
+        catalogue = self.catalogue()
+        if catalogue is None:
+            return None
+        now = self.clock() if now is None else now
+        origin_stops = [stop['station_id'] for _, stop in catalogue.nearest_stops(latitude, longitude, self.radius_km, self.stops_per_query)]
+        destination_stops = []
+        if destination is not None:
+            destination_stops = [stop['station_id'] for _, stop in catalogue.nearest_stops(destination[0], destination[1], self.radius_km, self.stops_per_query)
+                                 if stop['station_id'] not in origin_stops]
+            if not destination_stops: #nothing near the destination, no bus can get there
+                return []
+
+        #one call per stop, run concurrently on the client's own fetcher (this already runs on a request
+        #pool thread, waiting on that same pool could starve it); cached stops answer right away
+        results = self.client.fetcher.run_all({stop_id: (lambda stop_id=stop_id: self.client.stop_visits(stop_id))
+                                               for stop_id in origin_stops + destination_stops})
+        visits = {stop_id: result.value if result.ok else [] for stop_id, result in results.items()}
+        failed = [stop_id for stop_id, result in results.items() if not result.ok]
+        if failed and len(failed) == len(results):
+            raise RuntimeError(f"StopMonitoring unavailable for {', '.join(failed)}")
+
+        arrivals = {} #journey -> earliest arrival near the destination
+        for stop_id in destination_stops:
+            for visit in visits[stop_id]:
+                if visit.journey_id and (visit.journey_id not in arrivals or visit.expected < arrivals[visit.journey_id].expected):
+                    arrivals[visit.journey_id] = visit
+
+        matches, seen = [], set()
+        for visit in sorted((visit for stop_id in origin_stops for visit in visits[stop_id]), key=lambda visit: visit.expected):
+            if visit.expected < now or (visit.journey_id and visit.journey_id in seen):
+                continue
+            arrival = arrivals.get(visit.journey_id)
+            if destination is not None and (arrival is None or arrival.expected <= visit.expected):
+                continue
+            seen.add(visit.journey_id) #the same bus shows up at every nearby stop on its route
+            matches.append((visit, arrival))
+            if len(matches) == limit:
+                break
+        return matches
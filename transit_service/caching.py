@@ -0,0 +1,98 @@
+#small building blocks for caching upstream answers: a bounded LRU cache with expiry, request
+#coalescing so identical in-flight lookups share one upstream call, and a rate limiter
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+_MISSING = object()
+
+
+#bounded LRU cache whose entries expire ttl seconds after they were stored
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=60.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() #key -> (expires_at, value), least recently used first
+
+    #cached value or `default` when missing or expired
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > self.clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not _MISSING: #expired
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (self.clock() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+#runs fn once per key at a time: callers asking for a key that is already being computed wait for
+#that result instead of starting their own call
+class Coalescer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {} #key -> Future
+
+    def run(self, key, fn):
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+
+#spaces calls at least min_interval seconds apart across all threads, ex: Nominatim allows 1 req/s
+class RateLimiter:
+    def __init__(self, min_interval=1.0, clock=time.monotonic, sleep=time.sleep):
+        self.min_interval = min_interval
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    #claims the next slot and waits for it. Returns False without waiting (and without claiming)
+    #when the slot is more than max_wait seconds away
+    def acquire(self, max_wait=None):
+        with self._lock:
+            now = self.clock()
+            slot = max(now, self._next_slot)
+            if max_wait is not None and slot - now > max_wait:
+                return False
+            self._next_slot = slot + self.min_interval
+        if slot > now:
+            self.sleep(slot - now)
+        return True
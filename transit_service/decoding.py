@@ -0,0 +1,129 @@
+#projected GTFS-realtime decoder. Payloads are parsed (straight from a memoryview, the payload is
+#not copied) against a trimmed-down copy of the GTFS-realtime schema that only declares trip_update
+#entities and the fields we use: trip_id, route_id, stop_id, arrival and departure time. Vehicle
+#positions, alerts and extensions (ex: the NYCT 1001 fields) are never turned into message objects,
+#and the result is flattened into compact parallel columns so snapshots hold arrays, not protobufs
+from array import array
+
+from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+
+
+#builds the message class of the projected schema. Field numbers match gtfs-realtime.proto, so
+#the real payloads parse as-is and everything not declared here is skipped by the parser
+def _projected_feed_class():
+    field = descriptor_pb2.FieldDescriptorProto
+    optional, repeated = field.LABEL_OPTIONAL, field.LABEL_REPEATED
+    proto = descriptor_pb2.FileDescriptorProto(name='transit_service/projected_gtfs_rt.proto',
+                                               package='transit_service.projected', syntax='proto2')
+
+    def message(name, fields):
+        descriptor = proto.message_type.add(name=name)
+        for field_name, number, field_type, label, type_name in fields:
+            added = descriptor.field.add(name=field_name, number=number, type=field_type, label=label)
+            if type_name:
+                added.type_name = f".transit_service.projected.{type_name}"
+
+    message('FeedMessage', [('header', 1, field.TYPE_MESSAGE, optional, 'FeedHeader'),
+                            ('entity', 2, field.TYPE_MESSAGE, repeated, 'FeedEntity')])
+    message('FeedHeader', [('timestamp', 3, field.TYPE_UINT64, optional, None)])
+    message('FeedEntity', [('trip_update', 3, field.TYPE_MESSAGE, optional, 'TripUpdate')])
+    message('TripUpdate', [('trip', 1, field.TYPE_MESSAGE, optional, 'TripDescriptor'),
+                           ('stop_time_update', 2, field.TYPE_MESSAGE, repeated, 'StopTimeUpdate')])
+    message('TripDescriptor', [('trip_id', 1, field.TYPE_STRING, optional, None),
+                               ('route_id', 5, field.TYPE_STRING, optional, None)])
+    message('StopTimeUpdate', [('arrival', 2, field.TYPE_MESSAGE, optional, 'StopTimeEvent'),
+                               ('departure', 3, field.TYPE_MESSAGE, optional, 'StopTimeEvent'),
+                               ('stop_id', 4, field.TYPE_STRING, optional, None)])
+    message('StopTimeEvent', [('time', 2, field.TYPE_INT64, optional, None)])
+
+    pool = descriptor_pool.DescriptorPool() #private pool, can't clash with gtfs_realtime_pb2
+    pool.Add(proto)
+    return message_factory.GetMessageClass(pool.FindMessageTypeByName('transit_service.projected.FeedMessage'))
+
+
+ProjectedFeedMessage = _projected_feed_class()
+
+
+#trip updates of one feed as parallel columns. Trip t's stop_time_updates are rows
+#trip_offsets[t] to trip_offsets[t + 1] - 1 of the row columns (stop_codes, arrivals, departures).
+#stop ids are stored once in stop_names and referenced by position from stop_codes. Times are
+#posix timestamps, 0 when the update has none
+class TripColumns:
+    __slots__ = ('header_timestamp', 'trip_ids', 'route_ids', 'trip_offsets', 'stop_codes', 'stop_names',
+                 'arrivals', 'departures')
+
+    def __init__(self, header_timestamp=0):
+        self.header_timestamp = header_timestamp
+        self.trip_ids = []
+        self.route_ids = []
+        self.trip_offsets = array('I', [0])
+        self.stop_codes = array('I')
+        self.stop_names = []
+        self.arrivals = array('q')
+        self.departures = array('q')
+
+    def __len__(self):
+        return len(self.trip_ids)
+
+    #row numbers of trip t's stop_time_updates, in feed order
+    def rows(self, trip):
+        return range(self.trip_offsets[trip], self.trip_offsets[trip + 1])
+
+    def stop_id(self, row):
+        return self.stop_names[self.stop_codes[row]]
+
+    #appends one trip, stops is a list of (stop_id, arrival, departure)
+    def add_trip(self, trip_id, route_id, stops, stop_lookup=None):
+        stop_lookup = {name: code for code, name in enumerate(self.stop_names)} if stop_lookup is None else stop_lookup
+        for stop_id, arrival, departure in stops:
+            code = stop_lookup.get(stop_id)
+            if code is None:
+                code = stop_lookup[stop_id] = len(self.stop_names)
+                self.stop_names.append(stop_id)
+            self.stop_codes.append(code)
+            self.arrivals.append(arrival)
+            self.departures.append(departure)
+        self.trip_ids.append(trip_id)
+        self.route_ids.append(route_id)
+        self.trip_offsets.append(len(self.stop_codes))
+
+    #approximate bytes held by the columns
+    def nbytes(self):
+        strings = sum(len(text) + 49 for text in self.trip_ids + self.route_ids + self.stop_names)
+        columns = (self.trip_offsets, self.stop_codes, self.arrivals, self.departures)
+        return strings + sum(column.itemsize * len(column) for column in columns)
+
+
+#flattens the trip updates of a parsed feed (projected or full gtfs_realtime_pb2) into TripColumns.
+#this loop is the hot part of decoding, so it appends to the columns directly instead of add_trip
+def columns_from_feed(feed):
+    columns = TripColumns(feed.header.timestamp)
+    stop_lookup = {}
+    stop_names, trip_ids, route_ids, trip_offsets = columns.stop_names, columns.trip_ids, columns.route_ids, columns.trip_offsets
+    add_code, add_arrival, add_departure = columns.stop_codes.append, columns.arrivals.append, columns.departures.append
+    rows = 0
+    for entity in feed.entity:
+        if not entity.HasField('trip_update'):
+            continue
+        trip_update = entity.trip_update
+        for update in trip_update.stop_time_update:
+            stop_id = update.stop_id
+            code = stop_lookup.get(stop_id)
+            if code is None:
+                code = stop_lookup[stop_id] = len(stop_names)
+                stop_names.append(stop_id)
+            add_code(code)
+            add_arrival(update.arrival.time) #0 when the update has no arrival
+            add_departure(update.departure.time)
+            rows += 1
+        trip_ids.append(trip_update.trip.trip_id)
+        route_ids.append(trip_update.trip.route_id)
+        trip_offsets.append(rows)
+    return columns
+
+
+#decodes a serialized FeedMessage (bytes, bytearray, memoryview or mmap) into TripColumns
+def decode_trip_updates(payload):
+    feed = ProjectedFeedMessage()
+    feed.ParseFromString(payload if isinstance(payload, memoryview) else memoryview(payload))
+    return columns_from_feed(feed)
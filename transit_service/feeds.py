@@ -0,0 +1,268 @@
+#feed ingestion: polls every configured GTFS-realtime feed in the background and publishes
+#immutable, versioned snapshots that request handlers read without doing any network I/O
+import heapq #to keep track of which feed is due next
+import itertools #global version counter
+import logging
+import threading #poller runs in its own daemon thread
+import time
+from collections import namedtuple
+from types import MappingProxyType #read-only view of the published snapshots
+from urllib.parse import unquote
+
+from google.transit import gtfs_realtime_pb2
+
+from .decoding import decode_trip_updates
+from .fetch import Fetcher
+from .stop_index import StopIndex
+
+logger = logging.getLogger('transit_api')
+
+DEFAULT_POLL_INTERVAL = 30 #seconds between polls of one feed, MTA feeds update about every 30s
+DEFAULT_MAX_STALENESS = 120 #seconds after which a feed's data counts as stale
+
+#one configured feed: name used as key in the store, url to poll, agency it belongs to
+FeedConfig = namedtuple('FeedConfig', ['name', 'url', 'agency', 'interval', 'max_staleness'],
+                        defaults=[DEFAULT_POLL_INTERVAL, DEFAULT_MAX_STALENESS])
+
+#one published version of a feed. header_timestamp is the feed header `timestamp` (0 if missing),
+#fetched_at is when we downloaded it, feed is its decoded TripColumns and index its StopIndex
+FeedSnapshot = namedtuple('FeedSnapshot', ['name', 'agency', 'version', 'header_timestamp', 'fetched_at', 'feed', 'index'])
+
+
+class FeedUnavailableError(Exception):
+    #raised when a feed has never been fetched successfully
+    pass
+
+
+class StaleFeedError(FeedUnavailableError):
+    #raised when a feed's newest snapshot is older than its max_staleness and stale data isn't allowed
+    def __init__(self, name, age):
+        super().__init__(f"Feed {name} is stale ({age:.0f}s old)")
+        self.name = name
+        self.age = age
+
+
+#turns a feed url into a short name, ex: .../mtagtfsfeeds/nyct%2Fgtfs-ace -> gtfs-ace
+def feed_name(url):
+    return unquote(url.rstrip('/')).rsplit('/', 1)[-1]
+
+
+#reads a protobuf varint starting at pos, returns (value, next position)
+def _read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+#skips over one field of the given wire type, returns the position after it
+def _skip_field(buf, pos, wire_type):
+    if wire_type == 0: #varint
+        return _read_varint(buf, pos)[1]
+    if wire_type == 1: #64-bit
+        return pos + 8
+    if wire_type == 2: #length-delimited
+        length, pos = _read_varint(buf, pos)
+        return pos + length
+    if wire_type == 5: #32-bit
+        return pos + 4
+    raise ValueError(f"Unsupported wire type {wire_type}")
+
+
+#reads FeedHeader.timestamp straight from the raw bytes without decoding any entities,
+#so an unchanged feed can be skipped before paying for a full parse. Returns 0 if missing
+def read_header_timestamp(payload):
+    buf = memoryview(payload)
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = _read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 0x7
+        if field == 1 and wire_type == 2: #FeedMessage.header
+            length, pos = _read_varint(buf, pos)
+            header_end = pos + length
+            while pos < header_end:
+                key, pos = _read_varint(buf, pos)
+                if key >> 3 == 3 and key & 0x7 == 0: #FeedHeader.timestamp
+                    return _read_varint(buf, pos)[0]
+                pos = _skip_field(buf, pos, key & 0x7)
+            return 0
+        pos = _skip_field(buf, pos, wire_type)
+    return 0
+
+
+#full protobuf decode of a feed payload. The poller uses the projected decoding.decode_trip_updates, this
+#is the reference it is tested and benchmarked against (test_decoding, bench_decoding)
+def decode_feed(payload):
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.ParseFromString(payload)
+    return feed
+
+
+#holds the newest snapshot of every feed. Publishing swaps in a new dict (copy on write),
+#so readers never take a lock and a view they grabbed never changes under them
+class FeedStore:
+    def __init__(self, configs=()):
+        self._lock = threading.Lock() #only writers take the lock
+        self._configs = {config.name: config for config in configs}
+        self._snapshots = MappingProxyType({})
+        self._versions = itertools.count(1)
+        self._listeners = [] #called with every published snapshot, ex: writing it out for other processes
+
+    def add_config(self, config):
+        with self._lock:
+            self._configs[config.name] = config
+
+    def config(self, name):
+        return self._configs[name]
+
+    def configs(self, agency=None):
+        return [config for config in self._configs.values() if agency is None or config.agency == agency]
+
+    def next_version(self):
+        with self._lock:
+            return next(self._versions)
+
+    def add_listener(self, listener):
+        with self._lock:
+            self._listeners.append(listener)
+
+    def publish(self, snapshot):
+        with self._lock:
+            snapshots = dict(self._snapshots)
+            snapshots[snapshot.name] = snapshot
+            self._snapshots = MappingProxyType(snapshots)
+            listeners = list(self._listeners)
+        for listener in listeners: #outside the lock, a listener may read the store
+            try:
+                listener(snapshot)
+            except Exception as e: #a broken listener must not stop publishing
+                logger.error("Feed listener failed for %s: %s", snapshot.name, e)
+
+    #read-only mapping name -> snapshot, consistent across all feeds
+    def view(self):
+        return self._snapshots
+
+    #(name, version) pairs for every published feed (of `view` when given), changes whenever any feed updates
+    def versions(self, view=None):
+        return tuple(sorted((name, snapshot.version) for name, snapshot in (self._snapshots if view is None else view).items()))
+
+    #age of a snapshot's data in seconds, based on the feed header timestamp when the feed has one
+    def age(self, snapshot, now=None):
+        now = time.time() if now is None else now
+        return now - (snapshot.header_timestamp or snapshot.fetched_at)
+
+    def is_stale(self, snapshot, now=None):
+        config = self._configs.get(snapshot.name)
+        max_staleness = config.max_staleness if config else DEFAULT_MAX_STALENESS
+        return self.age(snapshot, now) > max_staleness
+
+    #returns the newest snapshot of a feed, raises if missing or (when allow_stale is False) stale
+    def get(self, name, allow_stale=True, now=None, view=None):
+        snapshot = (self._snapshots if view is None else view).get(name)
+        if snapshot is None:
+            raise FeedUnavailableError(f"Feed {name} has not been fetched yet")
+        if not allow_stale and self.is_stale(snapshot, now):
+            raise StaleFeedError(name, self.age(snapshot, now))
+        return snapshot
+
+
+#background poller. Every feed is polled on its own interval, feeds that are due together are
+#fetched concurrently; a payload whose header timestamp matches the published snapshot is skipped
+#without decoding
+class FeedPoller:
+    def __init__(self, store, fetcher=None, fetch=None, decode=decode_trip_updates, indexer=StopIndex.from_columns, clock=time.time,
+                 metrics=None):
+        self.store = store
+        self.fetcher = fetcher or Fetcher()
+        self.fetch = fetch or self.fetcher.get #url -> raw payload
+        self.decode = decode
+        self.indexer = indexer #builds the stop -> trip index once per feed version
+        self.clock = clock
+        self.metrics = metrics #fetch, decode and index times per feed, failed fetches
+        self._stop = threading.Event()
+        self._thread = None
+
+    #polls one feed, returns True if a new snapshot was published
+    def poll(self, config):
+        return self.poll_many([config])[config.name]
+
+    #fetches the given feeds concurrently, returns dict name -> True if a new snapshot was published
+    def poll_many(self, configs):
+        results = self.fetcher.run_all({config.name: (lambda url=config.url: self.fetch(url)) for config in configs})
+        updated = {}
+        for config in configs:
+            result = results[config.name]
+            if not result.ok: #keep serving the previous snapshot, try again next interval
+                logger.error("Error polling feed %s: %s", config.name, result.error)
+                if self.metrics is not None:
+                    self.metrics.upstream_failure(config.name, result.error)
+                updated[config.name] = False
+            else:
+                if self.metrics is not None:
+                    self.metrics.feeds.observe(result.elapsed, config.name, 'fetch')
+                updated[config.name] = self._process(config, result.value)
+        return updated
+
+    def _process(self, config, payload):
+        try:
+            header_timestamp = read_header_timestamp(payload)
+            current = self.store.view().get(config.name)
+            if current is not None and header_timestamp and header_timestamp == current.header_timestamp:
+                logger.debug("Feed %s unchanged (timestamp %s)", config.name, header_timestamp)
+                return False
+            started = time.perf_counter()
+            feed = self.decode(payload)
+            decoded = time.perf_counter()
+            index = self.indexer(feed)
+            if self.metrics is not None:
+                self.metrics.feeds.observe(decoded - started, config.name, 'decode')
+                self.metrics.feeds.observe(time.perf_counter() - decoded, config.name, 'index')
+        except Exception as e: #corrupt payload, keep the previous snapshot
+            logger.error("Error decoding feed %s: %s", config.name, e)
+            return False
+
+        snapshot = FeedSnapshot(config.name, config.agency, self.store.next_version(),
+                                header_timestamp, self.clock(), feed, index)
+        self.store.publish(snapshot)
+        logger.info("Published feed %s version %s", config.name, snapshot.version)
+        return True
+
+    #polls every configured feed once, used before serving traffic and by tests
+    def refresh_all(self):
+        return self.poll_many(self.store.configs())
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='feed-poller', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    #scheduler loop: a heap of (next due time, feed name), sleeps until the earliest one is due
+    #and then polls every feed that is due at that point in one concurrent batch
+    def _run(self):
+        now = time.monotonic()
+        due = [(now, config.name) for config in self.store.configs()]
+        heapq.heapify(due)
+        while due and not self._stop.is_set():
+            if self._stop.wait(max(0.0, due[0][0] - time.monotonic())):
+                break
+            now = time.monotonic()
+            batch = []
+            while due and due[0][0] <= now:
+                batch.append(self.store.config(heapq.heappop(due)[1]))
+            self.poll_many(batch)
+            for config in batch:
+                heapq.heappush(due, (time.monotonic() + config.interval, config.name))
@@ -0,0 +1,125 @@
+#fetch layer: runs upstream calls concurrently on a bounded thread pool over one pooled
+#keep-alive session, with per-call and overall deadlines. Slow or failing calls come back as
+#error markers instead of holding up everything else
+import logging
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('transit_api')
+
+DEFAULT_WORKERS = 16 #max upstream calls in flight at once
+DEFAULT_CALL_TIMEOUT = 5 #seconds one upstream call may take
+DEFAULT_DEADLINE = 8 #seconds a whole fan-out may take
+
+#outcome of one call: value is set when ok, error holds a short marker ('timeout', 'HTTP 500', ...)
+#and exception the original exception when the call raised
+FetchResult = namedtuple('FetchResult', ['name', 'ok', 'value', 'error', 'elapsed', 'exception'], defaults=[None])
+
+
+class Fetcher:
+    def __init__(self, max_workers=DEFAULT_WORKERS, call_timeout=DEFAULT_CALL_TIMEOUT, deadline=DEFAULT_DEADLINE):
+        self.call_timeout = call_timeout
+        self.deadline = deadline
+        #one session shared by all threads, its connection pool is sized to the worker count
+        #so every worker can keep its own keep-alive connection
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fetch')
+
+    #blocking GET through the pooled session, returns the raw body or raises
+    def get(self, url, params=None, timeout=None):
+        response = self.session.get(url, params=params, timeout=timeout or self.call_timeout)
+        response.raise_for_status()
+        return response.content
+
+    #runs calls (dict name -> zero-arg callable) concurrently, returns dict name -> FetchResult.
+    #each call gets `call_timeout` seconds from when a worker picks it up, and the batch waits at most
+    #`deadline` seconds overall; anything still running or queued after that is reported as 'timeout'
+    #and left to finish in the background
+    def run_all(self, calls, deadline=None, call_timeout=None):
+        return self.collect(self.submit_all(calls), deadline, call_timeout)
+
+    #starts calls without waiting for them, collect() gathers the results. The caller can do its own
+    #work in between
+    def submit_all(self, calls):
+        started = time.monotonic()
+        pending = {}
+        for name, call in calls.items():
+            began = [] #the worker's start time, once it picks the call up
+            pending[name] = (self.executor.submit(self._timed, call, began), began)
+        return started, pending
+
+    def collect(self, batch, deadline=None, call_timeout=None):
+        deadline = self.deadline if deadline is None else deadline
+        call_timeout = self.call_timeout if call_timeout is None else call_timeout
+        started, pending = batch
+        #a queued call can wait until the deadline, a running one until its own timeout too
+        limit = lambda began: min(began[0] + call_timeout, started + deadline) if began else started + deadline
+        while True:
+            now = time.monotonic()
+            running = [(future, limit(began)) for future, began in pending.values() if not future.done() and limit(began) > now]
+            if not running:
+                break
+            wait([future for future, _ in running], timeout=min(end for _, end in running) - now, return_when=FIRST_COMPLETED)
+
+        results = {}
+        for name, (future, _) in pending.items():
+            if not future.done():
+                future.cancel()
+                logger.warning("Upstream call %s timed out", name)
+                results[name] = FetchResult(name, False, None, 'timeout', time.monotonic() - started)
+            else:
+                results[name] = _result(name, *future.result())
+        return results
+
+    #fetches urls (dict name -> url) concurrently, values are the raw response bodies
+    def fetch_all(self, urls, deadline=None, call_timeout=None):
+        timeout = self.call_timeout if call_timeout is None else call_timeout
+        calls = {name: (lambda url=url: self.get(url, timeout=timeout)) for name, url in urls.items()}
+        return self.run_all(calls, deadline, call_timeout)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+    #runs one call, captures its exception so the pool thread never raises
+    @staticmethod
+    def _timed(call, began=None):
+        started = time.monotonic()
+        if began is not None:
+            began.append(started)
+        try:
+            return None, call(), time.monotonic() - started
+        except Exception as e:
+            return e, None, time.monotonic() - started
+
+
+#runs calls on the calling thread, one after the other, with the same FetchResults as Fetcher.run_all.
+#For in-memory work (matching feed snapshots, the timetable) that has no reason to wait for a pool
+#worker or to time out
+def run_inline(calls):
+    return {name: _result(name, *Fetcher._timed(call)) for name, call in calls.items()}
+
+
+def _result(name, error, value, elapsed):
+    if error is not None:
+        logger.error("Call %s failed: %s", name, error)
+        return FetchResult(name, False, None, _error_marker(error), elapsed, error)
+    return FetchResult(name, True, value, None, elapsed)
+
+
+#short, client-safe description of what went wrong with an upstream call
+def _error_marker(error):
+    if isinstance(error, requests.Timeout):
+        return 'timeout'
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return f"HTTP {error.response.status_code}"
+    if isinstance(error, requests.ConnectionError):
+        return 'connection error'
+    return type(error).__name__
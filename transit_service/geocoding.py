@@ -0,0 +1,98 @@
+#reverse geocoding with a local gazetteer in front: "which station is this" is answered from the
+#station registry, and only coordinates away from every station go to the remote geocoder, through
+#a cache keyed on rounded coordinates, request coalescing and Nominatim's 1 req/s rate limit
+import logging
+
+from .caching import Coalescer, RateLimiter, TTLCache
+
+logger = logging.getLogger('transit_api')
+
+DEFAULT_PRECISION = 4 #decimal places coordinates are rounded to for caching, 4 is about 11 m
+DEFAULT_CACHE_SIZE = 4096
+DEFAULT_CACHE_TTL = 24 * 3600 #addresses hardly ever change
+DEFAULT_MIN_INTERVAL = 1.0 #Nominatim usage policy: at most 1 request per second
+DEFAULT_MAX_WAIT = 2.0 #seconds a caller waits for a rate limit slot before giving up
+DEFAULT_GAZETTEER_RADIUS_KM = 0.3 #how close coordinates must be to a station to count as "at" it
+
+_MISS = object() #cache sentinel, None is a valid cached answer ("no address here")
+
+
+#remote backend on a geopy geocoder (ex: Nominatim): (latitude, longitude) -> address or None
+def geopy_backend(geolocator, timeout=5):
+    def reverse(latitude, longitude):
+        location = geolocator.reverse((latitude, longitude), exactly_one=True, timeout=timeout)
+        return location.address if location else None
+    return reverse
+
+
+#offline gazetteer built from the station registry
+class Gazetteer:
+    def __init__(self, registry, radius_km=DEFAULT_GAZETTEER_RADIUS_KM):
+        self.registry = registry
+        self.radius_km = radius_km
+
+    #nearest station within radius_km, or None
+    def station_for(self, latitude, longitude):
+        matches = self.registry.nearest(latitude, longitude, k=1)
+        if matches and matches[0][0] <= self.radius_km:
+            return matches[0][1]
+        return None
+
+
+class CachedGeocoder:
+    def __init__(self, backend=None, gazetteer=None, precision=DEFAULT_PRECISION, cache_size=DEFAULT_CACHE_SIZE,
+                 ttl=DEFAULT_CACHE_TTL, min_interval=DEFAULT_MIN_INTERVAL, max_wait=DEFAULT_MAX_WAIT):
+        self.backend = backend #None means offline, only the gazetteer answers
+        self.gazetteer = gazetteer
+        self.precision = precision
+        self.max_wait = max_wait
+        self.cache = TTLCache(cache_size, ttl)
+        self.coalescer = Coalescer()
+        self.limiter = RateLimiter(min_interval)
+        self.remote_calls = 0
+
+    def _key(self, latitude, longitude):
+        return round(latitude, self.precision), round(longitude, self.precision)
+
+    #address for the coordinates from the remote backend, None when offline, rate limited or not found.
+    #answers (including "not found") are cached per rounded coordinate
+    def reverse(self, latitude, longitude):
+        if self.backend is None:
+            return None
+        key = self._key(latitude, longitude)
+        cached = self.cache.get(key, _MISS)
+        if cached is not _MISS:
+            return cached
+        return self.coalescer.run(key, lambda: self._lookup(key))
+
+    def _lookup(self, key):
+        cached = self.cache.get(key, _MISS) #another caller may have filled it while we queued
+        if cached is not _MISS:
+            return cached
+        if not self.limiter.acquire(self.max_wait):
+            logger.warning("Geocoder rate limited, skipping lookup for %s", key)
+            return None
+        self.remote_calls += 1
+        try:
+            address = self.backend(*key)
+        except Exception as e: #upstream trouble isn't cached, next caller tries again
+            logger.error("Reverse geocoding %s failed: %s", key, e)
+            return None
+        self.cache.set(key, address)
+        return address
+
+    #station at the coordinates: the gazetteer answers when a station is within its radius, otherwise
+    #the remote address is matched by name with `extract` (address -> station name or None)
+    def station_for(self, latitude, longitude, extract=None):
+        if self.gazetteer is not None:
+            station = self.gazetteer.station_for(latitude, longitude)
+            if station is not None:
+                return station
+        if extract is None or self.backend is None:
+            return None
+        address = self.reverse(latitude, longitude)
+        name = extract(address) if address else None
+        if name and self.gazetteer is not None:
+            return self.gazetteer.registry.find_by_name(name)
+        return None
+
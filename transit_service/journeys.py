@@ -0,0 +1,377 @@
+#journey planning across subway, LIRR and Metro North with RAPTOR (round-based public transit routing):
+#round k finds the earliest arrival at every stop using k trips, so the rounds give the Pareto set of
+#(arrival time, transfers) itineraries directly. The network is built from the static timetable with the
+#realtime delays laid over it: trips with the same stop sequence form a route, each route keeps one
+#departure and one arrival column per stop position (trips in order, so the earliest trip to catch is a
+#binary search), and footpaths connect the stops of a station and stations close to each other
+import bisect
+import logging
+import operator
+import threading
+import time
+from collections import namedtuple
+
+from .schedules import DEFAULT_TRANSFER_RADIUS_KM, stops_for_agency
+
+logger = logging.getLogger('transit_api')
+
+DEFAULT_MAX_TRANSFERS = 3
+DEFAULT_WINDOW = 4 * 3600 #seconds of service a network covers from when it was built
+DEFAULT_MIN_TRANSFER = 120 #seconds to change between platforms of a station
+DEFAULT_WALKING_SPEED = 1.2 #meters per second, between nearby stations
+DEFAULT_REBUILD_INTERVAL = 120 #seconds at least between rebuilds for new realtime versions
+WALK = 'walk'
+INFINITY = float('inf')
+
+#one part of a journey: a ride on a trip (mode is the agency) or a walk between stops (mode 'walk', no trip)
+Leg = namedtuple('Leg', ['mode', 'trip_id', 'route_id', 'origin_stop', 'destination_stop', 'departure', 'arrival'])
+#departure and arrival are posix timestamps, transfers is the number of changes between trips
+Journey = namedtuple('Journey', ['departure', 'arrival', 'transfers', 'legs'])
+
+
+#routes, trips and footpaths of a time window, as flat lists indexed by route / stop number
+class Network:
+    def __init__(self, start, end, versions):
+        self.start = start
+        self.end = end
+        self.versions = versions #realtime feed versions whose delays are in the times
+        self.stops = [] #stop number -> (agency, stop id)
+        self.stop_numbers = {} #(agency, stop code) -> stop number
+        self.route_stops = [] #route -> stop numbers in order
+        self.route_departures = [] #route -> per stop position, departure of every trip (ascending)
+        self.route_arrivals = [] #route -> per stop position, arrival of every trip
+        self.route_trips = [] #route -> (agency, trip, day start) per trip
+        self.stop_routes = [] #stop number -> [(route, position)]
+        self.footpaths = [] #stop number -> [(stop number, seconds)]
+
+    def __len__(self):
+        return len(self.stops)
+
+
+#(trip, day start) of every trip instance per agency that runs between start and end (posix)
+def scheduled_trips(timetables, start, end):
+    trips = {}
+    for agency, timetable in timetables.items():
+        trip_offsets, trip_services = timetable.trip_offsets, timetable.trip_services
+        row_departures, row_arrivals = timetable.row_departures, timetable.row_arrivals
+        instances = trips[agency] = []
+        for date, day in timetable.service_days_between(start, end):
+            active = timetable.active_services(date)
+            for trip in range(len(timetable)):
+                if active[trip_services[trip]] and day + row_departures[trip_offsets[trip]] <= end and \
+                        day + row_arrivals[trip_offsets[trip + 1] - 1] >= start:
+                    instances.append((trip, day))
+    return trips
+
+
+#the trip instances (see scheduled_trips) grouped into routes. delays is agency -> AgencyTimetable.overlay result
+def _add_routes(network, timetables, trips, delays):
+    patterns = {} #(agency, stop codes) -> [(departures, arrivals, trip reference)]
+    for agency, instances in trips.items():
+        timetable = timetables[agency]
+        agency_delays = delays.get(agency, {})
+        trip_offsets, row_departures, row_arrivals, row_stops = timetable.trip_offsets, timetable.row_departures, timetable.row_arrivals, timetable.row_stops
+        for trip, day in instances:
+            first, last = trip_offsets[trip], trip_offsets[trip + 1]
+            shift = agency_delays.get(trip)
+            shift = shift[2] if shift is not None and shift[0] == day else None
+            departures = [day + row_departures[row] for row in range(first, last)]
+            arrivals = [day + row_arrivals[row] for row in range(first, last)]
+            if shift is not None:
+                departures = list(map(operator.add, departures, shift))
+                arrivals = list(map(operator.add, arrivals, shift))
+            patterns.setdefault((agency, bytes(row_stops[first:last])), []).append((departures, arrivals, (agency, trip, day)))
+
+    for (agency, codes), pattern_trips in patterns.items():
+        stops = [network.stop_numbers[(agency, code)] for code in memoryview(codes).cast('I')]
+        pattern_trips.sort(key=lambda trip: trip[0][0])
+        #RAPTOR needs trips that never overtake each other, a trip that would is put in another route
+        routes = []
+        for trip in pattern_trips:
+            for route in routes:
+                previous = route[-1]
+                if min(map(operator.sub, trip[0], previous[0])) >= 0 and min(map(operator.sub, trip[1], previous[1])) >= 0:
+                    route.append(trip)
+                    break
+            else:
+                routes.append([trip])
+        for route in routes:
+            number = len(network.route_stops)
+            network.route_stops.append(stops)
+            network.route_departures.append([list(times) for times in zip(*(trip[0] for trip in route))])
+            network.route_arrivals.append([list(times) for times in zip(*(trip[1] for trip in route))])
+            network.route_trips.append([trip[2] for trip in route])
+            for position, stop in enumerate(stops):
+                network.stop_routes[stop].append((number, position))
+
+
+#footpaths between the stops of one station (min_transfer seconds) and between stations within
+#radius_km of each other (walking time on top)
+def _add_footpaths(network, timetables, registry, radius_km, walking_speed, min_transfer):
+    station_stops = {} #station id -> stop numbers
+    for station in registry.stations:
+        agency = station.get('agency', 'subway')
+        timetable = timetables.get(agency)
+        if timetable is not None:
+            numbers = [network.stop_numbers[(agency, code)] for code in timetable.stop_codes(station.get('gtfs_stops', []))]
+            if numbers:
+                station_stops[station['station_id']] = numbers
+    walks = [{} for _ in network.stops]
+    for station in registry.stations:
+        numbers = station_stops.get(station['station_id'])
+        if not numbers:
+            continue
+        nearby = [(0.0, station)] + registry.within(station['latitude'], station['longitude'], radius_km, exclude=[station['station_id']])
+        for distance_km, other in nearby:
+            seconds = min_transfer + int(distance_km * 1000 / walking_speed)
+            for target in station_stops.get(other['station_id'], ()):
+                for source in numbers:
+                    if source != target and seconds < walks[source].get(target, INFINITY):
+                        walks[source][target] = seconds
+    network.footpaths = [sorted(targets.items()) for targets in walks]
+
+
+#stop numbers of every agency's stops, in timetable order
+def _add_stops(network, timetables):
+    for agency, timetable in timetables.items():
+        for code, stop_id in enumerate(timetable.stop_ids):
+            network.stop_numbers[(agency, code)] = len(network.stops)
+            network.stops.append((agency, stop_id))
+
+
+#`base` is an earlier network of the same timetables: its stops and footpaths don't depend on the window
+#or the delays and are shared. `trips` are scheduled_trips(timetables, start, end) when already known
+def build_network(timetables, registry, start, end, delays=None, radius_km=DEFAULT_TRANSFER_RADIUS_KM,
+                  walking_speed=DEFAULT_WALKING_SPEED, min_transfer=DEFAULT_MIN_TRANSFER, versions=(), base=None, trips=None):
+    network = Network(start, end, versions)
+    if base is not None:
+        network.stops, network.stop_numbers, network.footpaths = base.stops, base.stop_numbers, base.footpaths
+    else:
+        _add_stops(network, timetables)
+    network.stop_routes = [[] for _ in network.stops]
+    _add_routes(network, timetables, trips if trips is not None else scheduled_trips(timetables, start, end), delays or {})
+    if base is None:
+        _add_footpaths(network, timetables, registry, radius_km, walking_speed, min_transfer)
+    return network
+
+
+def _versions(snapshots):
+    return tuple(sorted((snapshot.name, snapshot.version) for snapshot in snapshots))
+
+
+#RAPTOR from the origin stops at departure_time to any destination stop. Returns the Pareto-optimal
+#journeys, fewest transfers first, each one arriving earlier than the one before. A destination that is
+#an origin or a walk away gives a journey without trips first (no legs, or one walk)
+def raptor(network, origins, destinations, departure_time, max_transfers=DEFAULT_MAX_TRANSFERS):
+    stop_count = len(network)
+    best = [INFINITY] * stop_count #earliest arrival at each stop in any round so far
+    arrivals = [[INFINITY] * stop_count] #round -> earliest arrival per stop with at most that many trips
+    parents = [{}] #round -> stop -> how it was reached: (WALK, from stop) or (route, trip, boarding position, alighting position)
+    marked = set()
+    for origin in origins:
+        arrivals[0][origin] = best[origin] = departure_time
+        marked.add(origin)
+    for origin in list(marked):
+        for target, seconds in network.footpaths[origin]:
+            if departure_time + seconds < best[target]:
+                arrivals[0][target] = best[target] = departure_time + seconds
+                parents[0][target] = (WALK, origin)
+                marked.add(target)
+
+    journeys, best_target = [], INFINITY
+    reached = min(destinations, key=lambda stop: arrivals[0][stop], default=None)
+    if reached is not None and arrivals[0][reached] < INFINITY: #already there or a walk away, no trip to take
+        best_target = arrivals[0][reached]
+        journeys.append(_journey(network, arrivals, parents, 0, reached))
+    route_stops, route_departures, route_arrivals = network.route_stops, network.route_departures, network.route_arrivals
+    for trips in range(1, max_transfers + 2):
+        previous = arrivals[-1]
+        current = list(previous)
+        arrivals.append(current)
+        parents.append({})
+        round_parents = parents[-1]
+
+        queue = {} #route -> earliest marked position
+        for stop in marked:
+            for route, position in network.stop_routes[stop]:
+                if position < queue.get(route, INFINITY):
+                    queue[route] = position
+        marked = set()
+        for route, start in queue.items():
+            stops, departures, route_arrival = route_stops[route], route_departures[route], route_arrivals[route]
+            trip = None
+            for position in range(start, len(stops)):
+                stop = stops[position]
+                if trip is not None:
+                    arrival = route_arrival[position][trip]
+                    if arrival < best[stop] and arrival < best_target:
+                        current[stop] = best[stop] = arrival
+                        round_parents[stop] = (route, trip, boarded, position)
+                        marked.add(stop)
+                ready = previous[stop]
+                if ready < INFINITY and (trip is None or ready <= departures[position][trip]):
+                    earliest = bisect.bisect_left(departures[position], ready)
+                    if earliest < len(departures[position]) and (trip is None or earliest < trip):
+                        trip, boarded = earliest, position
+
+        for stop in list(marked): #walks only continue rides, never other walks
+            for target, seconds in network.footpaths[stop]:
+                arrival = current[stop] + seconds
+                if arrival < best[target] and arrival < best_target:
+                    current[target] = best[target] = arrival
+                    round_parents[target] = (WALK, stop)
+                    marked.add(target)
+
+        #only a destination this round's rides improved, the others keep the journey of an earlier round
+        reached = min((stop for stop in destinations if stop in round_parents), key=lambda stop: current[stop], default=None)
+        if reached is not None and current[reached] < best_target:
+            best_target = current[reached]
+            journeys.append(_journey(network, arrivals, parents, trips, reached))
+        if not marked:
+            break
+    return journeys
+
+
+#follows the parent pointers back from the destination stop reached in round `trips`. A stop keeps its
+#arrival in the rounds that didn't improve it, so its parent is in the last round that did
+def _journey(network, arrivals, parents, trips, stop):
+    legs, arrival = [], arrivals[trips][stop]
+    round_number = trips
+    while True:
+        while round_number > 0 and stop not in parents[round_number]:
+            round_number -= 1
+        parent = parents[round_number].get(stop)
+        if parent is None: #an origin
+            break
+        if parent[0] == WALK:
+            source = parent[1]
+            legs.append(Leg(WALK, None, None, network.stops[source][1], network.stops[stop][1],
+                            arrivals[round_number][source], arrivals[round_number][stop]))
+            stop = source
+            continue
+        route, trip, boarded, alighted = parent
+        agency, trip_index, _ = network.route_trips[route][trip]
+        origin = network.route_stops[route][boarded]
+        legs.append(Leg(agency, trip_index, None, network.stops[origin][1], network.stops[stop][1],
+                        network.route_departures[route][boarded][trip], network.route_arrivals[route][alighted][trip]))
+        stop = origin
+        round_number -= 1
+    legs.reverse()
+    rides = [leg for leg in legs if leg.mode != WALK]
+    if not rides: #round 0: the origin itself, or a walk from it
+        return Journey(legs[0].departure if legs else arrival, arrival, 0, legs)
+    return Journey(rides[0].departure, legs[-1].arrival, len(rides) - 1, legs)
+
+
+#owns the network: built in warm_up, then rebuilt in a background thread while requests keep using the
+#previous one. A rebuild moves the window ahead once a query gets within half a window of its end, and
+#otherwise brings in new realtime versions, at most once every rebuild_interval seconds: each one is a
+#pass over every trip of the window, in every worker. A query never waits for a build, one the network
+#doesn't cover (before warm_up finished, or after hours without requests) has no journeys until the
+#background build is done
+class JourneyPlanner:
+    def __init__(self, timetable, registry, window=DEFAULT_WINDOW, radius_km=DEFAULT_TRANSFER_RADIUS_KM,
+                 walking_speed=DEFAULT_WALKING_SPEED, min_transfer=DEFAULT_MIN_TRANSFER, max_transfers=DEFAULT_MAX_TRANSFERS,
+                 rebuild_interval=DEFAULT_REBUILD_INTERVAL, clock=time.monotonic):
+        self.timetables = dict(timetable.agencies)
+        self.registry = registry
+        self.window = window
+        self.radius_km = radius_km
+        self.walking_speed = walking_speed
+        self.min_transfer = min_transfer
+        self.max_transfers = max_transfers
+        self.rebuild_interval = rebuild_interval
+        self.clock = clock
+        self.rebuilds = 0
+        self._network = None
+        self._built_at = -INFINITY #clock() of the last build
+        self._trips = (None, None, None) #(start, end, scheduled_trips) of the last window
+        self._lock = threading.Lock()
+        self._rebuilding = False
+
+    #network with the delays of `snapshots` for the window starting at `now` (or the given start and end)
+    def build(self, snapshots, now, start=None, end=None):
+        started = time.perf_counter()
+        #trips that left up to an hour ago can still be running late into the window
+        start, end = (now - 3600, now + self.window) if start is None else (start, end)
+        delays = {}
+        for agency, timetable in self.timetables.items():
+            agency_snapshots = [snapshot for snapshot in snapshots if snapshot.agency == agency]
+            if agency_snapshots:
+                delays[agency] = timetable.overlay(agency_snapshots, now)
+        trips_start, trips_end, trips = self._trips
+        if (trips_start, trips_end) != (start, end):
+            trips = scheduled_trips(self.timetables, start, end)
+            self._trips = (start, end, trips)
+        network = build_network(self.timetables, self.registry, start, end, delays, self.radius_km, self.walking_speed,
+                                self.min_transfer, _versions(snapshots), base=self._network, trips=trips)
+        logger.info("Built journey network: %s routes, %s stops in %.2fs", len(network.route_stops), len(network),
+                    time.perf_counter() - started)
+        return network
+
+    #builds and installs the network for `now` on this thread, for warm_up
+    def warm(self, snapshots, now):
+        return self._install(self.build(snapshots, now))
+
+    #network covering `now` with the delays of `snapshots`, None while it is being built, see the class comment
+    def network(self, snapshots, now):
+        network = self._network
+        if network is None or now < network.start or now >= network.end:
+            self._rebuild_in_background(snapshots, now, None, None)
+            return None
+        if now + self.window / 2 > network.end:
+            self._rebuild_in_background(snapshots, now, None, None)
+        elif network.versions != _versions(snapshots) and self.clock() - self._built_at >= self.rebuild_interval:
+            self._rebuild_in_background(snapshots, now, network.start, network.end)
+        return network
+
+    def _install(self, network):
+        self._network, self._built_at = network, self.clock()
+        self.rebuilds += 1
+        return network
+
+    def _rebuild_in_background(self, snapshots, now, start, end):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild, args=(snapshots, now, start, end), name='journey-network', daemon=True).start()
+
+    def _rebuild(self, snapshots, now, start, end):
+        try:
+            self._install(self.build(snapshots, now, start, end))
+        except Exception as e: #keep planning on the previous network
+            logger.error("Journey network rebuild failed: %s", e)
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+    #stop numbers of a station for every agency with a timetable, co-located stations of other agencies included
+    def station_stops(self, network, station_id):
+        numbers = []
+        for agency, timetable in self.timetables.items():
+            for code in timetable.stop_codes(stops_for_agency(self.registry, station_id, agency, self.radius_km)):
+                numbers.append(network.stop_numbers[(agency, code)])
+        return numbers
+
+    #Pareto-optimal journeys between two stations leaving at departure_time or later, with trip and
+    #route ids filled in. None while the network for departure_time is being built
+    def plan(self, origin_station_id, destination_station_id, departure_time, snapshots=()):
+        network = self.network(snapshots, departure_time)
+        if network is None:
+            return None
+        origins = self.station_stops(network, origin_station_id)
+        destinations = self.station_stops(network, destination_station_id)
+        if not origins or not destinations:
+            return []
+        journeys = []
+        for journey in raptor(network, origins, destinations, departure_time, self.max_transfers):
+            legs = []
+            for leg in journey.legs:
+                if leg.mode != WALK:
+                    timetable = self.timetables[leg.mode]
+                    leg = leg._replace(trip_id=timetable.trip_ids[leg.trip_id], route_id=timetable.route_ids[leg.trip_id])
+                legs.append(leg)
+            journeys.append(journey._replace(legs=legs))
+        return journeys
+
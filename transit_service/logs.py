@@ -0,0 +1,168 @@
+#logging setup: request threads only put records on a queue, a background listener thread formats
+#and writes them (console + rotating file), one JSON object per line. Debug records are rate-limited
+#per message template before they are queued, so per-trip / per-stop debug output can stay in the
+#code without flooding the log or slowing requests down
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+DEFAULT_LOG_LEVEL = 'INFO'
+DEFAULT_LOG_FILE = 'transit_api.log'
+DEFAULT_DEBUG_BURST = 20 #debug records let through per message template and interval
+DEFAULT_DEBUG_INTERVAL = 10.0 #seconds
+QUEUE_SIZE = 10000 #records waiting for the writer, beyond that new ones are dropped instead of blocking
+
+#LogRecord attributes that aren't "extra" fields
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+#one JSON object per line: time, level, logger, message, plus any `extra` fields of the call
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text: #rendered before the record was queued
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+#lets at most `burst` records per message template through every `interval` seconds, for records at
+#or below `max_level` (DEBUG by default). The first record after a suppressed stretch carries the
+#number of dropped records in its `suppressed` field. Templates are the unformatted msg, so
+#"Matched trip %s" is one key no matter how many trips there are
+class RateLimitFilter(logging.Filter):
+    def __init__(self, burst=DEFAULT_DEBUG_BURST, interval=DEFAULT_DEBUG_INTERVAL, max_level=logging.DEBUG, clock=time.monotonic):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.max_level = max_level
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._windows = {} #template -> [window start, records let through, records suppressed]
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        key = (record.name, record.msg if isinstance(record.msg, str) else type(record.msg).__name__)
+        now = self.clock()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                window = self._windows[key] = [now, 0, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+            if window[1] >= self.burst:
+                window[2] += 1
+                return False
+            window[1] += 1
+            return True
+
+
+#queue handler that formats the message lazily in the writer thread: records are queued with their
+#args untouched, only exc_info is rendered up front since tracebacks can't cross threads safely later
+class _LazyQueueHandler(QueueHandler):
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full: #never block a request on logging
+            pass
+
+
+_listener = None
+_queue_handler = None
+
+
+#configures the transit_api logger. Records go through a bounded queue to a listener thread that
+#writes them to the console and a rotating file. Calling it again keeps the existing setup unless
+#force is True (ex: benchmarks switching levels). stream is the console stream, stderr by default
+def setup_logging(level=None, log_format=None, log_file=None, force=False, stream=None):
+    global _listener, _queue_handler
+    logger = logging.getLogger('transit_api')
+    if logger.handlers and not force: #already set up, ex: a second create_app() in the same process
+        return logger
+    stop_logging()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+    level = (level or os.getenv('LOG_LEVEL', DEFAULT_LOG_LEVEL)).upper()
+    log_format = log_format or os.getenv('LOG_FORMAT', 'json')
+    log_file = os.getenv('LOG_FILE', DEFAULT_LOG_FILE) if log_file is None else log_file
+    logger.setLevel(level)
+    logger.propagate = False #our handlers write everything, a root handler would format on the request thread again
+
+    if log_format == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handlers = [logging.StreamHandler(stream)]
+    if log_file: #LOG_FILE= (empty) logs to the console only
+        handlers.append(RotatingFileHandler(log_file, maxBytes=10 * 1024 * 1024, backupCount=5))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.Queue(QUEUE_SIZE)
+    _queue_handler = _LazyQueueHandler(records)
+    _queue_handler.addFilter(RateLimitFilter())
+    logger.addHandler(_queue_handler)
+    _listener = QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    return logger
+
+
+#LOG_FILE for one of several processes logging side by side (gunicorn workers, the publisher): console
+#only unless LOG_FILE is set, and then with the process id in the name, ex: transit_api.4242.log, so no
+#two processes rotate the same file
+def process_log_file():
+    log_file = os.getenv('LOG_FILE', '')
+    if not log_file:
+        return ''
+    stem, extension = os.path.splitext(log_file)
+    return f"{stem}.{os.getpid()}{extension}"
+
+
+#a forked child (ex: a gunicorn worker) has no writer thread, and the old queue's lock may have been
+#held at fork time: give the child a fresh queue and its own listener on the same handlers
+def _restart_after_fork():
+    global _listener
+    if _listener is None:
+        return
+    records = queue.Queue(QUEUE_SIZE)
+    _queue_handler.queue = records
+    _listener = QueueListener(records, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+#flushes and stops the writer thread, runs at exit
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        listener, _listener = _listener, None
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+atexit.register(stop_logging)
+os.register_at_fork(after_in_child=_restart_after_fork)
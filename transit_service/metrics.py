@@ -0,0 +1,184 @@
+#in-process metrics exposed in the Prometheus text format at /metrics: latency histograms per request
+#stage and per feed, counters for responses and upstream failures, and values read only when scraped
+#(cache hits, feed versions). Recording a sample is a bisect and a few additions under a per-metric
+#lock, cheap enough to stay on in production. A request sending the profile header also gets its
+#own stage breakdown back in a Server-Timing header
+import bisect
+import re
+import threading
+import time
+
+#seconds, from a cached answer (well under 1 ms) to a slow upstream
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROFILE_HEADER = 'X-Transit-Profile' #request header asking for the stage breakdown, ex: X-Transit-Profile: 1
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+#label values need backslashes, quotes and newlines escaped
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+#upstream error marker (fetch.FetchResult.error) as a label value: 'HTTP 503' -> 'http_503',
+#'connection error' -> 'connection_error', 'timeout' stays
+def error_label(error):
+    return re.sub(r'[^a-z0-9]+', '_', str(error).lower()).strip('_') or 'unknown'
+
+
+def _number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {} #label values -> count
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        lines += [f"{self.name}{_labels(self.labels, key)} {_number(value)}" for key, value in values]
+        return lines
+
+
+#cumulative histogram per label combination: bucket counts, sum and count of the observed values
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {} #label values -> [count per bucket (+Inf last), sum, count]
+
+    def observe(self, value, *label_values):
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][slot] += 1
+            series[1] += value
+            series[2] += 1
+
+    #(sum, count) of one series, (0.0, 0) when nothing was observed
+    def totals(self, *label_values):
+        series = self._series.get(label_values)
+        return (series[1], series[2]) if series else (0.0, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {count}")
+        return lines
+
+
+#a metric computed when scraped: fn() returns (label values, value) pairs, ex: cache hits read off a TTLCache
+class Collected:
+    def __init__(self, name, help, kind, labels, fn):
+        self.name = name
+        self.help = help
+        self.kind = kind #'counter' or 'gauge'
+        self.labels = tuple(labels)
+        self.fn = fn
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{self.name}{_labels(self.labels, key)} {_number(value)}" for key, value in self.fn()]
+        return lines
+
+
+#stage timings of one profiled request, summed per stage (a batch runs every stage once per query)
+class Profile:
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    #Server-Timing header value, durations in milliseconds, ex: "geocode;dur=0.210, subway;dur=1.804"
+    def server_timing(self):
+        return ", ".join(f"{stage};dur={seconds * 1000:.3f}" for stage, seconds in self.stages.items())
+
+
+#times a `with` block into a histogram series and, when given, a request profile under `stage`
+class Timer:
+    __slots__ = ('histogram', 'labels', 'stage', 'profile', 'started')
+
+    def __init__(self, histogram, labels, stage, profile=None):
+        self.histogram = histogram
+        self.labels = labels
+        self.stage = stage
+        self.profile = profile
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        self.histogram.observe(elapsed, *self.labels)
+        if self.profile is not None:
+            self.profile.add(self.stage, elapsed)
+
+
+#the service's metrics, one instance per app (TransitServices.metrics)
+class Metrics:
+    def __init__(self):
+        self.requests = Histogram('transit_request_seconds', "Request latency per endpoint", ['endpoint'])
+        self.responses = Counter('transit_responses_total', "Responses per endpoint and HTTP status", ['endpoint', 'status'])
+        self.stages = Histogram('transit_stage_seconds', "Time spent per request stage", ['stage'])
+        self.feeds = Histogram('transit_feed_seconds', "Feed polling time per feed and step (fetch, decode, index)", ['feed', 'step'])
+        self.upstream_failures = Counter('transit_upstream_failures_total', "Failed upstream calls per call and error, ex: timeout",
+                                         ['call', 'error'])
+        self._metrics = [self.requests, self.responses, self.stages, self.feeds, self.upstream_failures]
+
+    def add_collected(self, name, help, kind, labels, fn):
+        self._metrics.append(Collected(name, help, kind, labels, fn))
+
+    #`with metrics.stage('geocode', profile):` times the block
+    def stage(self, name, profile=None):
+        return Timer(self.stages, (name,), name, profile)
+
+    #records a stage timed elsewhere, ex: the elapsed time of a Fetcher.run_all call
+    def record_stage(self, name, seconds, profile=None):
+        self.stages.observe(seconds, name)
+        if profile is not None:
+            profile.add(name, seconds)
+
+    #a failed upstream call, the error marker normalised with error_label
+    def upstream_failure(self, call, error):
+        self.upstream_failures.inc(call, error_label(error))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,220 @@
+#record/replay of upstream traffic: a capture is a directory of raw response bodies (GTFS-rt feeds,
+#BusTime JSON) plus index.jsonl, one line per response with its url and the second it was received at.
+#Both sides are requests transport adapters mounted on the fetchers' sessions, so the service runs its
+#normal code paths: UPSTREAM_CAPTURE records every upstream response, UPSTREAM_REPLAY serves a capture
+#back offline at the recorded timing (UPSTREAM_REPLAY_SPEED=10 runs it 10x faster, 0 hands each
+#request the url's next recorded response). BusTime API keys are stripped before anything is written
+#    python -m transit_service.replay record --output capture/ --duration 600 --query '{"origin_station_id": "CH01", ...}'
+import argparse
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from requests import Response
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+logger = logging.getLogger('transit_api')
+
+INDEX = 'index.jsonl'
+SECRET_PARAMS = ('key',) #query parameters never written to a capture, ex: the BusTime API key
+
+#one recorded response: seconds since the capture started, status, content type and body file name
+Exchange = namedtuple('Exchange', ['offset', 'status', 'content_type', 'body'])
+
+
+#url as a capture key: secret parameters dropped and the rest sorted, so replay matches whatever key
+#or parameter order the replaying service uses
+def capture_url(url):
+    parts = urlsplit(url)
+    query = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True) if name not in SECRET_PARAMS)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ''))
+
+
+#appends responses to a capture directory, shared by every session recording into it
+class CaptureWriter:
+    def __init__(self, directory, clock=time.time):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.clock = clock
+        self.started = clock()
+        self.count = 0
+        self._lock = threading.Lock()
+        self._index = open(os.path.join(directory, INDEX), 'a', encoding='utf-8')
+
+    def write(self, url, status, content_type, body):
+        offset = round(self.clock() - self.started, 3)
+        with self._lock:
+            if self._index.closed: #a call finishing after the service closed
+                return
+            name = f"{self.count:06d}.bin"
+            self.count += 1
+            with open(os.path.join(self.directory, name), 'wb') as body_file:
+                body_file.write(body)
+            entry = {"offset": offset, "url": capture_url(url), "status": status, "content_type": content_type, "body": name}
+            self._index.write(json.dumps(entry) + "\n")
+            self._index.flush()
+
+    def close(self):
+        with self._lock:
+            self._index.close()
+
+
+#a recorded capture: url -> exchanges in the order they were received. Bodies are read from disk when served
+class Capture:
+    def __init__(self, directory, exchanges):
+        self.directory = directory
+        self.exchanges = exchanges
+
+    @classmethod
+    def load(cls, directory):
+        exchanges = {}
+        with open(os.path.join(directory, INDEX), encoding='utf-8') as index:
+            for line in filter(None, (line.strip() for line in index)):
+                entry = json.loads(line)
+                exchanges.setdefault(entry['url'], []).append(Exchange(entry['offset'], entry['status'], entry['content_type'], entry['body']))
+        for recorded in exchanges.values():
+            recorded.sort(key=lambda exchange: exchange.offset)
+        return cls(directory, exchanges)
+
+    #seconds between the first and the last recorded response
+    @property
+    def duration(self):
+        offsets = [exchange.offset for recorded in self.exchanges.values() for exchange in recorded]
+        return max(offsets) - min(offsets) if offsets else 0.0
+
+    def body(self, exchange):
+        with open(os.path.join(self.directory, exchange.body), 'rb') as body_file:
+            return body_file.read()
+
+
+#sends through the session's own adapter (keeps its connection pool) and records what came back
+class RecordingAdapter(BaseAdapter):
+    def __init__(self, adapter, writer):
+        super().__init__()
+        self.adapter = adapter
+        self.writer = writer
+
+    def send(self, request, **kwargs):
+        response = self.adapter.send(request, **kwargs)
+        self.writer.write(request.url, response.status_code, response.headers.get('Content-Type', ''), response.content)
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+#serves a capture instead of the network. With speed > 0 a url gets the response recorded last before
+#the replay clock (started when the adapter was created, running `speed` times faster than the capture),
+#or the first one before that; with speed 0 every request gets the url's next response, the last one
+#repeating. Urls missing from the capture get 404
+class ReplayAdapter(BaseAdapter):
+    def __init__(self, capture, speed=1.0, clock=time.monotonic):
+        super().__init__()
+        self.capture = capture
+        self.speed = speed
+        self.clock = clock
+        self.started = clock()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._positions = {} #url -> next exchange, speed 0
+        self._offsets = {url: [exchange.offset for exchange in recorded] for url, recorded in capture.exchanges.items()}
+        self._first = min((offsets[0] for offsets in self._offsets.values()), default=0.0)
+
+    def exchange_for(self, url):
+        recorded = self.capture.exchanges.get(url)
+        if not recorded:
+            return None
+        if self.speed <= 0:
+            with self._lock:
+                position = self._positions.get(url, 0)
+                self._positions[url] = min(position + 1, len(recorded) - 1)
+            return recorded[position]
+        replayed = self._first + (self.clock() - self.started) * self.speed
+        return recorded[max(0, bisect.bisect_right(self._offsets[url], replayed) - 1)]
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        exchange = self.exchange_for(capture_url(request.url))
+        response = Response()
+        response.request = request
+        response.url = request.url
+        if exchange is None:
+            self.misses += 1
+            response.status_code, response.reason, response._content = 404, 'Not Recorded', b'not recorded'
+            response.headers = CaseInsensitiveDict({'Content-Type': 'text/plain'})
+        else:
+            self.hits += 1
+            response.status_code, response.reason, response._content = exchange.status, 'Replayed', self.capture.body(exchange)
+            response.headers = CaseInsensitiveDict({'Content-Type': exchange.content_type})
+        return response
+
+    def close(self):
+        pass
+
+
+def _mount(session, adapter):
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+
+#points a fetcher's session at a capture (replay) or records through it, per the UPSTREAM_* settings.
+#writer / replay are the CaptureWriter and ReplayAdapter every session of the service shares
+def route_session(session, writer=None, replay=None):
+    if replay is not None:
+        _mount(session, replay)
+    elif writer is not None:
+        _mount(session, RecordingAdapter(session.get_adapter('https://'), writer))
+
+
+#records a capture with the service itself: feeds are polled as usual and the given /api/transit
+#queries are asked every `interval` seconds, so their bus calls get recorded too
+def record(output, duration, queries=(), interval=30.0):
+    from .app import create_app, warm_up
+    app = create_app({"UPSTREAM_CAPTURE": output, "UPSTREAM_REPLAY": "", "RESPONSE_CACHE_TTL": 0})
+    services = app.extensions['transit']
+    warm_up(app)
+    client = app.test_client()
+    ends = time.monotonic() + duration
+    try:
+        while True:
+            for query in queries:
+                response = client.post('/api/transit', json=query)
+                logger.info("Recorded query: HTTP %s", response.status_code)
+            if time.monotonic() + interval > ends:
+                break
+            time.sleep(interval)
+    finally:
+        services.close()
+    return services.capture_writer.count if services.capture_writer is not None else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m transit_service.replay', description="Record upstream traffic for offline replay")
+    commands = parser.add_subparsers(dest='command', required=True)
+    recorder = commands.add_parser('record', help="poll the configured feeds (and ask --query bodies) while recording")
+    recorder.add_argument('--output', required=True, help="capture directory, appended to when it exists")
+    recorder.add_argument('--duration', type=float, default=300, help="seconds to record")
+    recorder.add_argument('--interval', type=float, default=30, help="seconds between rounds of --query requests")
+    recorder.add_argument('--query', action='append', default=[], help="/api/transit request body (JSON), repeatable")
+    inspector = commands.add_parser('info', help="urls and responses in a capture")
+    inspector.add_argument('capture')
+    args = parser.parse_args(argv)
+
+    if args.command == 'record':
+        count = record(args.output, args.duration, [json.loads(query) for query in args.query], args.interval)
+        print(f"Recorded {count} responses into {args.output}")
+    else:
+        capture = Capture.load(args.capture)
+        for url, recorded in sorted(capture.exchanges.items()):
+            print(f"{len(recorded):5d}  {url}")
+        print(f"{sum(map(len, capture.exchanges.values()))} responses over {capture.duration:.0f}s")
+
+
+if __name__ == '__main__':
+    main()
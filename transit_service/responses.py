@@ -0,0 +1,51 @@
+#response caching for the transit endpoints: answers are cached per query together with the versions
+#of the feed snapshots they were computed from, so a new feed version means a new key and the old
+#entries just age out. The ETag is a hash of the body, a client polling again with If-None-Match
+#gets 304 Not Modified for as long as its answer stays the same, even after the entry expired
+import hashlib
+import json
+import time
+from collections import namedtuple
+
+from .caching import TTLCache
+
+DEFAULT_RESPONSE_CACHE_TTL = 15 #seconds, bounds how long departures that already left or old bus predictions are served
+DEFAULT_RESPONSE_CACHE_SIZE = 4096
+DEFAULT_MAX_BATCH_QUERIES = 100 #origin/destination pairs per batch request
+
+#one answered query: HTTP status, response body, ETag (None for errors) and the seconds a client may reuse it
+Answer = namedtuple('Answer', ['status', 'payload', 'etag', 'max_age'])
+CachedResponse = namedtuple('CachedResponse', ['payload', 'etag', 'expires_at'])
+
+
+#strong ETag of a JSON body, the same body always gets the same tag
+def etag_for(payload):
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, separators=(',', ':')).encode()).hexdigest()[:20]
+
+
+#cache key of a parsed query. Coordinates are rounded like the geocoder's (precision decimals), versions
+#is FeedStore.versions() of the snapshots the answer is computed from
+def response_key(query, versions, precision):
+    return (query['origin_station_id'], query['destination_station_id'], round(query['latitude'], precision),
+            round(query['longitude'], precision), query['allow_stale'], versions)
+
+
+class ResponseCache:
+    def __init__(self, maxsize=DEFAULT_RESPONSE_CACHE_SIZE, ttl=DEFAULT_RESPONSE_CACHE_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = TTLCache(maxsize, ttl, clock)
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    #stores a body and returns its CachedResponse, nothing is kept when ttl is 0 (cache disabled)
+    def put(self, key, payload):
+        cached = CachedResponse(payload, etag_for(payload), self.clock() + self.ttl)
+        if self.ttl > 0:
+            self.entries.set(key, cached)
+        return cached
+
+    #whole seconds the entry stays valid, what clients are told in Cache-Control
+    def max_age(self, cached):
+        return max(0, int(cached.expires_at - self.clock()))
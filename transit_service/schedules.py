@@ -0,0 +1,59 @@
+#rail schedule matching shared by subway, LIRR and Metro North: a station is mapped to the stop ids of
+#the agency whose feeds are searched, trips are matched through each feed's StopIndex and only the
+#next few departures are returned, so response size and CPU don't grow with the feed
+import heapq
+from collections import namedtuple
+
+DEFAULT_SCHEDULE_LIMIT = 10 #departures returned per mode
+DEFAULT_TRANSFER_RADIUS_KM = 0.4 #stations of other agencies this close count as the same place, ex: Penn Station
+
+#one matched trip. departure is when it leaves the origin stop, arrival when it gets to the
+#destination stop (posix timestamps)
+Departure = namedtuple('Departure', ['agency', 'trip_id', 'route_id', 'origin_stop', 'destination_stop', 'departure', 'arrival'])
+
+
+#GTFS stop ids of `agency` for a station: its own gtfs_stops when it belongs to that agency, plus
+#those of the agency's stations within radius_km, ex: subway Penn Station -> LIRR stop 237.
+#stations without an agency are subway stations
+def stops_for_agency(registry, station_id, agency, radius_km=DEFAULT_TRANSFER_RADIUS_KM):
+    station = registry.get(station_id)
+    if station is None:
+        return []
+    candidates = [station] + [nearby for _, nearby in registry.within(station['latitude'], station['longitude'], radius_km)]
+    stops = []
+    for candidate in candidates:
+        if candidate.get('agency', 'subway') == agency:
+            stops.extend(candidate.get('gtfs_stops', []))
+    return list(dict.fromkeys(stops)) #drop duplicates, keep order
+
+
+#the `limit` earliest departures from an origin stop to a later destination stop, over the given
+#feed snapshots. Trips leaving before `now` are skipped (None keeps them all), each trip counts
+#once, with its first origin stop and the first destination stop after it
+def find_departures(snapshots, origin_stops, destination_stops, now=None, limit=DEFAULT_SCHEDULE_LIMIT):
+    if not origin_stops or not destination_stops or limit <= 0:
+        return []
+    candidates = []
+    for snapshot in snapshots:
+        index = snapshot.index
+        seen = set()
+        for origin, destination in index.find_trips(origin_stops, destination_stops):
+            if origin.trip in seen: #pairs come sorted by trip and stop order, the first one wins
+                continue
+            seen.add(origin.trip)
+            departure = origin.departure or origin.arrival #first stops often only have a departure
+            arrival = destination.arrival or destination.departure
+            if not departure or not arrival or (now is not None and departure < now):
+                continue
+            trip = index.trips[origin.trip]
+            candidates.append(Departure(snapshot.agency, trip.trip_id, trip.route_id, origin.stop_id,
+                                        destination.stop_id, departure, arrival))
+    return heapq.nsmallest(limit, candidates, key=lambda match: (match.departure, match.arrival))
+
+
+#realtime departures (find_departures) plus scheduled ones (see timetable.py) of the trips the realtime
+#answer doesn't have, the `limit` earliest. trip_key maps both kinds of trip id to one key
+def merge_departures(realtime, scheduled, limit=DEFAULT_SCHEDULE_LIMIT, trip_key=lambda trip_id: trip_id):
+    listed = {trip_key(match.trip_id) for match in realtime}
+    merged = list(realtime) + [match for match in scheduled if trip_key(match.trip_id) not in listed]
+    return heapq.nsmallest(limit, merged, key=lambda match: (match.departure, match.arrival))
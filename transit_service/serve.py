@@ -0,0 +1,125 @@
+#production launcher: one feed publisher process plus gunicorn workers that share its snapshots
+#    python -m transit_service.serve --workers 4 --bind 0.0.0.0:5000
+#    python -m transit_service.serve --publisher-only --snapshot-dir /shared/feeds  (publisher on its own)
+#the publisher polls and decodes every feed and writes the snapshots to SNAPSHOT_DIR, workers map
+#them read-only (see snapshots.py) so adding workers adds no MTA traffic and no decoding.
+#with --stream-bind (or STREAM_BIND) one more process streams schedule updates over Server-Sent Events
+#on that address, following the same snapshots (see streaming.py).
+#`kill -HUP <launcher pid>` reloads the workers gracefully: new workers warm up and start serving
+#while the old ones finish their requests, the publisher keeps running
+import argparse
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+
+from gunicorn.app.base import BaseApplication
+
+from .app import create_app, warm_up
+from .logs import process_log_file, setup_logging
+from .services import TransitServices, load_config
+
+logger = logging.getLogger('transit_api')
+
+
+#publisher process: polls the feeds in the background and writes every new version out, until SIGTERM
+def publish_feeds(config):
+    setup_logging(log_file=process_log_file())
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stopped.set())
+    signal.signal(signal.SIGINT, lambda *args: stopped.set())
+    services = TransitServices(load_config(config))
+    services.publish_snapshots()
+    updated = services.feed_poller.refresh_all()
+    logger.info("Feed publisher: %s of %s feeds written to %s", sum(updated.values()), len(updated), config['SNAPSHOT_DIR'])
+    services.feed_poller.start()
+    stopped.wait()
+    services.close()
+
+
+#gunicorn application: every worker creates its own app after the fork and warms it up on the
+#shared snapshots before it takes requests. Workers log to the console, or to a file of their own
+#when LOG_FILE is set (see logs.process_log_file)
+class TransitApplication(BaseApplication):
+    def __init__(self, options, config):
+        self.options = options
+        self.config = config
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        setup_logging(log_file=process_log_file(), force=True) #not the launcher's handlers inherited through the fork
+        app = create_app(self.config)
+        warm_up(app)
+        return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the transit API with gunicorn workers sharing one feed publisher")
+    parser.add_argument('--bind', default=os.getenv('BIND', '0.0.0.0:5000'))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEB_WORKERS', os.cpu_count() or 1)))
+    #requests mostly wait on BusTime and the fan-out, a few threads per worker keep the core busy
+    parser.add_argument('--threads', type=int, default=int(os.getenv('WEB_THREADS', 4)))
+    parser.add_argument('--timeout', type=int, default=int(os.getenv('WEB_TIMEOUT', 30)))
+    parser.add_argument('--snapshot-dir', default=os.getenv('SNAPSHOT_DIR', ''),
+                        help="where the publisher writes feed snapshots, a temporary directory by default")
+    parser.add_argument('--stream-bind', default=os.getenv('STREAM_BIND', ''),
+                        help="host:port of the schedule update stream, off when empty")
+    parser.add_argument('--publisher-only', action='store_true', help="only run the feed publisher, ex: in its own container")
+    parser.add_argument('--no-publisher', action='store_true', help="only run the workers, snapshots come from --snapshot-dir")
+    args = parser.parse_args(argv)
+    if args.no_publisher and not args.snapshot_dir:
+        parser.error("--no-publisher needs the --snapshot-dir another publisher writes to")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging(log_file=process_log_file())
+    if args.publisher_only:
+        publish_feeds({"SNAPSHOT_DIR": args.snapshot_dir or 'snapshots'})
+        return
+    snapshot_dir = args.snapshot_dir or tempfile.mkdtemp(prefix='transit-snapshots-')
+    publisher = None
+    if not args.no_publisher:
+        #a separate interpreter rather than a fork: gunicorn forks its workers from this process, and they
+        #mustn't inherit the publisher as a child of their own
+        publisher = subprocess.Popen([sys.executable, '-m', 'transit_service.serve', '--publisher-only', '--snapshot-dir', snapshot_dir])
+    #one event loop holds every stream connection, so the stream gets a process of its own rather than one per worker
+    streamer = None
+    if args.stream_bind:
+        streamer = subprocess.Popen([sys.executable, '-m', 'transit_service.streaming', '--bind', args.stream_bind, '--snapshot-dir', snapshot_dir])
+    options = {
+        'bind': args.bind,
+        'workers': args.workers,
+        'worker_class': 'gthread',
+        'threads': args.threads,
+        'timeout': args.timeout,
+        'graceful_timeout': args.timeout,
+        'proc_name': 'transit-api',
+    }
+    logger.info("Serving on %s with %s workers, feed snapshots in %s", args.bind, args.workers, snapshot_dir)
+    try:
+        TransitApplication(options, {"FEED_SOURCE": "shared", "SNAPSHOT_DIR": snapshot_dir}).run()
+    finally:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL) #the arbiter's handler would reap our children under us
+        for child in (publisher, streamer):
+            if child is not None:
+                child.terminate()
+                try:
+                    child.wait(10)
+                except subprocess.TimeoutExpired:
+                    child.kill()
+        if not args.snapshot_dir:
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
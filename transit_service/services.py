@@ -0,0 +1,359 @@
+#configuration and the long-lived objects the request handlers share (fetcher, feed store and poller,
+#station registry, geocoder). Everything expensive is built on first use or in warm_up(), so
+#creating an app makes no network calls and reads no data files
+import logging
+import os
+import threading
+import time
+from zoneinfo import ZoneInfoNotFoundError
+
+from dotenv import load_dotenv
+
+from .buses import (BusService, BusTimeClient, DEFAULT_BUS_AGENCIES, DEFAULT_BUS_API_URL, DEFAULT_CATALOGUE_INTERVAL, DEFAULT_CATALOGUE_WORKERS,
+                    DEFAULT_STOP_RADIUS_KM, DEFAULT_VISITS_TTL)
+from .feeds import FeedConfig, FeedPoller, FeedStore, feed_name, DEFAULT_POLL_INTERVAL, DEFAULT_MAX_STALENESS
+from .fetch import Fetcher, DEFAULT_CALL_TIMEOUT, DEFAULT_DEADLINE, DEFAULT_WORKERS
+from .geocoding import (CachedGeocoder, Gazetteer, geopy_backend, DEFAULT_CACHE_SIZE, DEFAULT_CACHE_TTL,
+                        DEFAULT_GAZETTEER_RADIUS_KM, DEFAULT_MIN_INTERVAL, DEFAULT_PRECISION)
+from .metrics import Metrics
+from .replay import Capture, CaptureWriter, ReplayAdapter, route_session
+from .responses import ResponseCache, DEFAULT_MAX_BATCH_QUERIES, DEFAULT_RESPONSE_CACHE_SIZE, DEFAULT_RESPONSE_CACHE_TTL
+from .schedules import DEFAULT_SCHEDULE_LIMIT, DEFAULT_TRANSFER_RADIUS_KM
+from .snapshots import SnapshotFollower, SnapshotWriter
+from .stations import StationRegistry, parse_stops_setting
+from .streaming import DEFAULT_HEARTBEAT, DEFAULT_MAX_PAIRS, DEFAULT_QUEUE_SIZE
+from .timetable import Timetable, DEFAULT_HORIZON
+from .journeys import JourneyPlanner, DEFAULT_MAX_TRANSFERS, DEFAULT_REBUILD_INTERVAL, DEFAULT_WINDOW
+
+logger = logging.getLogger('transit_api')
+
+
+#comma-separated env value -> list of stripped, non-empty items
+def _split(value):
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
+
+
+#reads the service configuration from the environment (and .env), overrides win over both
+def load_config(overrides=None):
+    load_dotenv() #load environment variables from .env file
+    config = {
+        #MTA feed URLs, SUBWAY_API_URLS is a comma-separated list
+        "SUBWAY_API_URLS": _split(os.getenv('SUBWAY_API_URLS')),
+        "LIRR_API_URL": (os.getenv('LIRR_API_URL') or '').strip(),
+        "METRO_NORTH_API_URL": (os.getenv('METRO_NORTH_API_URL') or '').strip(),
+        "BUS_API_KEY": os.getenv('BUS_API_KEY'),
+        #BusTime: the route/stop catalogue is reloaded every BUS_CATALOGUE_INTERVAL seconds, StopMonitoring
+        #answers are reused for BUS_CACHE_TTL seconds, stops up to BUS_STOP_RADIUS_KM away are monitored
+        "BUS_API_URL": os.getenv('BUS_API_URL', DEFAULT_BUS_API_URL),
+        "BUS_AGENCIES": _split(os.getenv('BUS_AGENCIES')) or list(DEFAULT_BUS_AGENCIES),
+        "BUS_CATALOGUE_INTERVAL": float(os.getenv('BUS_CATALOGUE_INTERVAL', DEFAULT_CATALOGUE_INTERVAL)),
+        "BUS_CACHE_TTL": float(os.getenv('BUS_CACHE_TTL', DEFAULT_VISITS_TTL)),
+        "BUS_STOP_RADIUS_KM": float(os.getenv('BUS_STOP_RADIUS_KM', DEFAULT_STOP_RADIUS_KM)),
+        #how often each feed is polled and how old its data may get before it counts as stale (seconds)
+        "FEED_POLL_INTERVAL": int(os.getenv('FEED_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)),
+        "FEED_MAX_STALENESS": int(os.getenv('FEED_MAX_STALENESS', DEFAULT_MAX_STALENESS)),
+        #what to do when a feed is behind: 'serve' returns the stale data, 'fail' answers 503 right away
+        "FEED_STALE_POLICY": os.getenv('FEED_STALE_POLICY', 'serve'),
+        #where feed snapshots come from: 'poll' fetches and decodes them in this process, 'shared' follows
+        #the snapshot files a feed publisher process writes to SNAPSHOT_DIR (see serve.py)
+        "FEED_SOURCE": os.getenv('FEED_SOURCE', 'poll'),
+        "SNAPSHOT_DIR": os.getenv('SNAPSHOT_DIR', ''),
+        #upstream calls run concurrently on one pooled session: UPSTREAM_TIMEOUT bounds a single call,
+        #REQUEST_DEADLINE bounds a whole request's fan-out, FETCH_WORKERS bounds calls in flight
+        "UPSTREAM_TIMEOUT": float(os.getenv('UPSTREAM_TIMEOUT', DEFAULT_CALL_TIMEOUT)),
+        "REQUEST_DEADLINE": float(os.getenv('REQUEST_DEADLINE', DEFAULT_DEADLINE)),
+        "FETCH_WORKERS": int(os.getenv('FETCH_WORKERS', DEFAULT_WORKERS)),
+        #record/replay (see replay.py): UPSTREAM_CAPTURE records every upstream response into a directory,
+        #UPSTREAM_REPLAY serves one back instead of the network, UPSTREAM_REPLAY_SPEED times faster than
+        #recorded (0: each request gets the next recorded response)
+        "UPSTREAM_CAPTURE": os.getenv('UPSTREAM_CAPTURE', ''),
+        "UPSTREAM_REPLAY": os.getenv('UPSTREAM_REPLAY', ''),
+        "UPSTREAM_REPLAY_SPEED": float(os.getenv('UPSTREAM_REPLAY_SPEED', 1.0)),
+        #GTFS stops.txt files loaded into the station registry, ex: subway=data/subway/stops.txt,lirr=data/lirr/stops.txt
+        "STATION_STOPS": os.getenv('STATION_STOPS', ''),
+        #rail matching: departures returned per mode, and how close a station of another agency must be to
+        #count as the same place (ex: subway Penn Station -> LIRR Penn Station)
+        "MAX_SCHEDULES": int(os.getenv('MAX_SCHEDULES', DEFAULT_SCHEDULE_LIMIT)),
+        "STATION_TRANSFER_RADIUS_KM": float(os.getenv('STATION_TRANSFER_RADIUS_KM', DEFAULT_TRANSFER_RADIUS_KM)),
+        #static timetable built with `python -m transit_service.timetable`, mapped at startup; scheduled
+        #departures are searched TIMETABLE_HORIZON seconds ahead
+        "TIMETABLE_PATH": os.getenv('TIMETABLE_PATH', ''),
+        "TIMETABLE_HORIZON": float(os.getenv('TIMETABLE_HORIZON', DEFAULT_HORIZON)),
+        #journeys with transfers planned over the timetable (needs TIMETABLE_PATH): at most JOURNEY_MAX_TRANSFERS
+        #changes, over a network of JOURNEY_WINDOW seconds of service rebuilt for new realtime versions at
+        #most every JOURNEY_REBUILD_INTERVAL seconds
+        "JOURNEY_MAX_TRANSFERS": int(os.getenv('JOURNEY_MAX_TRANSFERS', DEFAULT_MAX_TRANSFERS)),
+        "JOURNEY_WINDOW": float(os.getenv('JOURNEY_WINDOW', DEFAULT_WINDOW)),
+        "JOURNEY_REBUILD_INTERVAL": float(os.getenv('JOURNEY_REBUILD_INTERVAL', DEFAULT_REBUILD_INTERVAL)),
+        #answers are cached per query and feed versions for RESPONSE_CACHE_TTL seconds (0 turns caching off),
+        #a batch request takes at most MAX_BATCH_QUERIES origin/destination pairs
+        "RESPONSE_CACHE_TTL": float(os.getenv('RESPONSE_CACHE_TTL', DEFAULT_RESPONSE_CACHE_TTL)),
+        "RESPONSE_CACHE_SIZE": int(os.getenv('RESPONSE_CACHE_SIZE', DEFAULT_RESPONSE_CACHE_SIZE)),
+        "MAX_BATCH_QUERIES": int(os.getenv('MAX_BATCH_QUERIES', DEFAULT_MAX_BATCH_QUERIES)),
+        #schedule updates pushed over Server-Sent Events (streaming.py) from STREAM_BIND, ex: 0.0.0.0:5001 (empty: off).
+        #A connection subscribes to at most STREAM_MAX_PAIRS pairs and is dropped when STREAM_QUEUE_SIZE events
+        #pile up unsent; idle streams get a keep-alive comment every STREAM_HEARTBEAT seconds
+        "STREAM_BIND": os.getenv('STREAM_BIND', ''),
+        "STREAM_MAX_PAIRS": int(os.getenv('STREAM_MAX_PAIRS', DEFAULT_MAX_PAIRS)),
+        "STREAM_QUEUE_SIZE": int(os.getenv('STREAM_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)),
+        "STREAM_HEARTBEAT": float(os.getenv('STREAM_HEARTBEAT', DEFAULT_HEARTBEAT)),
+        #reverse geocoding: stations within GAZETTEER_RADIUS_KM are answered offline, Nominatim is only
+        #asked when GEOCODER_REMOTE is on, cached per coordinate rounded to GEOCODER_PRECISION decimals
+        "GEOCODER_REMOTE": os.getenv('GEOCODER_REMOTE', 'false').lower() in ('1', 'true', 'yes'),
+        "GEOCODER_PRECISION": int(os.getenv('GEOCODER_PRECISION', DEFAULT_PRECISION)),
+        "GEOCODER_CACHE_SIZE": int(os.getenv('GEOCODER_CACHE_SIZE', DEFAULT_CACHE_SIZE)),
+        "GEOCODER_CACHE_TTL": float(os.getenv('GEOCODER_CACHE_TTL', DEFAULT_CACHE_TTL)),
+        "GEOCODER_MIN_INTERVAL": float(os.getenv('GEOCODER_MIN_INTERVAL', DEFAULT_MIN_INTERVAL)),
+        "GAZETTEER_RADIUS_KM": float(os.getenv('GAZETTEER_RADIUS_KM', DEFAULT_GAZETTEER_RADIUS_KM)),
+    }
+    config.update(overrides or {})
+    return config
+
+
+class TransitServices:
+    def __init__(self, config, stations=()):
+        self.config = config
+        self.builtin_stations = list(stations)
+        self.timings = {} #startup phase -> seconds, ex: {"warm_up": 1.2}
+        self._lock = threading.Lock()
+        self._fetcher = None
+        self._feed_poller = None
+        self._station_registry = None
+        self._geolocator = None
+        self._geocoder = None
+        self._bus_service = None
+        self._snapshot_follower = None
+        self._response_cache = None
+        self._timetable = None
+        self._timetable_loaded = False
+        self._journey_planner = None
+        self.capture_writer = None #CaptureWriter while recording upstream traffic
+        self.replay_adapter = None #ReplayAdapter while replaying a capture
+        self.metrics = Metrics()
+        self.metrics.add_collected('transit_cache_lookups_total', "Cache lookups per cache and result (hit, miss)", 'counter',
+                                   ['cache', 'result'], self._cache_lookups)
+        self.metrics.add_collected('transit_remote_calls_total', "Calls made to remote services on request paths", 'counter',
+                                   ['service'], self._remote_calls)
+        self.metrics.add_collected('transit_feed_version', "Version of the feed snapshot being served", 'gauge', ['feed'],
+                                   lambda: [((name,), snapshot.version) for name, snapshot in sorted(self.feed_store.view().items())])
+        self.metrics.add_collected('transit_feed_age_seconds', "Age of the feed snapshot being served", 'gauge', ['feed'],
+                                   lambda: [((name,), round(self.feed_store.age(snapshot), 3)) for name, snapshot in sorted(self.feed_store.view().items())])
+
+        #feed configs are cheap, the store itself stays empty until the poller fills it
+        interval, staleness = config['FEED_POLL_INTERVAL'], config['FEED_MAX_STALENESS']
+        self.feed_store = FeedStore()
+        for url in config['SUBWAY_API_URLS']:
+            self.feed_store.add_config(FeedConfig(feed_name(url), url, 'subway', interval, staleness))
+        if config['LIRR_API_URL']:
+            self.feed_store.add_config(FeedConfig('lirr', config['LIRR_API_URL'], 'lirr', interval, staleness))
+        if config['METRO_NORTH_API_URL']:
+            self.feed_store.add_config(FeedConfig('metro_north', config['METRO_NORTH_API_URL'], 'metro_north', interval, staleness))
+
+    @property
+    def fetcher(self):
+        with self._lock:
+            if self._fetcher is None:
+                self._fetcher = Fetcher(self.config['FETCH_WORKERS'], self.config['UPSTREAM_TIMEOUT'], self.config['REQUEST_DEADLINE'])
+                self._route_upstream(self._fetcher)
+            return self._fetcher
+
+    #records into UPSTREAM_CAPTURE or replays UPSTREAM_REPLAY on a fetcher's session, call with the lock held
+    def _route_upstream(self, fetcher):
+        if self.config['UPSTREAM_REPLAY']:
+            if self.replay_adapter is None:
+                self.replay_adapter = ReplayAdapter(Capture.load(self.config['UPSTREAM_REPLAY']), self.config['UPSTREAM_REPLAY_SPEED'])
+                logger.info("Replaying upstream traffic from %s", self.config['UPSTREAM_REPLAY'])
+            route_session(fetcher.session, replay=self.replay_adapter)
+        elif self.config['UPSTREAM_CAPTURE']:
+            if self.capture_writer is None:
+                self.capture_writer = CaptureWriter(self.config['UPSTREAM_CAPTURE'])
+                logger.info("Recording upstream traffic into %s", self.config['UPSTREAM_CAPTURE'])
+            route_session(fetcher.session, writer=self.capture_writer)
+
+    #feed polls get their own fetcher, one worker per feed: a hung feed never takes a worker the request
+    #fan-out is waiting for
+    @property
+    def feed_poller(self):
+        with self._lock:
+            if self._feed_poller is None:
+                fetcher = Fetcher(max(len(self.feed_store.configs()), 1), self.config['UPSTREAM_TIMEOUT'], self.config['REQUEST_DEADLINE'])
+                self._route_upstream(fetcher)
+                self._feed_poller = FeedPoller(self.feed_store, fetcher, metrics=self.metrics)
+            return self._feed_poller
+
+    #built-in stations plus every STATION_STOPS file, loaded and indexed on first use
+    @property
+    def station_registry(self):
+        with self._lock:
+            if self._station_registry is None:
+                started = time.perf_counter()
+                self._station_registry = StationRegistry.from_gtfs(parse_stops_setting(self.config['STATION_STOPS']), self.builtin_stations)
+                self.timings['station_registry'] = time.perf_counter() - started
+            return self._station_registry
+
+    #Nominatim geocoder, only created when something actually geocodes
+    @property
+    def geolocator(self):
+        with self._lock:
+            if self._geolocator is None:
+                from geopy.geocoders import Nominatim
+                self._geolocator = Nominatim(user_agent="my_geocoder")
+            return self._geolocator
+
+    #cached reverse geocoder with the station gazetteer in front
+    @property
+    def geocoder(self):
+        if self._geocoder is None:
+            registry = self.station_registry
+            backend = geopy_backend(self.geolocator, self.config['UPSTREAM_TIMEOUT']) if self.config['GEOCODER_REMOTE'] else None
+            with self._lock:
+                if self._geocoder is None:
+                    self._geocoder = CachedGeocoder(
+                        backend, Gazetteer(registry, self.config['GAZETTEER_RADIUS_KM']), self.config['GEOCODER_PRECISION'],
+                        self.config['GEOCODER_CACHE_SIZE'], self.config['GEOCODER_CACHE_TTL'], self.config['GEOCODER_MIN_INTERVAL'])
+        return self._geocoder
+
+    #reads the snapshots another process publishes to SNAPSHOT_DIR, used when FEED_SOURCE is 'shared'
+    @property
+    def snapshot_follower(self):
+        with self._lock:
+            if self._snapshot_follower is None:
+                self._snapshot_follower = SnapshotFollower(self.feed_store, self.config['SNAPSHOT_DIR'], metrics=self.metrics)
+            return self._snapshot_follower
+
+    #static timetable mapped from TIMETABLE_PATH, None when not configured or unreadable
+    @property
+    def timetable(self):
+        with self._lock:
+            if not self._timetable_loaded and self.config['TIMETABLE_PATH']:
+                started = time.perf_counter()
+                try:
+                    self._timetable = Timetable.open(self.config['TIMETABLE_PATH'])
+                except (OSError, ValueError, ZoneInfoNotFoundError) as e: #serve realtime data only
+                    logger.error("Timetable %s unavailable: %s", self.config['TIMETABLE_PATH'], e)
+                self.timings['timetable'] = time.perf_counter() - started
+            self._timetable_loaded = True
+            return self._timetable
+
+    #RAPTOR journeys across subway, LIRR and Metro North, None without a timetable. Footpaths reach
+    #stations within STATION_TRANSFER_RADIUS_KM, like co-located stations for rail matching
+    @property
+    def journey_planner(self):
+        timetable = self.timetable
+        if timetable is None or self.config['JOURNEY_MAX_TRANSFERS'] < 0:
+            return None
+        registry = self.station_registry
+        with self._lock:
+            if self._journey_planner is None:
+                self._journey_planner = JourneyPlanner(timetable, registry, self.config['JOURNEY_WINDOW'],
+                                                       self.config['STATION_TRANSFER_RADIUS_KM'],
+                                                       max_transfers=self.config['JOURNEY_MAX_TRANSFERS'],
+                                                       rebuild_interval=self.config['JOURNEY_REBUILD_INTERVAL'])
+            return self._journey_planner
+
+    #realtime snapshots the planner lays over the timetable, in feed config order like rail matching
+    #so both share each AgencyTimetable's overlay
+    def journey_snapshots(self, view=None):
+        view = self.feed_store.view() if view is None else view
+        return [view[config.name] for agency in self.timetable.agencies for config in self.feed_store.configs(agency) if config.name in view]
+
+    #answers of /api/transit and /api/transit/batch, keyed on the query and the feed versions
+    @property
+    def response_cache(self):
+        with self._lock:
+            if self._response_cache is None:
+                self._response_cache = ResponseCache(self.config['RESPONSE_CACHE_SIZE'], self.config['RESPONSE_CACHE_TTL'])
+            return self._response_cache
+
+    @property
+    def shares_feeds(self):
+        return self.config['FEED_SOURCE'] == 'shared'
+
+    #feed publisher process: every snapshot the poller publishes is also written to SNAPSHOT_DIR
+    def publish_snapshots(self):
+        self.feed_store.add_listener(SnapshotWriter(self.config['SNAPSHOT_DIR']))
+
+    #BusTime catalogue and StopMonitoring, None without a BUS_API_KEY. Bus calls get their own small
+    #fetcher: they fan out from inside a request that already runs on the shared pool. Catalogue loads
+    #get another one, their hundreds of calls must not queue ahead of StopMonitoring
+    @property
+    def bus_service(self):
+        if not self.config['BUS_API_KEY']:
+            return None
+        with self._lock:
+            if self._bus_service is None:
+                fetcher = Fetcher(8, self.config['UPSTREAM_TIMEOUT'], self.config['REQUEST_DEADLINE'])
+                self._route_upstream(fetcher)
+                catalogue_fetcher = Fetcher(DEFAULT_CATALOGUE_WORKERS, self.config['UPSTREAM_TIMEOUT'], self.config['REQUEST_DEADLINE'])
+                self._route_upstream(catalogue_fetcher)
+                client = BusTimeClient(fetcher, self.config['BUS_API_KEY'], self.config['BUS_API_URL'], self.config['BUS_AGENCIES'],
+                                       self.config['BUS_CACHE_TTL'], catalogue_fetcher=catalogue_fetcher)
+                self._bus_service = BusService(client, self.config['BUS_CATALOGUE_INTERVAL'], self.config['BUS_STOP_RADIUS_KM'])
+            return self._bus_service
+
+    #hits and misses of the caches created so far, read when /metrics is scraped
+    def _cache_lookups(self):
+        caches = [("response", self._response_cache and self._response_cache.entries),
+                  ("geocoder", self._geocoder and self._geocoder.cache),
+                  ("bus_visits", self._bus_service and self._bus_service.client.visits_cache)]
+        for name, cache in caches:
+            if cache is not None:
+                yield (name, 'hit'), cache.hits
+                yield (name, 'miss'), cache.misses
+
+    def _remote_calls(self):
+        if self._geocoder is not None:
+            yield ('nominatim',), self._geocoder.remote_calls
+        if self._bus_service is not None:
+            yield ('bus_stop_monitoring',), self._bus_service.client.monitoring_calls
+
+    #everything a worker should do before taking traffic: build the station index, fill the feed
+    #store once, load the bus catalogue and start background polling. Returns the timings it measured
+    def warm_up(self, start_polling=True):
+        started = time.perf_counter()
+        logger.info("Warming up: %s stations", len(self.station_registry))
+
+        if self.timetable is not None:
+            logger.info("Warming up: timetable with %s", ", ".join(f"{len(agency)} {name} trips" for name, agency in self.timetable.agencies.items()))
+
+        feeds_started = time.perf_counter()
+        if self.shares_feeds: #the publisher process fetches, just wait for its first snapshots
+            complete = self.snapshot_follower.wait(2 * self.config['REQUEST_DEADLINE'])
+            logger.info("Warming up: %s shared feeds loaded%s", len(self.feed_store.view()), "" if complete else ", some still missing")
+        else:
+            updated = self.feed_poller.refresh_all()
+            logger.info("Warming up: %s of %s feeds loaded", sum(updated.values()), len(updated))
+        self.timings['feeds'] = time.perf_counter() - feeds_started
+
+        if self.bus_service is not None:
+            buses_started = time.perf_counter()
+            try:
+                logger.info("Warming up: %s bus stops", len(self.bus_service.load()))
+            except Exception as e: #BusTime down, the first bus request starts a load in the background
+                logger.error("Warming up: bus catalogue unavailable: %s", e)
+            self.timings['bus_catalogue'] = time.perf_counter() - buses_started
+
+        if self.journey_planner is not None:
+            network_started = time.perf_counter()
+            network = self.journey_planner.warm(self.journey_snapshots(), time.time())
+            logger.info("Warming up: journey network with %s routes", len(network.route_stops))
+            self.timings['journey_network'] = time.perf_counter() - network_started
+
+        if start_polling:
+            (self.snapshot_follower if self.shares_feeds else self.feed_poller).start()
+        self.timings['warm_up'] = time.perf_counter() - started
+        return dict(self.timings)
+
+    def close(self):
+        if self._feed_poller is not None:
+            self._feed_poller.stop()
+            self._feed_poller.fetcher.close()
+        if self._snapshot_follower is not None:
+            self._snapshot_follower.stop()
+        if self._fetcher is not None:
+            self._fetcher.close()
+        if self._bus_service is not None:
+            self._bus_service.client.fetcher.close()
+            self._bus_service.client.catalogue_fetcher.close()
+        if self.capture_writer is not None:
+            self.capture_writer.close()
@@ -0,0 +1,191 @@
+#feed snapshots shared between processes: one publisher process polls and decodes the feeds and
+#writes every new version as a columnar file plus a manifest into a directory, worker processes
+#follow the manifest and map the files read-only. Workers never fetch or parse a feed, and the
+#numeric columns are used straight from the page cache (memoryviews over the mapping, no copies)
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+from .decoding import TripColumns
+from .feeds import FeedSnapshot
+from .stop_index import StopIndex
+
+logger = logging.getLogger('transit_api')
+
+MANIFEST = 'manifest.json'
+MAGIC = b'TRIPCOL1'
+#magic, header timestamp, trips, rows, distinct stop ids, bytes of the string table
+_HEADER = struct.Struct('<8sqIIII')
+_SEPARATOR = '\0' #between the strings of the string table, never part of a GTFS id
+
+
+def _padding(size):
+    return b'\0' * (-size % 8) #keeps every column 8-byte aligned
+
+
+#TripColumns -> bytes: header, trip_offsets, stop_codes, arrivals, departures, then the trip ids,
+#route ids and stop ids as one string table
+def dump_columns(columns):
+    strings = _SEPARATOR.join(list(columns.trip_ids) + list(columns.route_ids) + list(columns.stop_names)).encode('utf-8')
+    parts = [_HEADER.pack(MAGIC, columns.header_timestamp, len(columns.trip_ids), len(columns.stop_codes),
+                          len(columns.stop_names), len(strings))]
+    for column in (columns.trip_offsets, columns.stop_codes, columns.arrivals, columns.departures):
+        data = bytes(column)
+        parts += [data, _padding(len(data))]
+    parts.append(strings)
+    return b''.join(parts)
+
+
+#bytes-like (bytes, mmap) -> TripColumns whose numeric columns are memoryviews into the buffer
+def load_columns(buffer):
+    view = memoryview(buffer)
+    magic, header_timestamp, trip_count, row_count, stop_count, strings_size = _HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError("not a trip columns file")
+    columns = TripColumns(header_timestamp)
+    offset = _HEADER.size
+    loaded = []
+    for typecode, count in (('I', trip_count + 1), ('I', row_count), ('q', row_count), ('q', row_count)):
+        size = struct.calcsize(typecode) * count
+        loaded.append(view[offset:offset + size].cast(typecode))
+        offset += size + len(_padding(size))
+    columns.trip_offsets, columns.stop_codes, columns.arrivals, columns.departures = loaded
+    strings = bytes(view[offset:offset + strings_size]).decode('utf-8').split(_SEPARATOR) if strings_size else []
+    columns.trip_ids = strings[:trip_count]
+    columns.route_ids = strings[trip_count:2 * trip_count]
+    columns.stop_names = strings[2 * trip_count:]
+    if len(columns.stop_names) != stop_count:
+        raise ValueError("corrupt string table")
+    return columns
+
+
+#writes bytes to path atomically: readers see the old file or the new one, never half of one
+def _write_atomic(path, data):
+    temporary = f"{path}.tmp{os.getpid()}"
+    with open(temporary, 'wb') as output:
+        output.write(data)
+    os.replace(temporary, path)
+
+
+#FeedStore listener of the publisher process: every published snapshot is written to
+#<name>-<version>.cols, then the manifest is swapped and the feed's previous file removed
+#(workers that still map it keep their pages until they move on). Each manifest carries the
+#writer's start time and a sequence number, a new pair means a new manifest
+class SnapshotWriter:
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._manifest = {}
+        self._started = time.time()
+        self._sequence = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, snapshot):
+        filename = f"{snapshot.name}-{snapshot.version}.cols"
+        _write_atomic(os.path.join(self.directory, filename), dump_columns(snapshot.feed))
+        with self._lock:
+            previous = self._manifest.get(snapshot.name)
+            self._manifest[snapshot.name] = {"agency": snapshot.agency, "version": snapshot.version, "file": filename,
+                                             "header_timestamp": snapshot.header_timestamp, "fetched_at": snapshot.fetched_at}
+            self._sequence += 1
+            _write_atomic(os.path.join(self.directory, MANIFEST),
+                          json.dumps({"started": self._started, "sequence": self._sequence, "feeds": self._manifest}).encode())
+        if previous is not None:
+            try:
+                os.remove(os.path.join(self.directory, previous['file']))
+            except OSError:
+                pass
+
+
+#maps one snapshot file read-only
+def map_columns(path):
+    with open(path, 'rb') as snapshot_file:
+        mapped = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) #stays valid after close
+    return load_columns(mapped)
+
+
+#worker side: reads the manifest every interval and publishes the new versions into the worker's own
+#FeedStore, keeping the publisher's version numbers so every worker agrees on them. Changes are told
+#by the manifest's sequence, not its mtime: several publishes can land within one mtime tick
+class SnapshotFollower:
+    def __init__(self, store, directory, interval=1.0, indexer=StopIndex.from_columns, metrics=None):
+        self.store = store
+        self.directory = directory
+        self.interval = interval #seconds between manifest checks, one small read each
+        self.indexer = indexer
+        self.metrics = metrics #map and index times per feed
+        self._seen = None #(started, sequence) of the manifest last loaded
+        self._stop = threading.Event()
+        self._thread = None
+
+    #loads every feed whose version changed, returns how many were published
+    def sync(self):
+        path = os.path.join(self.directory, MANIFEST)
+        try:
+            with open(path, 'rb') as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError): #no manifest yet
+            return 0
+        sequence = (manifest.get('started'), manifest.get('sequence'))
+        if sequence == self._seen and sequence[1] is not None:
+            return 0
+
+        published, complete = 0, True
+        view = self.store.view()
+        for name, entry in manifest.get('feeds', {}).items():
+            current = view.get(name)
+            if current is not None and current.version == entry['version']:
+                continue
+            try:
+                started = time.perf_counter()
+                columns = map_columns(os.path.join(self.directory, entry['file']))
+                mapped = time.perf_counter()
+                index = self.indexer(columns)
+                if self.metrics is not None:
+                    self.metrics.feeds.observe(mapped - started, name, 'map')
+                    self.metrics.feeds.observe(time.perf_counter() - mapped, name, 'index')
+            except (OSError, ValueError) as e: #replaced while we read the manifest, next sync picks it up
+                logger.warning("Shared snapshot %s unreadable: %s", entry['file'], e)
+                complete = False
+                continue
+            self.store.publish(FeedSnapshot(name, entry['agency'], entry['version'], entry['header_timestamp'],
+                                            entry['fetched_at'], columns, index))
+            published += 1
+        if complete:
+            self._seen = sequence
+        return published
+
+    #syncs until every configured feed is there or timeout seconds passed, returns True when complete
+    def wait(self, timeout):
+        names = {config.name for config in self.store.configs()}
+        for _ in range(max(1, int(timeout / 0.1))):
+            self.sync()
+            if names <= set(self.store.view()):
+                return True
+            if self._stop.wait(0.1):
+                break
+        return names <= set(self.store.view())
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='snapshot-follower', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sync()
+            except Exception as e: #keep following, the previous snapshots stay in place
+                logger.error("Following shared snapshots failed: %s", e)
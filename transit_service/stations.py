@@ -0,0 +1,191 @@
+#station registry: loads stations from GTFS static stops.txt files and answers nearest-station and
+#within-radius queries through a KD-tree, so lookups stay fast with the full subway, LIRR and
+#Metro North station set
+import csv
+import heapq
+import logging
+import math
+
+logger = logging.getLogger('transit_api')
+
+EARTH_RADIUS_KM = 6371.0088 #mean earth radius
+
+
+#great-circle distance in km between two (lat, lon) points
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+#projects (lat, lon) onto the unit sphere. Straight-line (chord) distance between projected
+#points grows with great-circle distance, so nearest by chord is exactly nearest by haversine
+def _project(latitude, longitude):
+    lat, lon = math.radians(latitude), math.radians(longitude)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+#great-circle km -> squared chord length on the unit sphere
+def _chord2(distance_km):
+    return (2 * math.sin(min(math.pi, distance_km / EARTH_RADIUS_KM) / 2)) ** 2
+
+
+#reads stations out of a GTFS stops.txt. Parent stations (location_type 1) and stops without a
+#parent become stations, platforms are folded into their parent's gtfs_stops. Station ids are the
+#GTFS stop ids, prefixed with the agency for everything but the subway since LIRR and Metro North
+#both use plain numbers
+def load_stops(path, agency='subway'):
+    prefix = '' if agency == 'subway' else f"{agency}:"
+    stations = {}
+    children = []
+    with open(path, newline='', encoding='utf-8-sig') as stops_file:
+        for row in csv.DictReader(stops_file):
+            if row.get('location_type', '') not in ('', '0', '1'): #entrances, nodes, boarding areas
+                continue
+            if row.get('parent_station'):
+                children.append(row)
+                continue
+            stations[row['stop_id']] = {
+                "name": row['stop_name'],
+                "latitude": float(row['stop_lat']),
+                "longitude": float(row['stop_lon']),
+                "station_id": prefix + row['stop_id'],
+                "agency": agency,
+                "gtfs_stops": [row['stop_id']],
+            }
+    for row in children:
+        parent = stations.get(row['parent_station'])
+        #A01N / A01S are covered by the parent's A01, anything else is added explicitly
+        if parent is not None and not row['stop_id'].startswith(row['parent_station']):
+            parent['gtfs_stops'].append(row['stop_id'])
+    logger.info("Loaded %s %s stations from %s", len(stations), agency, path)
+    return list(stations.values())
+
+
+#parses "subway=/data/subway/stops.txt,lirr=/data/lirr/stops.txt" into [(agency, path)]
+def parse_stops_setting(value):
+    sources = []
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        agency, _, path = item.rpartition('=')
+        sources.append((agency or 'subway', path))
+    return sources
+
+
+class StationRegistry:
+    def __init__(self, stations):
+        self.stations = list(stations)
+        self._by_id = {}
+        self._by_name = {}
+        for station in self.stations:
+            self._by_id[station['station_id']] = station
+            if station.get('name'):
+                self._by_name.setdefault(station['name'].casefold(), station)
+            for alternative_id in station.get('alternative_ids', []):
+                self._by_id.setdefault(alternative_id, station)
+        self._points = [_project(station['latitude'], station['longitude']) for station in self.stations]
+        self._build_tree()
+
+    @classmethod
+    def from_gtfs(cls, sources, extra_stations=()):
+        stations = list(extra_stations)
+        for agency, path in sources:
+            stations.extend(load_stops(path, agency))
+        return cls(stations)
+
+    def __len__(self):
+        return len(self.stations)
+
+    #station by station_id or one of its alternative_ids, None if unknown
+    def get(self, station_id):
+        return self._by_id.get(station_id)
+
+    #first station with this name (case-insensitive), None if unknown
+    def find_by_name(self, name):
+        return self._by_name.get(name.strip().casefold())
+
+    #the k stations closest to (latitude, longitude) as (distance_km, station) pairs, nearest first.
+    #stations whose id is in exclude are skipped during the tree walk, no second scan needed
+    def nearest(self, latitude, longitude, k=1, exclude=()):
+        if k <= 0 or self._root is None:
+            return []
+        target = _project(latitude, longitude)
+        best = [] #max-heap of (-squared chord, index) holding the k best so far
+        self._search_nearest(self._root, target, k, self._station_ids(exclude), best)
+        found = sorted((-neg_distance, index) for neg_distance, index in best)
+        return [self._result(latitude, longitude, index) for _, index in found]
+
+    #every station within radius_km of (latitude, longitude) as (distance_km, station), nearest first
+    def within(self, latitude, longitude, radius_km, exclude=()):
+        if self._root is None:
+            return []
+        target = _project(latitude, longitude)
+        found = []
+        self._search_radius(self._root, target, _chord2(radius_km), self._station_ids(exclude), found)
+        results = [self._result(latitude, longitude, index) for index in found]
+        return sorted((result for result in results if result[0] <= radius_km), key=lambda result: result[0])
+
+    #canonical station ids for ids that may be alternative ids
+    def _station_ids(self, ids):
+        return {self._by_id[station_id]['station_id'] if station_id in self._by_id else station_id for station_id in ids}
+
+    #exact haversine distance for a matched station
+    def _result(self, latitude, longitude, index):
+        station = self.stations[index]
+        return haversine_km(latitude, longitude, station['latitude'], station['longitude']), station
+
+    #KD-tree stored in flat lists: node i holds station index _index[i], splits on axis _axis[i],
+    #children are _left[i] / _right[i] (-1 when missing)
+    def _build_tree(self):
+        self._index, self._axis, self._left, self._right = [], [], [], []
+        self._root = self._build(list(range(len(self.stations)))) if self.stations else None
+
+    def _build(self, indices):
+        if not indices:
+            return -1
+        points = self._points
+        #split on the axis with the largest spread
+        spreads = [max(points[i][axis] for i in indices) - min(points[i][axis] for i in indices) for axis in range(3)]
+        axis = spreads.index(max(spreads))
+        indices.sort(key=lambda i: points[i][axis])
+        middle = len(indices) // 2
+        node = len(self._index)
+        self._index.append(indices[middle])
+        self._axis.append(axis)
+        self._left.append(-1)
+        self._right.append(-1)
+        self._left[node] = self._build(indices[:middle])
+        self._right[node] = self._build(indices[middle + 1:])
+        return node
+
+    def _search_nearest(self, node, target, k, exclude, best):
+        index = self._index[node]
+        point = self._points[index]
+        if self.stations[index]['station_id'] not in exclude:
+            distance = (point[0] - target[0]) ** 2 + (point[1] - target[1]) ** 2 + (point[2] - target[2]) ** 2
+            if len(best) < k:
+                heapq.heappush(best, (-distance, index))
+            elif distance < -best[0][0]:
+                heapq.heapreplace(best, (-distance, index))
+        axis = self._axis[node]
+        offset = target[axis] - point[axis]
+        near, far = (self._left[node], self._right[node]) if offset < 0 else (self._right[node], self._left[node])
+        if near != -1:
+            self._search_nearest(near, target, k, exclude, best)
+        #the far side can only help if the splitting plane is closer than the worst match so far
+        if far != -1 and (len(best) < k or offset * offset < -best[0][0]):
+            self._search_nearest(far, target, k, exclude, best)
+
+    def _search_radius(self, node, target, radius2, exclude, found):
+        index = self._index[node]
+        point = self._points[index]
+        if self.stations[index]['station_id'] not in exclude:
+            distance = (point[0] - target[0]) ** 2 + (point[1] - target[1]) ** 2 + (point[2] - target[2]) ** 2
+            if distance <= radius2:
+                found.append(index)
+        axis = self._axis[node]
+        offset = target[axis] - point[axis]
+        near, far = (self._left[node], self._right[node]) if offset < 0 else (self._right[node], self._left[node])
+        if near != -1:
+            self._search_radius(near, target, radius2, exclude, found)
+        if far != -1 and offset * offset <= radius2:
+            self._search_radius(far, target, radius2, exclude, found)
@@ -0,0 +1,96 @@
+#stop -> trip index, built once per feed version so an origin/destination query is a couple of
+#dict lookups plus a sequence-order check instead of a scan over every trip and stop
+from array import array
+from collections import namedtuple
+
+from .decoding import TripColumns, columns_from_feed
+
+#subway stop ids carry a direction suffix, ex: A01N / A01S both belong to stop A01
+DIRECTION_SUFFIXES = ('N', 'S')
+
+#one stop_time_update of one trip. trip is an index into StopIndex.trips, position is the
+#stop's place in the trip's stop sequence, times are posix timestamps (0 when missing)
+StopEvent = namedtuple('StopEvent', ['trip', 'position', 'stop_id', 'arrival', 'departure'])
+
+#trip_id and route_id of an indexed trip
+TripInfo = namedtuple('TripInfo', ['trip_id', 'route_id'])
+
+
+#A01N -> A01, stop ids without a direction suffix are returned as they are
+def base_stop_id(stop_id):
+    if len(stop_id) > 1 and stop_id[-1] in DIRECTION_SUFFIXES:
+        return stop_id[:-1]
+    return stop_id
+
+
+class StopIndex:
+    def __init__(self, columns=None):
+        self.columns = TripColumns() if columns is None else columns
+        self.trips = [TripInfo(*trip) for trip in zip(self.columns.trip_ids, self.columns.route_ids)]
+        self.stops = {} #base stop id -> array of rows (see TripColumns) at that stop, in feed order
+        self._row_trips = array('I') #row -> trip
+        self._build()
+
+    #builds the index from a decoded FeedMessage, only trip_update entities are read
+    @classmethod
+    def from_feed(cls, feed):
+        return cls(columns_from_feed(feed))
+
+    #builds the index over TripColumns (see decoding.py)
+    @classmethod
+    def from_columns(cls, columns):
+        return cls(columns)
+
+    #rows are grouped per distinct stop first, then per base id, so the per-row work is
+    #two array appends and StopEvents are only created for rows a query actually returns
+    def _build(self):
+        columns = self.columns
+        rows_by_code = [array('I') for _ in columns.stop_names]
+        stop_codes, offsets = columns.stop_codes, columns.trip_offsets
+        for trip in range(len(columns)):
+            start, end = offsets[trip], offsets[trip + 1]
+            self._row_trips.extend([trip] * (end - start))
+            for row in range(start, end):
+                rows_by_code[stop_codes[row]].append(row)
+        for stop_id, rows in zip(columns.stop_names, rows_by_code):
+            base = base_stop_id(stop_id)
+            if base in self.stops:
+                merged = self.stops[base] + rows
+                self.stops[base] = array('I', sorted(merged))
+            else:
+                self.stops[base] = rows
+
+    def event(self, row):
+        columns = self.columns
+        trip = self._row_trips[row]
+        return StopEvent(trip, row - columns.trip_offsets[trip], columns.stop_id(row),
+                         columns.arrivals[row], columns.departures[row])
+
+    #every event at the given stops. A pattern matches a stop id exactly or with a direction
+    #suffix added ("A01" matches A01, A01N and A01S, "A01N" only A01N), never as a substring
+    def lookup(self, patterns):
+        events = []
+        for pattern in dict.fromkeys(patterns): #drop duplicate patterns, keep order
+            base = base_stop_id(pattern)
+            rows = self.stops.get(base, ())
+            if base != pattern: #directional pattern, keep that direction only
+                rows = [row for row in rows if self.columns.stop_id(row) == pattern]
+            events.extend(self.event(row) for row in rows)
+        return events
+
+    #(origin event, destination event) pairs of trips that stop at an origin stop and later at a
+    #destination stop, in the order the trips appear in the feed
+    def find_trips(self, origin_patterns, destination_patterns):
+        destinations = {} #trip -> destination events of that trip
+        for event in self.lookup(destination_patterns):
+            destinations.setdefault(event.trip, []).append(event)
+        if not destinations:
+            return []
+
+        pairs = []
+        for origin in self.lookup(origin_patterns):
+            for destination in destinations.get(origin.trip, ()):
+                if destination.position > origin.position: #destination comes after origin on this trip
+                    pairs.append((origin, destination))
+        pairs.sort(key=lambda pair: (pair[0].trip, pair[0].position, pair[1].position))
+        return pairs
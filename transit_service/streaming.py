@@ -0,0 +1,354 @@
+#push updates for subscribed station pairs over Server-Sent Events: a client opens
+#    GET /api/transit/stream?pair=CH01,TSQ01&pair=lirr:237,lirr:102
+#and gets the current next_schedules of each pair, then only the entries that changed whenever a feed
+#publishes a new snapshot. Every connection lives on one asyncio event loop (no thread per client, an
+#idle subscriber is a socket and a queue), and each change recomputes the rail modes of the changed
+#feed's agency once per unique pair, on a small thread pool, then hands the same encoded event to
+#every subscriber of that pair. Buses have no feed to follow and aren't streamed
+#    python -m transit_service.streaming --bind 0.0.0.0:5001
+import argparse
+import asyncio
+import json
+import logging
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+
+from .logs import process_log_file, setup_logging
+from .schedules import stops_for_agency
+
+logger = logging.getLogger('transit_api')
+
+RAIL_AGENCIES = ('subway', 'lirr', 'metro_north')
+DEFAULT_HEARTBEAT = 15.0 #seconds between keep-alive comments on an idle stream, proxies close silent connections
+DEFAULT_MAX_PAIRS = 20 #station pairs one connection may subscribe to
+DEFAULT_QUEUE_SIZE = 64 #events waiting per subscriber, one that falls further behind is disconnected
+MAX_REQUEST_BYTES = 8192
+
+
+#one server-sent event, encoded once for every subscriber it goes to
+def encode_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+def _entry_key(entry):
+    return (entry['transit_mode'], entry['eta_origin'], entry['eta_destination'])
+
+
+#(added, removed) next_schedules entries between two lists of one mode, in list order
+def diff_schedules(old, new):
+    old_keys, new_keys = set(map(_entry_key, old)), set(map(_entry_key, new))
+    return [entry for entry in new if _entry_key(entry) not in old_keys], [entry for entry in old if _entry_key(entry) not in new_keys]
+
+
+#a station pair someone subscribed to: the agencies with stops at both ends, the last schedules per
+#agency and the subscriptions to push to
+class _Pair:
+    def __init__(self, key, agencies):
+        self.key = key
+        self.agencies = agencies
+        self.schedules = None #agency -> entries, None until the first computation is done
+        self.ready = asyncio.Event()
+        self.subscribers = set()
+
+    @property
+    def name(self):
+        return ",".join(self.key)
+
+    def next_schedules(self):
+        return [entry for agency in RAIL_AGENCIES for entry in self.schedules.get(agency, [])]
+
+
+#one client connection: its pairs and the events waiting to be written
+class Subscription:
+    def __init__(self, keys, queue_size=DEFAULT_QUEUE_SIZE):
+        self.keys = keys
+        self.queue = asyncio.Queue(queue_size)
+        self.dropped = False #fell behind, the connection gets closed
+
+
+#subscriptions and pair state. Everything but feed_published runs on the event loop thread, so no locks
+class StreamHub:
+    def __init__(self, services, loop, queue_size=DEFAULT_QUEUE_SIZE, workers=2):
+        self.services = services
+        self.loop = loop
+        self.queue_size = queue_size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stream')
+        from .app import get_rail_data #app -> services -> this module's defaults, imported late
+        self.rail_data = get_rail_data
+        self.pairs = {} #(origin, destination) -> _Pair
+        self.subscriptions = set()
+        self.computed = 0 #pair computations, once per unique pair and change
+        self.pushed = 0 #events queued to subscribers
+        self._dirty = {} #agency -> publish time of the newest snapshot waiting to be applied
+        self._recomputing = False
+
+    #FeedStore listener, called on the publishing thread (poller or snapshot follower)
+    def feed_published(self, snapshot):
+        self.loop.call_soon_threadsafe(self._changed, {snapshot.agency: snapshot.fetched_at})
+
+    def _changed(self, agencies):
+        for agency, published in agencies.items():
+            self._dirty[agency] = max(published, self._dirty.get(agency, 0))
+        if not self._recomputing:
+            self._recomputing = True
+            self.loop.create_task(self._recompute())
+
+    #schedules of the given agencies for pairs, on a pool thread: {pair key: {agency: entries}}
+    def _compute(self, keys_agencies):
+        view = self.services.feed_store.view()
+        results = {}
+        for key, agencies in keys_agencies:
+            results[key] = {agency: self.rail_data(agency, key[0], key[1], services=self.services, view=view) or [] for agency in agencies}
+        return results
+
+    #applies changes until none are left, changes arriving meanwhile are picked up by the next round
+    async def _recompute(self):
+        try:
+            while self._dirty:
+                dirty, self._dirty = self._dirty, {}
+                work = [(pair.key, pair.agencies & set(dirty)) for pair in self.pairs.values()
+                        if pair.schedules is not None and pair.agencies & set(dirty)]
+                if not work:
+                    continue
+                started = time.perf_counter()
+                try:
+                    results = await self.loop.run_in_executor(self.executor, self._compute, work)
+                except Exception as e: #keep streaming, the next change tries again
+                    logger.error("Stream recompute failed: %s", e)
+                    continue
+                self.computed += len(work)
+                published = max(dirty.values())
+                for key, schedules in results.items():
+                    pair = self.pairs.get(key)
+                    if pair is not None and pair.schedules is not None: #still subscribed
+                        self._apply(pair, schedules, published)
+                logger.debug("Recomputed %s stream pairs for %s in %.1f ms", len(work), sorted(dirty), (time.perf_counter() - started) * 1000)
+        finally:
+            self._recomputing = False
+
+    #diffs new schedules against the pair's last ones and queues one event for all its subscribers
+    def _apply(self, pair, schedules, published):
+        added, removed = [], []
+        for agency, entries in schedules.items():
+            agency_added, agency_removed = diff_schedules(pair.schedules.get(agency, []), entries)
+            added += agency_added
+            removed += agency_removed
+            pair.schedules[agency] = entries
+        if added or removed:
+            self._push(pair, encode_event('update', {"pair": pair.name, "added": added, "removed": removed, "published": published}))
+
+    def _push(self, pair, event):
+        for subscription in list(pair.subscribers):
+            try:
+                subscription.queue.put_nowait(event)
+                self.pushed += 1
+            except asyncio.QueueFull:
+                subscription.dropped = True
+                self.unsubscribe(subscription)
+
+    #registers a connection's pairs, computing the ones nobody subscribed to yet. Returns the
+    #Subscription and the initial event per pair
+    async def subscribe(self, keys):
+        subscription = Subscription(keys, self.queue_size)
+        self.subscriptions.add(subscription)
+        registry, radius_km = self.services.station_registry, self.services.config['STATION_TRANSFER_RADIUS_KM']
+        pairs, new = [], []
+        for key in keys:
+            pair = self.pairs.get(key)
+            if pair is None:
+                agencies = {agency for agency in RAIL_AGENCIES if stops_for_agency(registry, key[0], agency, radius_km)
+                            and stops_for_agency(registry, key[1], agency, radius_km)}
+                pair = self.pairs[key] = _Pair(key, agencies)
+                new.append(pair)
+            pair.subscribers.add(subscription)
+            pairs.append(pair)
+        if new:
+            versions = self.services.feed_store.versions()
+            try:
+                results = await self.loop.run_in_executor(self.executor, self._compute, [(pair.key, pair.agencies) for pair in new])
+            except Exception as e: #start them empty, the next feed change fills them in
+                logger.error("Stream subscription failed to compute: %s", e)
+                results = {pair.key: {} for pair in new}
+            self.computed += len(new)
+            for pair in new:
+                pair.schedules = results[pair.key]
+                pair.ready.set()
+            if self.services.feed_store.versions() != versions: #a feed changed while computing, catch the new pairs up
+                self._changed({agency: time.time() for pair in new for agency in pair.agencies})
+        for pair in pairs: #pairs another connection is still computing
+            await pair.ready.wait()
+        return subscription, [encode_event('schedules', {"pair": pair.name, "next_schedules": pair.next_schedules()}) for pair in pairs]
+
+    def unsubscribe(self, subscription):
+        self.subscriptions.discard(subscription)
+        for key in subscription.keys:
+            pair = self.pairs.get(key)
+            if pair is not None:
+                pair.subscribers.discard(subscription)
+                if not pair.subscribers:
+                    del self.pairs[key]
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _http_response(status, body):
+    reason = {400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}.get(status, 'Error')
+    return (f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n").encode() + body
+
+
+#the SSE endpoint on an asyncio server. start() in a running loop, or start_in_thread() for a
+#loop of its own next to the Flask app
+class StreamServer:
+    def __init__(self, services, host='127.0.0.1', port=0, heartbeat=None, max_pairs=None, queue_size=None):
+        self.services = services
+        self.host = host
+        self.port = port
+        self.heartbeat = heartbeat or services.config['STREAM_HEARTBEAT']
+        self.max_pairs = max_pairs or services.config['STREAM_MAX_PAIRS']
+        self.queue_size = queue_size or services.config['STREAM_QUEUE_SIZE']
+        self.hub = None
+        self.loop = None
+        self._server = None
+        self._started = threading.Event()
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.hub = StreamHub(self.services, self.loop, self.queue_size)
+        self.services.feed_store.add_listener(self.hub.feed_published)
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Streaming schedule updates on %s:%s", self.host, self.port)
+        self._started.set()
+        return self
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            try:
+                await self._server.serve_forever()
+            except asyncio.CancelledError: #stop() closed the server
+                pass
+
+    def start_in_thread(self):
+        thread = threading.Thread(target=lambda: asyncio.run(self.serve_forever()), name='stream-server', daemon=True)
+        thread.start()
+        self._started.wait()
+        return thread
+
+    def stop(self):
+        if self.loop is not None and self._server is not None:
+            self.loop.call_soon_threadsafe(self._server.close)
+            self.hub.close()
+
+    #station pairs of a stream request, ValueError when the request is malformed
+    def parse_pairs(self, target):
+        parts = urlsplit(target)
+        if parts.path != '/api/transit/stream':
+            raise LookupError(parts.path)
+        keys = []
+        for name, value in parse_qsl(parts.query):
+            if name != 'pair':
+                continue
+            origin, _, destination = value.partition(',')
+            if not origin or not destination:
+                raise ValueError(f"pair must be origin,destination: {value}")
+            for station_id in (origin, destination):
+                if self.services.station_registry.get(station_id) is None:
+                    raise ValueError(f"Unknown station: {station_id}")
+            keys.append((origin, destination))
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            raise ValueError("at least one pair=origin,destination is required")
+        if len(keys) > self.max_pairs:
+            raise ValueError(f"at most {self.max_pairs} pairs per stream")
+        return keys
+
+    async def _handle(self, reader, writer):
+        subscription = None
+        try:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            if len(head) > MAX_REQUEST_BYTES:
+                writer.write(_http_response(400, b'{"error":"request too large"}'))
+                return
+            method, target = (head.split(b"\r\n", 1)[0].decode('latin-1').split(' ') + ['', ''])[:2]
+            if method != 'GET':
+                writer.write(_http_response(405, b'{"error":"use GET"}'))
+                return
+            try:
+                keys = self.parse_pairs(target)
+            except LookupError:
+                writer.write(_http_response(404, b'{"error":"not found"}'))
+                return
+            except ValueError as e:
+                writer.write(_http_response(400, json.dumps({"error": str(e)}).encode()))
+                return
+
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                         b"Connection: keep-alive\r\nAccess-Control-Allow-Origin: *\r\n\r\n")
+            subscription, initial = await self.hub.subscribe(keys)
+            for event in initial:
+                writer.write(event)
+            await writer.drain()
+            closed = asyncio.ensure_future(reader.read(1)) #the client never sends more, this finishes when it disconnects
+            try:
+                while not subscription.dropped:
+                    waiting = asyncio.ensure_future(subscription.queue.get())
+                    done, _ = await asyncio.wait({waiting, closed}, timeout=self.heartbeat, return_when=asyncio.FIRST_COMPLETED)
+                    if closed in done:
+                        waiting.cancel()
+                        break
+                    if waiting in done:
+                        writer.write(waiting.result())
+                        while not subscription.queue.empty(): #write what queued up in one go
+                            writer.write(subscription.queue.get_nowait())
+                    else:
+                        waiting.cancel()
+                        writer.write(b": keep-alive\n\n")
+                    await writer.drain()
+            finally:
+                closed.cancel()
+        except ConnectionError: #client went away mid-write
+            pass
+        finally:
+            if subscription is not None:
+                self.hub.unsubscribe(subscription)
+            writer.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m transit_service.streaming', description="Stream schedule updates over Server-Sent Events")
+    parser.add_argument('--bind', default=None, help="host:port, STREAM_BIND by default")
+    parser.add_argument('--snapshot-dir', default='', help="follow the snapshots a feed publisher writes here instead of polling")
+    args = parser.parse_args(argv)
+    #next to a publisher (serve.py --stream-bind) the log file is one of several, see process_log_file
+    setup_logging(log_file=process_log_file() if args.snapshot_dir else None)
+    from .app import stations
+    from .services import TransitServices, load_config
+    overrides = {"FEED_SOURCE": "shared", "SNAPSHOT_DIR": args.snapshot_dir} if args.snapshot_dir else {}
+    services = TransitServices(load_config(overrides), stations)
+    host, _, port = (args.bind or services.config['STREAM_BIND'] or '127.0.0.1:5001').rpartition(':')
+    services.warm_up()
+
+    async def serve():
+        server = await StreamServer(services, host or '0.0.0.0', int(port)).start()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, server.stop)
+        await server.serve_forever()
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        services.close()
+
+
+if __name__ == '__main__':
+    main()
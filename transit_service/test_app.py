@@ -1,20 +1,47 @@
+import datetime
+import threading
+import time
+from zoneinfo import ZoneInfoNotFoundError
 import unittest #python lib for writing unit tests
 #import functions we want to test 
-from transit_service.app import find_closest_station, get_lirr_data, get_metro_north_data
+from transit_service.app import find_closest_station, get_journeys, get_lirr_data, get_metro_north_data, get_rail_data
 import pytest #testing framework
-from transit_service.app import app #for testing http endpts from app
+from transit_service.app import create_app, warm_up #for testing http endpts from app
+from transit_service.testing import StubServer, build_feed, make_feed, make_rail_feed, serve_bustime, write_capture, write_gtfs
+from transit_service import timetable
+from transit_service.timetable import build_timetable
+
+#no feed URLs and no bus key: tests add the sources they need, everything else answers "unavailable"
+OFFLINE = {"SUBWAY_API_URLS": [], "LIRR_API_URL": "", "METRO_NORTH_API_URL": "", "BUS_API_KEY": ""}
 
 #expects test case classes to inherit from TestCase, contains all individual test methods
 class TestTransitService(unittest.TestCase):
     def test_find_closest_station(self):
         #known coordinates, NYC
         closest_station = find_closest_station(40.7128, -74.0060)
-        self.assertEqual(closest_station, "R16")  #expecting R16 as closest station ID
+        self.assertEqual(closest_station, "CH01")  #City Hall, R16 is one of its alternative IDs
 
 #pytest allows to set up reusable test res
+#make_app(config, warm=False) creates an app with OFFLINE + config (warmed up without polling when warm),
+#every app it made is closed at teardown, even when the test failed. Apps log to the console only, not
+#into a file in the working directory
+@pytest.fixture
+def make_app(monkeypatch):
+    monkeypatch.setenv("LOG_FILE", "")
+    apps = []
+    def make(config=None, warm=False):
+        app = create_app(dict(OFFLINE, **(config or {})))
+        apps.append(app)
+        if warm:
+            warm_up(app, start_polling=False)
+        return app
+    yield make
+    for app in apps:
+        app.extensions['transit'].close()
+
 @pytest.fixture #create a test client for making requests to the Flask app
-def client(): #initializes Flask test client, app.test_client(), make req to Flask app
-    with app.test_client() as client:
+def client(make_app): #initializes Flask test client, app.test_client(), make req to Flask app
+    with make_app().test_client() as client:
         yield client #returns test client for use in the tests
 
 #test /api/transit endpt 
@@ -38,34 +65,201 @@ def test_get_transit_schedules_missing_coordinates(client):
     assert response.status_code == 400 #expect bad req error 
     assert response.get_json() == {"error": "Coordinates are required"} #checks that resp has expected error message
 
-def test_get_lirr_data(): #verifies get_lirr_data returns valid data
-    lirr_data = get_lirr_data()
+#LIRR and Metro North feeds served by a local stub, fetched once by warm_up
+@pytest.fixture
+def rail_services(make_app):
+    now = int(time.time())
+    with StubServer() as server:
+        server.route('/feeds/lirr', make_rail_feed(now).SerializeToString())
+        server.route('/feeds/mnr', make_rail_feed(now, seed=1).SerializeToString())
+        app = make_app({"LIRR_API_URL": server.url('/feeds/lirr'), "METRO_NORTH_API_URL": server.url('/feeds/mnr')}, warm=True)
+        yield app.extensions['transit']
+
+def test_get_lirr_data(rail_services): #verifies get_lirr_data returns valid data
+    lirr_data = get_lirr_data(services=rail_services)
     assert lirr_data is not None  #is data returned
     assert isinstance(lirr_data, dict)  #is it a dict
 
-def test_get_metro_north_data(): #verifies get_metro_north_data returns valid data
-    metro_north_data = get_metro_north_data()
+def test_get_metro_north_data(rail_services): #verifies get_metro_north_data returns valid data
+    metro_north_data = get_metro_north_data(services=rail_services)
     assert metro_north_data is not None  #is data returned
     assert isinstance(metro_north_data, dict)  #is it a dict
 
-def find_closest_station(latitude, longitude):
-    #station data
-    stations = [
-        {"station_id": "R16", "latitude": 40.7128, "longitude": -74.0060},
-        {"station_id": "CH01", "latitude": 40.7127, "longitude": -74.0059},
-    ]
-    
-    closest_station = None
-    min_distance = float('inf')
-
-    for station in stations:
-        #calculate distance 
-        distance = ((latitude - station['latitude']) ** 2 + (longitude - station['longitude']) ** 2) ** 0.5
-        if distance < min_distance:
-            min_distance = distance
-            closest_station = station['station_id']
-
-    return closest_station
+#the same feeds replayed from a capture instead of the live MTA endpoints, no call leaves the process
+def test_rail_data_from_replay(tmp_path, make_app):
+    now = int(time.time())
+    write_capture(str(tmp_path), [(0, "https://replay.invalid/lirr", make_rail_feed(now).SerializeToString()),
+                                  (0, "https://replay.invalid/mnr", make_rail_feed(now, seed=1).SerializeToString())])
+    services = make_app({"LIRR_API_URL": "https://replay.invalid/lirr", "METRO_NORTH_API_URL": "https://replay.invalid/mnr",
+                         "UPSTREAM_REPLAY": str(tmp_path)}, warm=True).extensions['transit']
+    assert isinstance(get_lirr_data(services=services), dict) and isinstance(get_metro_north_data(services=services), dict)
+    assert services.replay_adapter.hits == 2 and services.replay_adapter.misses == 0
+
+#create_app() must stay offline and cheap: no feed URLs needed, nothing loaded until used
+def test_create_app_is_lazy(make_app):
+    services = make_app().extensions['transit']
+    assert services.feed_store.configs() == []
+    assert services._station_registry is None and services._feed_poller is None
+    assert services.station_registry.get("CH01")['name'] == "City Hall"
+
+#warm_up() fills the feed store and station index before any request comes in
+def test_warm_up_prefills_feeds(make_app):
+    with StubServer() as server:
+        server.route('/feeds/ace', make_feed(1700000000))
+        app = make_app({"SUBWAY_API_URLS": [server.url('/feeds/ace')]})
+        timings = warm_up(app, start_polling=False)
+        assert app.extensions['transit'].feed_store.get('ace').header_timestamp == 1700000000
+        assert {'create_app', 'station_registry', 'feeds', 'warm_up'} <= set(timings)
+
+#LIRR and Metro North answers only hold trips between the requested stations, next departures first
+def test_rail_data_filters_stations(tmp_path, make_app):
+    now = int(time.time())
+    (tmp_path / "lirr.txt").write_text("stop_id,stop_name,stop_lat,stop_lon\n237,Penn Station,40.750373,-73.993391\n102,Jamaica,40.699769,-73.808174\n")
+    (tmp_path / "mnr.txt").write_text("stop_id,stop_name,stop_lat,stop_lon\n1,Grand Central,40.752998,-73.977056\n4,Harlem-125 St,40.805157,-73.939149\n")
+    lirr_feed = build_feed(now, [("late", "1", [("237", 0, now + 900), ("102", now + 1800, 0)]),
+                                 ("early", "1", [("237", 0, now + 300), ("102", now + 1200, 0)]),
+                                 ("inbound", "1", [("102", 0, now + 300), ("237", now + 1200, 0)])])
+    mnr_feed = build_feed(now, [("harlem", "2", [("1", 0, now + 120), ("4", now + 720, 0)])])
+    with StubServer() as server:
+        server.route('/feeds/lirr', lirr_feed.SerializeToString())
+        server.route('/feeds/mnr', mnr_feed.SerializeToString())
+        app = make_app({"LIRR_API_URL": server.url('/feeds/lirr'), "METRO_NORTH_API_URL": server.url('/feeds/mnr'),
+                        "STATION_STOPS": f"lirr={tmp_path / 'lirr.txt'},metro_north={tmp_path / 'mnr.txt'}"}, warm=True)
+        services = app.extensions['transit']
+        lirr = get_lirr_data("PS01", "lirr:102", services=services)['schedules'] #subway Penn Station is next to LIRR's
+        assert [schedule['transit_mode'] for schedule in lirr] == ["lirr", "lirr"]
+        assert lirr[0]['eta_origin'] < lirr[1]['eta_origin']
+        assert get_lirr_data("lirr:102", "lirr:237", services=services)['schedules'][0]['transit_mode'] == "lirr"
+        assert len(get_metro_north_data("metro_north:1", "metro_north:4", services=services)['schedules']) == 1
+        assert get_metro_north_data("metro_north:4", "metro_north:1", services=services) == {"schedules": []}
+
+#buses come from StopMonitoring at the stops near the coordinates, never from the full route catalogue per request
+def test_bus_schedules_from_stop_monitoring(make_app):
+    now = int(time.time())
+    #a stop next to City Hall and one next to Times Square, served by the same bus
+    routes = {"MTA NYCT_M55": [("MTA_1", "Broadway/Park Row", 40.7128, -74.0061), ("MTA_2", "7 Av/W 42 St", 40.7579, -73.9856)]}
+    visits = {"MTA_1": [("M55", "bus-1", now + 120)], "MTA_2": [("M55", "bus-1", now + 1500)]}
+    with StubServer() as server:
+        serve_bustime(server, routes, visits)
+        app = make_app({"BUS_API_KEY": "test", "BUS_API_URL": server.url(""), "BUS_AGENCIES": ["MTA NYCT"]}, warm=True)
+        response = app.test_client().post('/api/transit', json={
+            "origin_station_id": "CH01", "destination_station_id": "TSQ01",
+            "coordinates": {"latitude": 40.7128, "longitude": -74.0060}})
+        buses = [schedule for schedule in response.get_json()['next_schedules'] if schedule['transit_mode'] == "bus"]
+        assert len(buses) == 1 and buses[0]['eta_origin'] < buses[0]['eta_destination']
+        assert "bus" not in response.get_json().get('errors', {})
+
+#answers are cached per query and feed versions: a re-poll with the ETag gets 304 until a feed updates
+def test_answers_cached_per_feed_version(make_app):
+    now = int(time.time())
+    body = {"origin_station_id": "CH01", "destination_station_id": "TSQ01", "coordinates": {"latitude": 40.7128, "longitude": -74.0060}}
+    with StubServer() as server:
+        server.route('/feeds/s', build_feed(now, [("s-1", "S", [("S25N", 0, now + 300), ("S29N", now + 900, 0)])]).SerializeToString())
+        app = make_app({"SUBWAY_API_URLS": [server.url('/feeds/s')]}, warm=True)
+        services = app.extensions['transit']
+        client = app.test_client()
+        first = client.post('/api/transit', json=body)
+        assert len(first.get_json()['next_schedules']) == 1
+        assert first.headers['ETag'] and first.headers['Cache-Control'].startswith("max-age=")
+        again = client.post('/api/transit', json=body, headers={"If-None-Match": first.headers['ETag']})
+        assert again.status_code == 304 and services.response_cache.entries.hits == 1
+
+        #a new feed version is a new cache key, the answer and its ETag change
+        server.route('/feeds/s', build_feed(now + 30, [("s-1", "S", [("S25N", 0, now + 300), ("S29N", now + 900, 0)]),
+                                                       ("s-2", "S", [("S25N", 0, now + 600), ("S29N", now + 1200, 0)])]).SerializeToString())
+        services.feed_poller.refresh_all()
+        updated = client.post('/api/transit', json=body, headers={"If-None-Match": first.headers['ETag']})
+        assert updated.status_code == 200 and len(updated.get_json()['next_schedules']) == 2
+        assert updated.headers['ETag'] != first.headers['ETag']
+
+#subway, LIRR and Metro North are matched on the request thread: with every fetch worker stuck on a
+#hung upstream call only bus times out
+def test_in_memory_modes_skip_the_fetch_pool(make_app):
+    now = int(time.time())
+    body = {"origin_station_id": "CH01", "destination_station_id": "TSQ01", "coordinates": {"latitude": 40.7128, "longitude": -74.0060}}
+    with StubServer() as server:
+        server.route('/feeds/s', build_feed(now, [("s-1", "S", [("S25N", 0, now + 300), ("S29N", now + 900, 0)])]).SerializeToString())
+        app = make_app({"SUBWAY_API_URLS": [server.url('/feeds/s')], "FETCH_WORKERS": 2, "REQUEST_DEADLINE": 0.5}, warm=True)
+        services, hung = app.extensions['transit'], threading.Event()
+        for _ in range(2):
+            services.fetcher.executor.submit(hung.wait)
+        try:
+            answer = app.test_client().post('/api/transit', json=body).get_json()
+        finally:
+            hung.set()
+        assert len(answer['next_schedules']) == 1
+        assert answer['errors'] == {"bus": "timeout", "lirr": "unavailable", "metro_north": "unavailable"}
+
+#a batch answers every pair from one set of snapshots, in order, each with its own status
+def test_batch_endpoint(make_app):
+    now = int(time.time())
+    pair = {"origin_station_id": "CH01", "destination_station_id": "TSQ01", "coordinates": {"latitude": 40.7128, "longitude": -74.0060}}
+    reverse = {"origin_station_id": "TSQ01", "destination_station_id": "CH01", "coordinates": {"latitude": 40.7580, "longitude": -73.9855}}
+    with StubServer() as server:
+        server.route('/feeds/s', build_feed(now, [("s-1", "S", [("S25N", 0, now + 300), ("S29N", now + 900, 0)])]).SerializeToString())
+        client = make_app({"SUBWAY_API_URLS": [server.url('/feeds/s')], "MAX_BATCH_QUERIES": 3}, warm=True).test_client()
+        response = client.post('/api/transit/batch', json={"queries": [pair, reverse, pair, {"origin_station_id": "CH01"}]})
+        assert response.status_code == 400 #over MAX_BATCH_QUERIES
+
+        response = client.post('/api/transit/batch', json={"queries": [pair, reverse, {"origin_station_id": "CH01"}]})
+        results = response.get_json()['results']
+        assert [result['status'] for result in results] == [200, 200, 400]
+        assert len(results[0]['next_schedules']) == 1 and results[1]['next_schedules'] == []
+        assert results[2]['error'] == "Coordinates are required"
+        assert client.post('/api/transit/batch', json={"queries": [pair, reverse, {"origin_station_id": "CH01"}]},
+                           headers={"If-None-Match": response.headers['ETag']}).status_code == 304
+        assert client.post('/api/transit/batch', json={"queries": []}).status_code == 400
+
+#/metrics has per-stage latency, the profile header returns the request's own breakdown
+def test_metrics_and_profile_header(make_app):
+    now = int(time.time())
+    with StubServer() as server:
+        server.route('/feeds/s', build_feed(now, [("s-1", "S", [("S25N", 0, now + 300), ("S29N", now + 900, 0)])]).SerializeToString())
+        client = make_app({"SUBWAY_API_URLS": [server.url('/feeds/s')]}, warm=True).test_client()
+        body = {"coordinates": {"latitude": 40.7128, "longitude": -74.0060}}
+        assert 'Server-Timing' not in client.post('/api/transit', json=body).headers
+        timing = client.post('/api/transit', json=body, headers={"X-Transit-Profile": "1"}).headers['Server-Timing']
+        assert timing.startswith("parse;dur=") and "total;dur=" in timing #second request is a cache hit, no modes ran
+
+        response = client.get('/metrics')
+        assert response.mimetype == "text/plain"
+        text = response.get_data(as_text=True)
+        assert 'transit_request_seconds_count{endpoint="/api/transit"} 2' in text
+        assert 'transit_stage_seconds_count{stage="subway"} 1' in text
+        assert 'transit_feed_seconds_count{feed="s",step="decode"} 1' in text
+        assert 'transit_cache_lookups_total{cache="response",result="hit"} 1' in text
+        assert 'transit_feed_version{feed="s"} 1' in text
+
+#with a static timetable, rail schedules still come back while no realtime feed has been fetched
+def test_rail_data_from_timetable(tmp_path, make_app):
+    (tmp_path / "stops.txt").write_text("stop_id,stop_name,stop_lat,stop_lon\n237,Penn Station,40.750373,-73.993391\n102,Jamaica,40.699769,-73.808174\n")
+    write_gtfs(tmp_path / "lirr", [("GO1", "1", "WK", [("237", "08:00:00", "08:00:00"), ("102", "08:20:00", "08:20:00")])],
+               {"WK": ("1111111", 20260101, 20261231)})
+    build_timetable([("lirr", str(tmp_path / "lirr"))], str(tmp_path / "timetable.bin"))
+    services = make_app({"STATION_STOPS": f"lirr={tmp_path / 'stops.txt'}", "TIMETABLE_PATH": str(tmp_path / "timetable.bin")}).extensions['transit']
+    now = int(datetime.datetime(2026, 3, 2, 7, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=-5))).timestamp())
+    schedules = get_rail_data('lirr', "lirr:237", "lirr:102", services=services, now=now)
+    assert len(schedules) == 1 and schedules[0]['eta_origin'] == datetime.datetime.fromtimestamp(now + 1800).strftime('%Y-%m-%d %H:%M:%S')
+    assert get_rail_data('metro_north', "lirr:237", "lirr:102", services=services, now=now) is None #no timetable, no feed
+    assert get_journeys("lirr:237", "lirr:102", services, now=now) is None #its network builds in the background
+    deadline = time.monotonic() + 10
+    while services.journey_planner.rebuilds < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    journeys = get_journeys("lirr:237", "lirr:102", services, now=now)
+    assert [(journey['transfers'], [leg['transit_mode'] for leg in journey['legs']]) for journey in journeys] == [(0, ["lirr"])]
+    assert journeys[0]['eta_destination'] == datetime.datetime.fromtimestamp(now + 3000).strftime('%Y-%m-%d %H:%M:%S')
+
+#without time zone data (no tzdata package) the timetable is skipped and rail falls back to realtime only
+def test_timetable_without_zone_data(tmp_path, make_app, monkeypatch):
+    write_gtfs(tmp_path / "lirr", [("GO1", "1", "WK", [("237", "08:00:00", "08:00:00"), ("102", "08:20:00", "08:20:00")])],
+               {"WK": ("1111111", 20260101, 20261231)})
+    build_timetable([("lirr", str(tmp_path / "lirr"))], str(tmp_path / "timetable.bin"))
+    def missing(key):
+        raise ZoneInfoNotFoundError(f"No time zone found with key {key}")
+    monkeypatch.setattr(timetable, 'ZoneInfo', missing)
+    services = make_app({"TIMETABLE_PATH": str(tmp_path / "timetable.bin")}).extensions['transit']
+    assert services.timetable is None and services.journey_planner is None
+    assert get_rail_data('lirr', "lirr:237", "lirr:102", services=services) is None #no timetable, no feed
 
 if __name__ == '__main__': #to run all tests, runs any methods in class that start with test_ 
     unittest.main()
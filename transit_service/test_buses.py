@@ -0,0 +1,116 @@
+import threading
+import time
+
+import pytest
+
+from transit_service.buses import BusService, BusTimeClient, parse_stop_monitoring
+from transit_service.fetch import Fetcher
+from transit_service.testing import StubServer, serve_bustime, siri_stop_monitoring
+
+NOW = 1700000000
+
+#B63 along 5th Av in Brooklyn, M15 in Manhattan
+ROUTES = {
+    "MTA NYCT_B63": [("MTA_301001", "5 Av/Union St", 40.6770, -73.9830), ("MTA_301002", "5 Av/9 St", 40.6700, -73.9880),
+                     ("MTA_301003", "5 Av/25 St", 40.6600, -73.9960)],
+    "MTA NYCT_M15": [("MTA_401001", "1 Av/E 14 St", 40.7310, -73.9820)],
+}
+VISITS = {
+    "MTA_301001": [("B63", "trip-2", NOW + 300), ("B63", "trip-1", NOW + 60), ("B63", "gone", NOW - 60)],
+    "MTA_301002": [("B63", "trip-1", NOW + 400)],
+    "MTA_301003": [("B63", "trip-1", NOW + 900), ("B63", "trip-2", NOW + 1200)],
+}
+
+
+@pytest.fixture
+def bustime():
+    with StubServer() as server:
+        monitoring = serve_bustime(server, ROUTES, VISITS)
+        fetcher = Fetcher(4, call_timeout=2, deadline=3)
+        client = BusTimeClient(fetcher, "key", server.url(""), agencies=("MTA NYCT",), visits_ttl=30)
+        yield BusService(client, interval=3600, radius_km=0.3, clock=lambda: NOW), monitoring
+        fetcher.close()
+
+
+def test_parse_stop_monitoring():
+    visits = parse_stop_monitoring("MTA_1", siri_stop_monitoring([("B63", "b", NOW + 120), ("B63", "a", NOW + 60)]))
+    assert [(visit.journey_id, visit.route, round(visit.expected)) for visit in visits] == [("a", "B63", NOW + 60), ("b", "B63", NOW + 120)]
+    assert parse_stop_monitoring("MTA_1", {}) == []
+
+
+def test_catalogue_and_nearest_stop(bustime):
+    service, _ = bustime
+    catalogue = service.load()
+    assert service.catalogue() is catalogue and len(catalogue) == 4
+    assert catalogue.routes == {"MTA NYCT_B63": "B63", "MTA NYCT_M15": "M15"}
+    (distance, stop), = catalogue.nearest_stops(40.6771, -73.9831, radius_km=0.3, count=1)
+    assert stop['station_id'] == "MTA_301001" and stop['routes'] == ["B63"] and distance < 0.05
+    assert catalogue.nearest_stops(40.80, -73.90) == [] #nothing within the radius
+
+
+def test_departures_to_destination(bustime):
+    service, monitoring = bustime
+    service.load()
+    #from Union St to 25 St: both buses get there, soonest first, "gone" already left
+    matches = service.departures(40.6771, -73.9831, destination=(40.6601, -73.9961))
+    assert [(origin.journey_id, round(origin.expected), round(arrival.expected)) for origin, arrival in matches] == \
+        [("trip-1", NOW + 60, NOW + 900), ("trip-2", NOW + 300, NOW + 1200)]
+    #the reverse direction has no bus that reaches Union St after 25 St
+    assert service.departures(40.6601, -73.9961, destination=(40.6771, -73.9831)) == []
+    #without a destination every upcoming bus at the nearby stops
+    assert [origin.journey_id for origin, arrival in service.departures(40.6771, -73.9831)] == ["trip-1", "trip-2"]
+    assert monitoring.hits == 2 #one call per stop, the later queries were answered from the cache
+
+
+def test_concurrent_identical_queries_share_one_call(bustime):
+    service, monitoring = bustime
+    monitoring.delay = 0.2
+    client = service.client
+    threads = [threading.Thread(target=client.stop_visits, args=("MTA_301002",)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert monitoring.hits == 1 and client.monitoring_calls == 1
+
+
+def test_stale_catalogue_refreshes_in_background(bustime):
+    service, _ = bustime
+    first = service.load()
+    service.clock = lambda: NOW + 7200 #older than the interval
+    assert service.catalogue() is first #served while the new one loads
+    for _ in range(50):
+        if service._catalogue is not first:
+            break
+        time.sleep(0.02)
+    assert service._catalogue is not first and len(service._catalogue) == 4
+
+
+#a request never waits for the catalogue: buses are unavailable until the background load is done,
+#and that load runs on its own fetcher
+def test_first_catalogue_loads_in_background(bustime):
+    service, monitoring = bustime
+    catalogue_fetcher = Fetcher(2, call_timeout=2, deadline=3)
+    service.client.catalogue_fetcher = catalogue_fetcher
+    try:
+        assert service.departures(40.6771, -73.9831) is None
+        for _ in range(50):
+            if service.catalogue() is not None:
+                break
+            time.sleep(0.02)
+        assert len(service.catalogue()) == 4 and monitoring.hits == 0
+        assert [origin.journey_id for origin, _ in service.departures(40.6771, -73.9831)] == ["trip-1", "trip-2"]
+    finally:
+        catalogue_fetcher.close()
+
+
+#a failed load isn't retried by every request, only after retry_interval
+def test_failed_catalogue_load_retried_later(bustime):
+    service, _ = bustime
+    service.client.base_url = "http://127.0.0.1:1"
+    with pytest.raises(Exception):
+        service.load()
+    assert service.catalogue() is None and not service._refreshing
+    service.clock = lambda: NOW + service.retry_interval
+    service.catalogue()
+    assert service._refreshing or service._attempted_at == NOW + service.retry_interval
@@ -0,0 +1,47 @@
+from transit_service.decoding import TripColumns, columns_from_feed, decode_trip_updates
+from transit_service.feeds import decode_feed
+from transit_service.testing import build_feed, make_synthetic_feed
+
+T = 1700000000
+
+
+#the projected decode and a full protobuf parse (feeds.decode_feed) of the same payload agree
+def test_matches_full_parse():
+    payload = make_synthetic_feed(T, trip_count=60).SerializeToString()
+    feed = decode_feed(payload)
+    columns = decode_trip_updates(payload)
+
+    expected = [(e.trip_update.trip.trip_id, e.trip_update.trip.route_id,
+                 [(u.stop_id, u.arrival.time, u.departure.time) for u in e.trip_update.stop_time_update])
+                for e in feed.entity if e.HasField('trip_update')]
+    decoded = [(columns.trip_ids[trip], columns.route_ids[trip],
+                [(columns.stop_id(row), columns.arrivals[row], columns.departures[row]) for row in columns.rows(trip)])
+               for trip in range(len(columns))]
+    assert columns.header_timestamp == T
+    assert decoded == expected
+
+
+def test_skips_vehicles_alerts_and_missing_times():
+    feed = build_feed(T, [("t1", "A", [("A01N", T + 60, 0), ("A02N", 0, T + 150)])])
+    feed.entity.add(id="v1").vehicle.trip.trip_id = "t1"
+    alert = feed.entity.add(id="a1").alert
+    alert.header_text.translation.add(text="Delays")
+    columns = decode_trip_updates(memoryview(feed.SerializeToString()))
+
+    assert columns.trip_ids == ["t1"]
+    assert [(columns.stop_id(row), columns.arrivals[row], columns.departures[row]) for row in columns.rows(0)] == \
+        [("A01N", T + 60, 0), ("A02N", 0, T + 150)]
+
+
+def test_stop_ids_are_stored_once():
+    feed = build_feed(T, [("t1", "A", [("A01N", T, 0), ("A02N", T, 0)]), ("t2", "A", [("A01N", T, 0)])])
+    columns = decode_trip_updates(feed.SerializeToString())
+    assert columns.stop_names == ["A01N", "A02N"]
+    assert list(columns.stop_codes) == [0, 1, 0]
+    assert columns_from_feed(feed).trip_ids == columns.trip_ids
+
+
+def test_empty_payload():
+    columns = decode_trip_updates(b"")
+    assert len(columns) == 0 and columns.header_timestamp == 0
+    assert isinstance(columns, TripColumns)
@@ -0,0 +1,124 @@
+import threading
+import time
+
+import pytest
+
+from transit_service.feeds import (FeedConfig, FeedPoller, FeedStore, FeedUnavailableError, StaleFeedError,
+                                   feed_name, read_header_timestamp)
+from transit_service.testing import make_feed
+
+
+#fake upstream: returns whatever payload is set for the url and counts calls
+class FakeUpstream:
+    def __init__(self):
+        self.payloads = {}
+        self.calls = 0
+
+    def __call__(self, url):
+        self.calls += 1
+        payload = self.payloads[url]
+        if isinstance(payload, Exception):
+            raise payload
+        return payload
+
+
+@pytest.fixture
+def upstream():
+    return FakeUpstream()
+
+
+@pytest.fixture
+def store():
+    return FeedStore([FeedConfig('gtfs-ace', 'http://feeds/ace', 'subway', interval=0.01, max_staleness=60)])
+
+
+def test_feed_name():
+    assert feed_name("https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-ace") == "gtfs-ace"
+
+
+def test_read_header_timestamp():
+    assert read_header_timestamp(make_feed(1700000000)) == 1700000000
+    assert read_header_timestamp(b"") == 0
+
+
+def test_poll_publishes_snapshot(store, upstream):
+    upstream.payloads['http://feeds/ace'] = make_feed(1700000000)
+    poller = FeedPoller(store, fetch=upstream)
+
+    assert poller.poll(store.config('gtfs-ace'))
+    snapshot = store.get('gtfs-ace')
+    assert snapshot.header_timestamp == 1700000000
+    assert snapshot.feed.trip_ids == ["trip-1"]
+    assert snapshot.index.find_trips(["A01"], ["A02"]) == []
+
+
+def test_unchanged_timestamp_is_skipped(store, upstream):
+    upstream.payloads['http://feeds/ace'] = make_feed(1700000000)
+    poller = FeedPoller(store, fetch=upstream)
+    poller.poll(store.config('gtfs-ace'))
+    first = store.get('gtfs-ace')
+
+    #same header timestamp: no new version, same snapshot object
+    assert not poller.poll(store.config('gtfs-ace'))
+    assert store.get('gtfs-ace') is first
+
+    upstream.payloads['http://feeds/ace'] = make_feed(1700000030, trip_id="trip-2")
+    assert poller.poll(store.config('gtfs-ace'))
+    assert store.get('gtfs-ace').version > first.version
+
+
+def test_views_are_immutable(store, upstream):
+    upstream.payloads['http://feeds/ace'] = make_feed(1700000000)
+    poller = FeedPoller(store, fetch=upstream)
+    poller.poll(store.config('gtfs-ace'))
+    view = store.view()
+    versions = store.versions()
+
+    upstream.payloads['http://feeds/ace'] = make_feed(1700000030)
+    poller.poll(store.config('gtfs-ace'))
+    #a view grabbed earlier keeps pointing at the old snapshot
+    assert view['gtfs-ace'].header_timestamp == 1700000000
+    assert store.versions() != versions
+    with pytest.raises(TypeError):
+        view['gtfs-ace'] = None
+
+
+def test_failed_poll_keeps_previous_snapshot(store, upstream):
+    upstream.payloads['http://feeds/ace'] = make_feed(1700000000)
+    poller = FeedPoller(store, fetch=upstream)
+    poller.poll(store.config('gtfs-ace'))
+
+    upstream.payloads['http://feeds/ace'] = ConnectionError("down")
+    assert not poller.poll(store.config('gtfs-ace'))
+    assert store.get('gtfs-ace').header_timestamp == 1700000000
+
+
+def test_staleness(store, upstream):
+    with pytest.raises(FeedUnavailableError):
+        store.get('gtfs-ace')
+
+    upstream.payloads['http://feeds/ace'] = make_feed(1700000000)
+    FeedPoller(store, fetch=upstream).poll(store.config('gtfs-ace'))
+
+    #within max_staleness: served either way
+    assert store.get('gtfs-ace', allow_stale=False, now=1700000030)
+    #behind: served only when stale data is allowed
+    assert store.get('gtfs-ace', allow_stale=True, now=1700000100)
+    with pytest.raises(StaleFeedError):
+        store.get('gtfs-ace', allow_stale=False, now=1700000100)
+
+
+def test_background_polling(store, upstream):
+    upstream.payloads['http://feeds/ace'] = make_feed(int(time.time()))
+    poller = FeedPoller(store, fetch=upstream)
+    poller.start()
+    try:
+        deadline = time.time() + 2
+        while upstream.calls < 3 and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        poller.stop(timeout=1)
+    #polled repeatedly on its interval, but only decoded and published once
+    assert upstream.calls >= 3
+    assert store.get('gtfs-ace').version == 1
+    assert not any(thread.name == 'feed-poller' for thread in threading.enumerate())
@@ -0,0 +1,88 @@
+import time
+
+import pytest
+
+from transit_service.feeds import FeedConfig, FeedPoller, FeedStore
+from transit_service.fetch import Fetcher, run_inline
+from transit_service.testing import StubServer, make_feed
+
+DELAYS = {'/feeds/ace': 0.3, '/feeds/bdfm': 0.2, '/feeds/g': 0.1, '/feeds/l': 0.3}
+
+
+@pytest.fixture
+def server():
+    with StubServer() as server:
+        for path, delay in DELAYS.items():
+            server.route(path, make_feed(1700000000, trip_id=path), delay=delay)
+        yield server
+
+
+@pytest.fixture
+def fetcher():
+    fetcher = Fetcher(max_workers=8, call_timeout=2, deadline=3)
+    yield fetcher
+    fetcher.close()
+
+
+def test_latency_tracks_slowest_feed(server, fetcher):
+    urls = {path: server.url(path) for path in DELAYS}
+    started = time.monotonic()
+    results = fetcher.fetch_all(urls)
+    elapsed = time.monotonic() - started
+
+    assert all(result.ok for result in results.values())
+    #concurrent: about as long as the slowest feed (0.3s), well under the sum (0.9s)
+    assert elapsed < sum(DELAYS.values()) - 0.3
+
+
+def test_partial_results_on_deadline(server, fetcher):
+    server.route('/feeds/hung', b'', delay=2)
+    urls = {'ace': server.url('/feeds/ace'), 'hung': server.url('/feeds/hung')}
+    started = time.monotonic()
+    results = fetcher.fetch_all(urls, deadline=0.6)
+
+    assert time.monotonic() - started < 1.5
+    assert results['ace'].ok
+    assert not results['hung'].ok and results['hung'].error == 'timeout'
+
+
+#call_timeout starts when a worker picks the call up, a call queued behind another isn't charged for the wait
+def test_call_timeout_per_call():
+    fetcher = Fetcher(max_workers=1, call_timeout=0.3, deadline=2)
+    try:
+        results = fetcher.run_all({'first': lambda: time.sleep(0.2), 'second': lambda: time.sleep(0.2), 'hung': lambda: time.sleep(1)})
+    finally:
+        fetcher.close()
+    assert results['first'].ok and results['second'].ok
+    assert results['hung'].error == 'timeout' and results['hung'].elapsed < 1
+
+
+def test_run_inline():
+    def fails():
+        raise KeyError('boom')
+    results = run_inline({'ok': lambda: 42, 'fails': fails})
+    assert results['ok'].value == 42 and not results['fails'].ok and isinstance(results['fails'].exception, KeyError)
+
+
+def test_error_markers(server, fetcher):
+    server.route('/feeds/broken', b'oops', status=500)
+    results = fetcher.fetch_all({'broken': server.url('/feeds/broken'), 'missing': 'http://127.0.0.1:1/feeds'})
+    assert results['broken'].error == 'HTTP 500'
+    assert results['missing'].error == 'connection error'
+
+
+def test_run_all_keeps_exception(fetcher):
+    def fails():
+        raise KeyError('boom')
+    results = fetcher.run_all({'ok': lambda: 42, 'fails': fails})
+    assert results['ok'].value == 42
+    assert isinstance(results['fails'].exception, KeyError)
+
+
+def test_poller_refreshes_feeds_concurrently(server, fetcher):
+    store = FeedStore([FeedConfig(path, server.url(path), 'subway') for path in DELAYS])
+    poller = FeedPoller(store, fetcher=fetcher)
+    started = time.monotonic()
+    assert all(poller.refresh_all().values())
+    assert time.monotonic() - started < sum(DELAYS.values()) - 0.3
+    assert len(store.view()) == len(DELAYS)
@@ -0,0 +1,149 @@
+import json
+import threading
+import time
+
+from geopy.geocoders import Nominatim
+
+from transit_service.caching import Coalescer, RateLimiter, TTLCache
+from transit_service.geocoding import CachedGeocoder, Gazetteer, geopy_backend
+from transit_service.stations import StationRegistry
+from transit_service.testing import StubServer
+
+STATIONS = [
+    {"name": "City Hall", "latitude": 40.7127, "longitude": -74.0059, "station_id": "CH01"},
+    {"name": "Times Square", "latitude": 40.7580, "longitude": -73.9855, "station_id": "TSQ01"},
+]
+
+
+#stub remote geocoder: counts calls, can be slowed down
+class StubBackend:
+    def __init__(self, address="Somewhere, New York", delay=0.0):
+        self.address = address
+        self.delay = delay
+        self.calls = []
+
+    def __call__(self, latitude, longitude):
+        self.calls.append((latitude, longitude))
+        time.sleep(self.delay)
+        return self.address
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_expiry_and_lru():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3) #evicts b, the least recently used
+    assert cache.get('b') is None and cache.get('c') == 3
+    clock.now = 11
+    assert cache.get('a') is None
+    assert cache.hits == 2 and cache.misses == 2
+
+
+def test_coalescer_shares_one_call():
+    coalescer = Coalescer()
+    calls = []
+    release = threading.Event()
+
+    def slow():
+        calls.append(1)
+        release.wait(1)
+        return "answer"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(coalescer.run('key', slow))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == ["answer"] * 8
+    assert len(calls) == 1
+
+
+def test_rate_limiter_spaces_calls():
+    clock = FakeClock()
+    waits = []
+
+    def sleep(seconds):
+        waits.append(seconds)
+        clock.now += seconds
+
+    limiter = RateLimiter(1.0, clock=clock, sleep=sleep)
+    assert limiter.acquire() and limiter.acquire() and limiter.acquire()
+    assert waits == [1.0, 1.0]
+    #next slot is a second away, a caller that can't wait gives up without claiming it
+    assert not limiter.acquire(max_wait=0.5)
+
+
+def test_reverse_is_cached_on_rounded_coordinates():
+    backend = StubBackend()
+    geocoder = CachedGeocoder(backend, precision=3, min_interval=0)
+    assert geocoder.reverse(40.71281, -74.00601) == "Somewhere, New York"
+    assert geocoder.reverse(40.71279, -74.00598) == "Somewhere, New York" #same 3-decimal cell
+    assert backend.calls == [(40.713, -74.006)]
+
+
+def test_identical_lookups_are_coalesced():
+    backend = StubBackend(delay=0.1)
+    geocoder = CachedGeocoder(backend, min_interval=0)
+    threads = [threading.Thread(target=geocoder.reverse, args=(40.7, -74.0)) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(backend.calls) == 1
+
+
+def test_remote_lookups_are_rate_limited():
+    backend = StubBackend()
+    geocoder = CachedGeocoder(backend, min_interval=0.1)
+    started = time.monotonic()
+    for offset in range(3):
+        geocoder.reverse(40.7 + offset, -74.0)
+    assert time.monotonic() - started >= 0.2
+    assert len(backend.calls) == 3
+
+
+def test_gazetteer_answers_without_remote_call():
+    backend = StubBackend()
+    geocoder = CachedGeocoder(backend, Gazetteer(StationRegistry(STATIONS), radius_km=0.3))
+    assert geocoder.station_for(40.7128, -74.0060)['station_id'] == "CH01"
+    assert backend.calls == []
+
+
+def test_remote_fallback_matches_station_by_name():
+    backend = StubBackend(address="Times Square Station, Manhattan")
+    geocoder = CachedGeocoder(backend, Gazetteer(StationRegistry(STATIONS), radius_km=0.01), min_interval=0)
+    extract = lambda address: address.split("Station")[0] if "Station" in address else None
+    assert geocoder.station_for(40.7600, -73.9855, extract=extract)['station_id'] == "TSQ01"
+    assert len(backend.calls) == 1
+
+
+def test_offline_geocoder():
+    geocoder = CachedGeocoder(None, Gazetteer(StationRegistry(STATIONS)))
+    assert geocoder.reverse(40.7, -74.0) is None
+    assert geocoder.station_for(41.5, -74.0, extract=str) is None
+
+
+#the geopy backend against a local stub of Nominatim's /reverse endpoint
+def test_geopy_backend_against_stub_nominatim():
+    body = json.dumps({"place_id": 1, "lat": "40.7128", "lon": "-74.0060",
+                       "display_name": "New York City Hall, 260, Broadway, Manhattan", "address": {}}).encode()
+    with StubServer() as server:
+        route = server.route('/reverse', body, content_type='application/json')
+        domain = server.url('').split('://')[1]
+        geocoder = CachedGeocoder(geopy_backend(Nominatim(user_agent="test", domain=domain, scheme="http")), min_interval=0)
+        assert geocoder.reverse(40.7128, -74.0060) == "New York City Hall, 260, Broadway, Manhattan"
+        assert geocoder.reverse(40.7128, -74.0060) == "New York City Hall, 260, Broadway, Manhattan"
+        assert route.hits == 1
@@ -0,0 +1,132 @@
+import datetime
+import time
+
+import pytest
+
+from transit_service.decoding import decode_trip_updates
+from transit_service.feeds import FeedSnapshot
+from transit_service.journeys import WALK, JourneyPlanner, raptor
+from transit_service.stations import StationRegistry
+from transit_service.testing import build_feed, write_gtfs
+from transit_service.timetable import Timetable, build_timetable
+
+NEW_YORK = datetime.timezone(datetime.timedelta(hours=-5)) #EST, March 2 2026 is a Monday before DST
+
+
+def at(clock): #posix time of "2026-03-02 HH:MM" in New York
+    hours, minutes = map(int, clock.split(':'))
+    return int(datetime.datetime(2026, 3, 2, tzinfo=NEW_YORK).timestamp()) + hours * 3600 + minutes * 60
+
+
+#subway A01 -> A05 (next to LIRR Penn) then LIRR Penn -> Jamaica, or the slow subway D line from A01
+#to D15 (next to LIRR Jamaica) without a transfer
+@pytest.fixture
+def cold_planner(tmp_path):
+    calendar = {"WK": ("1111100", 20260101, 20261231)}
+    write_gtfs(tmp_path / "subway", [
+        ("AFA-Weekday-00_000600_A..N", "A", "WK", [("A01N", "08:00:00", "08:00:00"), ("A03N", "08:10:00", "08:10:00"), ("A05N", "08:20:00", "08:20:00")]),
+        ("AFA-Weekday-00_000900_D..N", "D", "WK", [("A01N", "08:05:00", "08:05:00"), ("D15N", "09:30:00", "09:30:00")]),
+    ], calendar)
+    write_gtfs(tmp_path / "lirr", [
+        ("GO1", "1", "WK", [("237", "08:30:00", "08:30:00"), ("102", "09:00:00", "09:00:00")]),
+    ], calendar)
+    build_timetable([("subway", str(tmp_path / "subway")), ("lirr", str(tmp_path / "lirr"))], str(tmp_path / "timetable.bin"))
+    registry = StationRegistry([
+        {"station_id": "A01", "name": "Start", "latitude": 40.80, "longitude": -73.95, "gtfs_stops": ["A01"]},
+        {"station_id": "A03", "name": "Middle", "latitude": 40.78, "longitude": -73.97, "gtfs_stops": ["A03"]},
+        {"station_id": "A05", "name": "34 St-Penn Station", "latitude": 40.7506, "longitude": -73.9935, "gtfs_stops": ["A05"]},
+        {"station_id": "D15", "name": "Sutphin Blvd", "latitude": 40.7005, "longitude": -73.8078, "gtfs_stops": ["D15"]},
+        {"station_id": "lirr:237", "name": "Penn Station", "latitude": 40.7502, "longitude": -73.9930, "gtfs_stops": ["237"], "agency": "lirr"},
+        {"station_id": "lirr:102", "name": "Jamaica", "latitude": 40.6999, "longitude": -73.8081, "gtfs_stops": ["102"], "agency": "lirr"},
+    ])
+    return JourneyPlanner(Timetable.open(str(tmp_path / "timetable.bin")), registry)
+
+
+#the same planner with the network for 07:50 built, like after warm_up
+@pytest.fixture
+def planner(cold_planner):
+    cold_planner.warm((), at("07:50"))
+    return cold_planner
+
+
+#the direct train is the zero-transfer journey, changing to the LIRR at Penn gets there 30 minutes sooner
+def test_pareto_journeys_across_agencies(planner):
+    journeys = planner.plan("A01", "lirr:102", at("07:50"))
+    assert [(journey.transfers, journey.arrival) for journey in journeys] == [(0, at("09:30")), (1, at("09:00"))]
+    assert [(leg.mode, leg.trip_id, leg.origin_stop, leg.destination_stop) for leg in journeys[0].legs] == [
+        ("subway", "AFA-Weekday-00_000900_D..N", "A01N", "D15N")]
+    assert [(leg.mode, leg.route_id, leg.origin_stop, leg.destination_stop) for leg in journeys[1].legs] == [
+        ("subway", "A", "A01N", "A05N"), (WALK, None, "A05N", "237"), ("lirr", "1", "237", "102")]
+    assert journeys[1].departure == at("08:00")
+    walk = journeys[1].legs[1]
+    assert walk.departure == at("08:20") and at("08:22") <= walk.arrival <= at("08:30")
+
+
+#leaving after the A train, only the direct train is left; unknown stations have no journeys
+def test_departure_time_and_unknown_stations(planner):
+    assert [journey.transfers for journey in planner.plan("A01", "lirr:102", at("08:02"))] == [0]
+    assert planner.plan("A01", "nowhere", at("07:50")) == []
+    assert planner.plan("A01", "lirr:102", at("10:00")) == []
+
+
+def wait_for_rebuilds(planner, count):
+    deadline = time.monotonic() + 10
+    while planner.rebuilds < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return planner.rebuilds
+
+
+#a query never waits for a build: without a network covering it, there are no journeys (None) until the
+#background build is done
+def test_network_builds_in_the_background(cold_planner):
+    assert cold_planner.plan("A01", "lirr:102", at("07:50")) is None
+    assert wait_for_rebuilds(cold_planner, 1) == 1
+    assert len(cold_planner.plan("A01", "lirr:102", at("07:50"))) == 2
+    #hours later the window has run out, the next one is built the same way
+    assert cold_planner.plan("A01", "lirr:102", at("07:50") + cold_planner.window) is None
+    assert wait_for_rebuilds(cold_planner, 2) == 2
+    assert cold_planner.network((), at("07:50") + cold_planner.window).start > at("07:50")
+
+
+#a LIRR train running 45 minutes late makes the transfer slower than the direct train. The realtime
+#version is picked up by a background rebuild, once rebuild_interval has passed since the last build
+def test_realtime_delays_change_journeys(cold_planner):
+    clock, planner = [0.0], cold_planner
+    planner.clock = lambda: clock[0]
+    planner.warm((), at("07:50"))
+    assert len(planner.plan("A01", "lirr:102", at("07:50"))) == 2
+    feed = build_feed(at("07:50"), [("GO1", "1", [("237", 0, at("09:15")), ("102", at("09:45"), 0)])])
+    snapshot = FeedSnapshot("lirr", "lirr", 1, at("07:50"), at("07:50"), decode_trip_updates(feed.SerializeToString()), None)
+    assert len(planner.plan("A01", "lirr:102", at("07:50"), [snapshot])) == 2 #too soon after the first build
+    assert planner.rebuilds == 1
+
+    clock[0] += planner.rebuild_interval
+    planner.plan("A01", "lirr:102", at("07:50"), [snapshot])
+    assert wait_for_rebuilds(planner, 2) == 2
+    assert planner.network([snapshot], at("07:50")).versions == (("lirr", 1),)
+    journeys = planner.plan("A01", "lirr:102", at("07:50"), [snapshot])
+    assert [(journey.transfers, journey.arrival) for journey in journeys] == [(0, at("09:30"))]
+
+
+#near the end of the window the next one is built in the background, the query uses the current network
+def test_window_moves_ahead_in_the_background(planner):
+    network = planner.network((), at("07:50"))
+    later = network.end - planner.window / 2 + 60
+    assert planner.network((), later) is network
+    assert wait_for_rebuilds(planner, 2) == 2
+    assert planner.network((), later).start > network.start
+
+
+#no trip to take: the same station, or stations a short walk apart, give one journey without rides
+def test_same_and_walkable_stations(planner):
+    assert [(journey.departure, journey.arrival, journey.transfers, journey.legs) for journey in planner.plan("A01", "A01", at("07:50"))] == \
+        [(at("07:50"), at("07:50"), 0, [])]
+    for origin, destination in (("A05", "lirr:237"), ("lirr:237", "A05")):
+        journeys = planner.plan(origin, destination, at("07:50"))
+        assert len(journeys) == 1 and journeys[0].transfers == 0 and journeys[0].legs == []
+    #from A05's own platforms, Penn Station is a walk
+    network = planner.network((), at("07:50"))
+    stops = lambda agency, station: [network.stop_numbers[(agency, code)] for code in planner.timetables[agency].stop_codes([station])]
+    journeys = raptor(network, stops("subway", "A05"), stops("lirr", "237"), at("07:50"))
+    assert len(journeys) == 1 and [leg.mode for leg in journeys[0].legs] == [WALK] and journeys[0].transfers == 0
+    assert journeys[0].departure == at("07:50") and at("07:52") <= journeys[0].arrival < at("07:54")
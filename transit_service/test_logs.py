@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from transit_service.logs import JsonFormatter, RateLimitFilter, process_log_file, setup_logging, stop_logging
+
+
+def make_record(msg, *args, level=logging.DEBUG, **extra):
+    record = logging.LogRecord('transit_api', level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    path = tmp_path / "api.log"
+    yield path
+    setup_logging(log_file='', force=True) #back to console-only logging for the other tests
+
+
+def test_json_formatter_one_line_with_extra_fields():
+    line = JsonFormatter().format(make_record("Found %s trips\nacross feeds", 3, level=logging.INFO, origin="CH01"))
+    assert "\n" not in line
+    entry = json.loads(line)
+    assert entry["message"] == "Found 3 trips\nacross feeds"
+    assert entry["level"] == "INFO" and entry["origin"] == "CH01"
+
+
+def test_rate_limit_per_template():
+    now = [0.0]
+    limiter = RateLimitFilter(burst=2, interval=10, clock=lambda: now[0])
+    passed = [limiter.filter(make_record("Matched trip %s", trip)) for trip in range(5)]
+    assert passed == [True, True, False, False, False]
+    assert limiter.filter(make_record("Other message %s", 1)) #separate template, separate budget
+    assert limiter.filter(make_record("Warning %s", 1, level=logging.WARNING)) #above max_level, never limited
+
+    now[0] = 11.0
+    record = make_record("Matched trip %s", 9)
+    assert limiter.filter(record) and record.suppressed == 3
+
+
+def test_records_are_formatted_and_written_off_the_calling_thread(log_file):
+    formatted_on = []
+
+    class Probe:
+        def __str__(self):
+            formatted_on.append(threading.current_thread().name)
+            return "probe"
+
+    logger = setup_logging(level='DEBUG', log_format='json', log_file=str(log_file), force=True)
+    for handler in logger.handlers:
+        handler.filters.clear() #no rate limit, every record counts here
+    logger.info("Request for %s", Probe(), extra={"origin": "CH01"})
+    for number in range(50):
+        logger.debug("Matched trip %s", number)
+    stop_logging() #flushes the queue
+    lines = log_file.read_text().splitlines()
+    assert json.loads(lines[0]) == {**json.loads(lines[0]), "message": "Request for probe", "origin": "CH01"}
+    assert len(lines) == 51
+    assert formatted_on and threading.main_thread().name not in formatted_on
+
+
+def test_disabled_debug_is_never_formatted(log_file):
+    calls = []
+
+    class Probe:
+        def __str__(self):
+            calls.append(1)
+            return "probe"
+
+    logger = setup_logging(level='INFO', log_file=str(log_file), force=True)
+    logger.debug("Stops %s", Probe())
+    stop_logging()
+    assert calls == [] and log_file.read_text() == ""
+
+
+#importing the app module sets nothing up: no writer thread, no log file in the working directory
+def test_import_has_no_logging_side_effects(tmp_path):
+    code = "import threading, transit_service.app; print(threading.active_count())"
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), LOG_FILE="transit_api.log")
+    result = subprocess.run([sys.executable, "-c", code], cwd=str(tmp_path), env=env, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "1"
+    assert not (tmp_path / "transit_api.log").exists()
+
+
+def test_process_log_file(monkeypatch):
+    monkeypatch.setenv("LOG_FILE", "logs/transit_api.log")
+    assert process_log_file() == f"logs/transit_api.{os.getpid()}.log"
+    monkeypatch.setenv("LOG_FILE", "")
+    assert process_log_file() == ""
@@ -0,0 +1,54 @@
+from transit_service.metrics import Counter, Histogram, Metrics, Profile
+
+
+#buckets are cumulative and end with +Inf, sum and count cover every observation
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram('latency_seconds', "Latency", ['stage'], buckets=(0.01, 0.1))
+    for value in (0.005, 0.05, 0.05, 3.0):
+        histogram.observe(value, "match")
+    lines = histogram.render()
+    assert lines[:2] == ["# HELP latency_seconds Latency", "# TYPE latency_seconds histogram"]
+    assert lines[2:5] == ['latency_seconds_bucket{stage="match",le="0.01"} 1', 'latency_seconds_bucket{stage="match",le="0.1"} 3',
+                          'latency_seconds_bucket{stage="match",le="+Inf"} 4']
+    assert lines[6] == 'latency_seconds_count{stage="match"} 4'
+    assert histogram.totals("match") == (3.105, 4)
+
+
+def test_counter_escapes_label_values():
+    counter = Counter('failures_total', "Failures", ['error'])
+    counter.inc('say "hi"\n')
+    counter.inc('say "hi"\n', amount=2)
+    assert counter.render()[2] == 'failures_total{error="say \\"hi\\"\\n"} 3'
+
+
+
+#fetch error markers become the documented label values
+def test_upstream_failure_labels():
+    metrics = Metrics()
+    for error in ("HTTP 503", "HTTP 503", "timeout", "connection error"):
+        metrics.upstream_failure("gtfs-ace", error)
+    lines = metrics.upstream_failures.render()
+    assert 'transit_upstream_failures_total{call="gtfs-ace",error="http_503"} 2' in lines
+    assert 'transit_upstream_failures_total{call="gtfs-ace",error="timeout"} 1' in lines
+    assert 'transit_upstream_failures_total{call="gtfs-ace",error="connection_error"} 1' in lines
+
+
+#a timed stage lands in the histogram and in the request's profile
+def test_stage_timer_feeds_profile():
+    metrics = Metrics()
+    profile = Profile()
+    with metrics.stage('geocode', profile):
+        pass
+    metrics.record_stage('subway', 0.002, profile)
+    metrics.record_stage('subway', 0.001, profile)
+    assert metrics.stages.totals('geocode')[1] == 1
+    assert profile.server_timing().startswith("geocode;dur=")
+    assert profile.server_timing().endswith("subway;dur=3.000")
+
+
+def test_collected_values_read_at_render():
+    metrics = Metrics()
+    values = {"ace": 1}
+    metrics.add_collected('feed_version', "Version", 'gauge', ['feed'], lambda: [((name,), version) for name, version in values.items()])
+    values["ace"] = 7
+    assert 'feed_version{feed="ace"} 7' in metrics.render()
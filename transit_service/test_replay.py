@@ -0,0 +1,61 @@
+import json
+
+import pytest
+import requests
+
+from transit_service.fetch import Fetcher
+from transit_service.replay import Capture, CaptureWriter, ReplayAdapter, capture_url, route_session
+from transit_service.testing import StubServer, write_capture
+
+
+def test_capture_url_drops_api_key():
+    assert capture_url("https://bustime.mta.info/api/siri/stop-monitoring.json?key=SECRET&MonitoringRef=308209&version=2") == \
+        "https://bustime.mta.info/api/siri/stop-monitoring.json?MonitoringRef=308209&version=2"
+    assert capture_url("https://x/feeds/ace?b=2&a=1") == capture_url("https://x/feeds/ace?a=1&b=2")
+
+
+#a recording fetcher still gets the real answers, the capture holds them without the API key
+def test_records_through_the_session(tmp_path):
+    writer = CaptureWriter(str(tmp_path / "capture"))
+    fetcher = Fetcher(2)
+    route_session(fetcher.session, writer=writer)
+    with StubServer() as server:
+        server.route('/feeds/ace', b'feed-1')
+        server.route('/missing', b'gone', status=500)
+        assert fetcher.get(server.url('/feeds/ace'), params={"key": "SECRET"}) == b'feed-1'
+        with pytest.raises(requests.HTTPError):
+            fetcher.get(server.url('/missing'))
+    fetcher.close()
+    writer.close()
+    assert "SECRET" not in (tmp_path / "capture" / "index.jsonl").read_text()
+    capture = Capture.load(str(tmp_path / "capture"))
+    recorded = capture.exchanges[capture_url(server.url('/feeds/ace'))]
+    assert [(exchange.status, capture.body(exchange)) for exchange in recorded] == [(200, b'feed-1')]
+    assert capture.exchanges[capture_url(server.url('/missing'))][0].status == 500
+
+
+#speed 0: each request gets the url's next response, the last one repeats; unknown urls are 404
+def test_replay_in_sequence(tmp_path):
+    write_capture(str(tmp_path), [(0, "https://feeds/ace", b'v1'), (30, "https://feeds/ace", b'v2'),
+                                  (31, "https://bus/stops.json?key=K&id=1", b'{}', 200, 'application/json')])
+    fetcher = Fetcher(2)
+    route_session(fetcher.session, replay=ReplayAdapter(Capture.load(str(tmp_path)), speed=0))
+    assert [fetcher.get("https://feeds/ace") for _ in range(3)] == [b'v1', b'v2', b'v2']
+    assert json.loads(fetcher.get("https://bus/stops.json", params={"id": 1, "key": "other"})) == {}
+    with pytest.raises(requests.HTTPError):
+        fetcher.get("https://feeds/bdfm")
+    fetcher.close()
+
+
+#with a speed the replay clock runs that many times faster than the capture
+def test_replay_at_recorded_timing(tmp_path):
+    write_capture(str(tmp_path), [(0, "https://feeds/ace", b'v1'), (30, "https://feeds/ace", b'v2'), (60, "https://feeds/ace", b'v3')])
+    now = [100.0]
+    adapter = ReplayAdapter(Capture.load(str(tmp_path)), speed=10, clock=lambda: now[0])
+    body = lambda: adapter.capture.body(adapter.exchange_for("https://feeds/ace"))
+    assert body() == b'v1'
+    now[0] += 3.5 #35s of capture
+    assert body() == b'v2'
+    now[0] += 100
+    assert body() == b'v3'
+    assert Capture.load(str(tmp_path)).duration == 60
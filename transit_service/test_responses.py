@@ -0,0 +1,40 @@
+from transit_service.responses import ResponseCache, etag_for, response_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_etag_depends_only_on_content():
+    assert etag_for({"a": 1, "b": [1, 2]}) == etag_for({"b": [1, 2], "a": 1})
+    assert etag_for({"a": 1}) != etag_for({"a": 2})
+
+
+#feed versions are part of the key, coordinates are rounded
+def test_response_key():
+    query = {"origin_station_id": "CH01", "destination_station_id": "TSQ01", "latitude": 40.71281, "longitude": -74.00601, "allow_stale": True}
+    nearby = dict(query, latitude=40.71284)
+    assert response_key(query, (("ace", 1),), 4) == response_key(nearby, (("ace", 1),), 4)
+    assert response_key(query, (("ace", 1),), 4) != response_key(query, (("ace", 2),), 4)
+
+
+def test_entries_expire_and_report_max_age():
+    clock = FakeClock()
+    cache = ResponseCache(10, ttl=15, clock=clock)
+    cached = cache.put("key", {"next_schedules": []})
+    assert cache.get("key") == cached and cache.max_age(cached) == 15
+    clock.now += 10
+    assert cache.max_age(cache.get("key")) == 5
+    clock.now += 5
+    assert cache.get("key") is None
+
+
+#ttl 0 turns caching off, answers still get an ETag
+def test_disabled_cache_keeps_nothing():
+    cache = ResponseCache(10, ttl=0)
+    cached = cache.put("key", {"next_schedules": []})
+    assert cached.etag and cache.get("key") is None and cache.max_age(cached) == 0
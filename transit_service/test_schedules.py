@@ -0,0 +1,79 @@
+from collections import namedtuple
+
+import pytest
+
+from transit_service.schedules import find_departures, stops_for_agency
+from transit_service.stations import StationRegistry
+from transit_service.stop_index import StopIndex
+from transit_service.testing import build_feed, make_rail_feed, make_synthetic_feed
+
+T = 1700000000
+
+Snapshot = namedtuple('Snapshot', ['agency', 'index'])
+
+STATIONS = [
+    {"station_id": "PS01", "name": "34 St-Penn Station", "latitude": 40.7505, "longitude": -73.9934, "gtfs_stops": ["A28"]},
+    {"station_id": "lirr:237", "agency": "lirr", "name": "Penn Station", "latitude": 40.750373, "longitude": -73.993391, "gtfs_stops": ["237"]},
+    {"station_id": "lirr:102", "agency": "lirr", "name": "Jamaica", "latitude": 40.699769, "longitude": -73.808174, "gtfs_stops": ["102"]},
+    {"station_id": "metro_north:1", "agency": "metro_north", "name": "Grand Central", "latitude": 40.752998, "longitude": -73.977056, "gtfs_stops": ["1"]},
+    {"station_id": "metro_north:4", "agency": "metro_north", "name": "Harlem-125 St", "latitude": 40.805157, "longitude": -73.939149, "gtfs_stops": ["4"]},
+]
+
+
+def snapshot(agency, trips):
+    return Snapshot(agency, StopIndex.from_feed(build_feed(T, trips)))
+
+
+@pytest.fixture
+def registry():
+    return StationRegistry(STATIONS)
+
+
+def test_stops_for_agency(registry):
+    assert stops_for_agency(registry, "lirr:237", "lirr") == ["237"]
+    #subway Penn Station and LIRR Penn Station are the same place
+    assert stops_for_agency(registry, "PS01", "lirr") == ["237"]
+    assert stops_for_agency(registry, "lirr:237", "subway") == ["A28"]
+    assert stops_for_agency(registry, "metro_north:1", "lirr") == []
+    assert stops_for_agency(registry, "unknown", "lirr") == []
+
+
+def test_lirr_filters_on_origin_and_destination(registry):
+    lirr = snapshot("lirr", [
+        ("to-jamaica", "1", [("237", 0, T + 600), ("102", T + 1500, T + 1560)]),
+        ("from-jamaica", "1", [("102", 0, T + 300), ("237", T + 1200, 0)]),
+        ("elsewhere", "2", [("1", 0, T + 100), ("8", T + 900, 0)]),
+    ])
+    departures = find_departures([lirr], stops_for_agency(registry, "PS01", "lirr"), ["102"])
+    assert [(d.trip_id, d.departure, d.arrival) for d in departures] == [("to-jamaica", T + 600, T + 1500)]
+
+
+def test_metro_north_is_sorted_capped_and_upcoming():
+    trips = [(f"t{n}", "H", [("1", 0, T + 60 * n), ("4", T + 60 * n + 600, 0), ("9", T + 60 * n + 1200, 0)])
+             for n in (5, 3, 9, 1, 7)]
+    departures = find_departures([snapshot("metro_north", trips)], ["1"], ["4"], now=T + 120, limit=3)
+    assert [d.trip_id for d in departures] == ["t3", "t5", "t7"] #t1 already left
+    assert all(d.agency == "metro_north" and d.destination_stop == "4" for d in departures)
+
+
+def test_subway_merges_feeds_one_entry_per_trip():
+    ace = snapshot("subway", [("a", "A", [("A27N", T + 200, 0), ("A28N", T + 300, 0), ("A31N", T + 500, 0)])])
+    bdfm = snapshot("subway", [("d", "D", [("D16N", T + 100, 0), ("D17N", T + 400, 0)])])
+    departures = find_departures([ace, bdfm], ["A27", "A28", "D16"], ["A31", "D17"])
+    assert [(d.trip_id, d.origin_stop, d.departure) for d in departures] == [("d", "D16N", T + 100), ("a", "A27N", T + 200)]
+
+
+def test_output_is_bounded_on_large_feeds():
+    departures = find_departures([Snapshot("lirr", StopIndex.from_feed(make_rail_feed(T, trip_count=500)))], ["1"], ["10"], limit=10)
+    assert len(departures) == 10
+    assert [d.departure for d in departures] == sorted(d.departure for d in departures)
+
+    feed = make_synthetic_feed(T, trip_count=300)
+    departures = find_departures([Snapshot("subway", StopIndex.from_feed(feed))], ["A10", "C10"], ["A30", "C30"], limit=4)
+    assert len(departures) == 4
+
+
+def test_missing_stops_or_times():
+    lirr = snapshot("lirr", [("no-times", "1", [("237", 0, 0), ("102", 0, 0)])])
+    assert find_departures([lirr], ["237"], ["102"]) == []
+    assert find_departures([lirr], [], ["102"]) == []
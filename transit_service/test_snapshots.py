@@ -0,0 +1,85 @@
+import os
+
+from transit_service.decoding import decode_trip_updates
+from transit_service.feeds import FeedConfig, FeedSnapshot, FeedStore
+from transit_service.snapshots import MANIFEST, SnapshotFollower, SnapshotWriter, dump_columns, load_columns, map_columns
+from transit_service.stop_index import StopIndex
+from transit_service.testing import build_feed, make_synthetic_feed
+
+T = 1700000000
+
+
+def columns_of(feed):
+    return decode_trip_updates(feed.SerializeToString())
+
+
+def as_rows(columns):
+    return [(columns.trip_ids[trip], columns.route_ids[trip],
+             [(columns.stop_id(row), columns.arrivals[row], columns.departures[row]) for row in columns.rows(trip)])
+            for trip in range(len(columns))]
+
+
+def snapshot(name, version, columns):
+    return FeedSnapshot(name, 'subway', version, columns.header_timestamp, T + 5, columns, StopIndex.from_columns(columns))
+
+
+def test_dump_load_round_trip(tmp_path):
+    columns = columns_of(make_synthetic_feed(T, trip_count=40))
+    loaded = load_columns(dump_columns(columns))
+    assert loaded.header_timestamp == T
+    assert as_rows(loaded) == as_rows(columns)
+
+    path = tmp_path / "ace.cols"
+    path.write_bytes(dump_columns(columns))
+    mapped = map_columns(str(path))
+    assert as_rows(mapped) == as_rows(columns)
+    index = StopIndex.from_columns(mapped)
+    assert index.find_trips(["A10"], ["A20"]) == StopIndex.from_columns(columns).find_trips(["A10"], ["A20"])
+
+
+def test_empty_columns():
+    loaded = load_columns(dump_columns(columns_of(build_feed(T, []))))
+    assert len(loaded) == 0 and loaded.stop_names == []
+
+
+def test_follower_publishes_writer_versions(tmp_path):
+    writer = SnapshotWriter(str(tmp_path))
+    writer(snapshot('gtfs-ace', 7, columns_of(build_feed(T, [("t1", "A", [("A01N", T + 60, 0), ("A02N", T + 120, 0)])]))))
+
+    store = FeedStore([FeedConfig('gtfs-ace', 'http://feeds/ace', 'subway')])
+    follower = SnapshotFollower(store, str(tmp_path))
+    assert follower.wait(1)
+    shared = store.get('gtfs-ace')
+    assert (shared.version, shared.fetched_at, shared.header_timestamp) == (7, T + 5, T)
+    assert len(shared.index.find_trips(["A01"], ["A02"])) == 1
+    assert follower.sync() == 0 #manifest unchanged
+
+    writer(snapshot('gtfs-ace', 9, columns_of(build_feed(T + 30, [("t2", "A", [("A01N", T + 90, 0)])]))))
+    assert follower.sync() == 1
+    assert store.get('gtfs-ace').feed.trip_ids == ["t2"]
+    assert sorted(os.listdir(tmp_path)) == ["gtfs-ace-9.cols", MANIFEST] #the old version is gone
+    assert shared.feed.trip_ids == ["t1"] #a snapshot a reader still holds keeps working
+
+
+#publishes within one mtime tick leave the manifest's stat unchanged, its sequence still moves
+def test_follower_sees_rewrites_with_the_same_stat(tmp_path):
+    writer = SnapshotWriter(str(tmp_path))
+    feed = lambda version: columns_of(build_feed(T + version, [("t1", "A", [("A01N", T + 60, 0)])]))
+    writer(snapshot('gtfs-ace', 1, feed(1)))
+    store = FeedStore([FeedConfig('gtfs-ace', 'http://feeds/ace', 'subway')])
+    follower = SnapshotFollower(store, str(tmp_path))
+    assert follower.sync() == 1
+    manifest = tmp_path / MANIFEST
+    before = os.stat(manifest)
+    writer(snapshot('gtfs-ace', 2, feed(2)))
+    os.utime(manifest, ns=(before.st_atime_ns, before.st_mtime_ns))
+    assert os.stat(manifest).st_size == before.st_size
+    assert follower.sync() == 1
+    assert store.get('gtfs-ace').version == 2
+
+
+def test_store_listener_sees_every_publish(tmp_path):
+    store = FeedStore()
+    store.add_listener(SnapshotWriter(str(tmp_path)))
+    store.publish(snapshot('gtfs-g', store.next_version(), columns_of(build_feed(T, []))))
+    assert "gtfs-g-1.cols" in os.listdir(tmp_path)
@@ -0,0 +1,90 @@
+import random
+
+import pytest
+
+from transit_service.stations import StationRegistry, haversine_km, load_stops, parse_stops_setting
+from transit_service.testing import random_stations
+
+STOPS_TXT = """stop_id,stop_name,stop_lat,stop_lon,location_type,parent_station
+101,Van Cortlandt Park-242 St,40.889248,-73.898583,1,
+101N,Van Cortlandt Park-242 St,40.889248,-73.898583,0,101
+101S,Van Cortlandt Park-242 St,40.889248,-73.898583,0,101
+R16,Times Sq-42 St,40.754672,-73.986754,1,
+R16N,Times Sq-42 St,40.754672,-73.986754,0,R16
+A27,42 St-Port Authority Bus Terminal,40.757308,-73.989735,1,
+"""
+
+
+#reference answer: every station sorted by haversine distance
+def brute_force(stations, latitude, longitude, exclude=()):
+    candidates = [s for s in stations if s['station_id'] not in exclude]
+    return sorted(candidates, key=lambda s: haversine_km(latitude, longitude, s['latitude'], s['longitude']))
+
+
+def test_load_stops(tmp_path):
+    path = tmp_path / "stops.txt"
+    path.write_text(STOPS_TXT)
+    stations = load_stops(path)
+    assert [station['station_id'] for station in stations] == ["101", "R16", "A27"]
+    assert stations[0]['gtfs_stops'] == ["101"]
+
+    lirr = load_stops(path, agency='lirr')
+    assert lirr[1]['station_id'] == "lirr:R16"
+    assert lirr[1]['gtfs_stops'] == ["R16"]
+
+
+def test_parse_stops_setting():
+    assert parse_stops_setting(None) == []
+    assert parse_stops_setting("subway=a/stops.txt, lirr=b/stops.txt") == [("subway", "a/stops.txt"), ("lirr", "b/stops.txt")]
+
+
+def test_haversine():
+    #Times Sq to Grand Central is about 0.9 km
+    assert haversine_km(40.7580, -73.9855, 40.7527, -73.9772) == pytest.approx(0.92, abs=0.05)
+
+
+def test_nearest_matches_brute_force():
+    stations = random_stations(1500)
+    registry = StationRegistry(stations)
+    rng = random.Random(1)
+    for _ in range(200):
+        latitude, longitude = rng.uniform(40.5, 41.2), rng.uniform(-74.3, -73.2)
+        expected = brute_force(stations, latitude, longitude)
+        found = registry.nearest(latitude, longitude, k=5)
+        assert [station['station_id'] for _, station in found] == [s['station_id'] for s in expected[:5]]
+        assert found[0][0] == pytest.approx(haversine_km(latitude, longitude, expected[0]['latitude'], expected[0]['longitude']))
+
+
+def test_exclusion_without_rescan():
+    stations = random_stations(300)
+    registry = StationRegistry(stations)
+    first = registry.nearest(40.75, -73.98)[0][1]['station_id']
+    second = registry.nearest(40.75, -73.98, exclude=[first])[0][1]['station_id']
+    assert second != first
+    assert second == brute_force(stations, 40.75, -73.98, exclude=[first])[0]['station_id']
+
+
+def test_alternative_ids():
+    registry = StationRegistry([
+        {"station_id": "CH01", "latitude": 40.7127, "longitude": -74.0059, "alternative_ids": ["R16"]},
+        {"station_id": "TSQ01", "latitude": 40.7580, "longitude": -73.9855},
+    ])
+    assert registry.get("R16")['station_id'] == "CH01"
+    #excluding by alternative id excludes the station itself
+    assert registry.nearest(40.7128, -74.0060, exclude=["R16"])[0][1]['station_id'] == "TSQ01"
+
+
+def test_within_radius():
+    stations = random_stations(1000)
+    registry = StationRegistry(stations)
+    found = registry.within(40.75, -73.98, 3.0)
+    expected = [s['station_id'] for s in brute_force(stations, 40.75, -73.98)
+                if haversine_km(40.75, -73.98, s['latitude'], s['longitude']) <= 3.0]
+    assert [station['station_id'] for _, station in found] == expected
+    assert all(distance <= 3.0 for distance, _ in found)
+
+
+def test_empty_registry():
+    registry = StationRegistry([])
+    assert registry.nearest(40.75, -73.98) == []
+    assert registry.within(40.75, -73.98, 1) == []
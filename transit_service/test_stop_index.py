@@ -0,0 +1,69 @@
+from transit_service.stop_index import StopIndex, base_stop_id
+from transit_service.testing import build_feed, make_synthetic_feed
+
+T = 1700000000
+
+
+def make_index(trips):
+    return StopIndex.from_feed(build_feed(T, trips))
+
+
+def test_base_stop_id():
+    assert base_stop_id("A01N") == "A01"
+    assert base_stop_id("A01S") == "A01"
+    assert base_stop_id("S25") == "S25"
+    assert base_stop_id("237") == "237"
+
+
+def test_exact_prefix_matching():
+    index = make_index([
+        ("t1", "1", [("S2N", T + 60, 0), ("S29N", T + 120, 0)]),
+        ("t2", "1", [("S25N", T + 60, 0), ("S29N", T + 120, 0)]),
+    ])
+    #"S2" used to match S25 as a substring
+    pairs = index.find_trips(["S2"], ["S29"])
+    assert [index.trips[origin.trip].trip_id for origin, _ in pairs] == ["t1"]
+
+
+def test_direction_suffixes():
+    index = make_index([
+        ("north", "A", [("A01N", T + 60, 0), ("A02N", T + 120, 0)]),
+        ("south", "A", [("A02S", T + 60, 0), ("A01S", T + 120, 0)]),
+    ])
+    assert len(index.find_trips(["A01"], ["A02"])) == 1
+    assert len(index.find_trips(["A02"], ["A01"])) == 1
+    assert index.find_trips(["A01S"], ["A02S"]) == []
+    assert len(index.find_trips(["A01N"], ["A02N"])) == 1
+
+
+def test_destination_must_come_after_origin():
+    index = make_index([("t1", "A", [("A03N", T + 60, 0), ("A01N", T + 120, 0), ("A02N", T + 180, 0)])])
+    pairs = index.find_trips(["A01"], ["A02", "A03"])
+    assert [(origin.stop_id, destination.stop_id) for origin, destination in pairs] == [("A01N", "A02N")]
+    assert pairs[0][0].arrival == T + 120 and pairs[0][1].arrival == T + 180
+
+
+def test_times_and_trip_info():
+    index = make_index([("t1", "A", [("A01N", 0, T + 30), ("A02N", T + 90, 0)])])
+    origin, destination = index.find_trips(["A01"], ["A02"])[0]
+    assert (origin.arrival, origin.departure) == (0, T + 30)
+    assert index.trips[origin.trip] == ("t1", "A")
+
+
+def test_matches_full_scan_on_synthetic_feed():
+    feed = make_synthetic_feed(T, trip_count=130)
+    index = StopIndex.from_feed(feed)
+    origins, destinations = ["A10", "C10"], ["A20", "C20"]
+
+    expected = []
+    for trip, entity in enumerate(e for e in feed.entity if e.HasField('trip_update')):
+        updates = entity.trip_update.stop_time_update
+        for i, origin in enumerate(updates):
+            if base_stop_id(origin.stop_id) in origins:
+                for destination in updates[i + 1:]:
+                    if base_stop_id(destination.stop_id) in destinations:
+                        expected.append((trip, origin.stop_id, destination.stop_id))
+
+    pairs = index.find_trips(origins, destinations)
+    assert expected
+    assert [(o.trip, o.stop_id, d.stop_id) for o, d in pairs] == expected
@@ -0,0 +1,86 @@
+import json
+import socket
+import time
+
+import pytest
+
+from transit_service.services import TransitServices, load_config
+from transit_service.streaming import StreamServer, diff_schedules
+from transit_service.testing import make_rail_feed, write_capture
+
+
+def test_diff_schedules():
+    entry = lambda departure: {"transit_mode": "lirr", "eta_origin": departure, "eta_destination": "09:00"}
+    added, removed = diff_schedules([entry("08:00"), entry("08:10")], [entry("08:10"), entry("08:20")])
+    assert added == [entry("08:20")] and removed == [entry("08:00")]
+    assert diff_schedules([entry("08:00")], [entry("08:00")]) == ([], [])
+
+
+#LIRR feed replayed one version per refresh, stream server on its own loop thread
+@pytest.fixture
+def server(tmp_path):
+    now = int(time.time())
+    write_capture(str(tmp_path / "capture"), [(0, "https://replay.invalid/lirr", make_rail_feed(now).SerializeToString()),
+                                              (30, "https://replay.invalid/lirr", make_rail_feed(now + 600, seed=1).SerializeToString())])
+    (tmp_path / "lirr.txt").write_text("stop_id,stop_name,stop_lat,stop_lon\n1,Penn Station,40.750373,-73.993391\n5,Jamaica,40.699769,-73.808174\n")
+    config = load_config({"SUBWAY_API_URLS": [], "LIRR_API_URL": "https://replay.invalid/lirr", "METRO_NORTH_API_URL": "", "BUS_API_KEY": "",
+                          "STATION_STOPS": f"lirr={tmp_path / 'lirr.txt'}", "UPSTREAM_REPLAY": str(tmp_path / "capture"), "UPSTREAM_REPLAY_SPEED": 0})
+    services = TransitServices(config)
+    services.warm_up(start_polling=False)
+    stream = StreamServer(services)
+    stream.start_in_thread()
+    yield stream
+    stream.stop()
+    services.close()
+
+
+def connect(server, target):
+    connection = socket.create_connection(('127.0.0.1', server.port), timeout=5)
+    connection.sendall(f"GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    return connection.makefile('rb')
+
+
+#status line, then (event, data) of the next event, keep-alive comments skipped
+def read_event(stream):
+    event, data = None, None
+    while True:
+        line = stream.readline().decode().rstrip("\n")
+        if not line and event:
+            return event, json.loads(data)
+        if line.startswith("event: "):
+            event = line[7:]
+        elif line.startswith("data: "):
+            data = line[6:]
+
+
+def read_headers(stream):
+    status = stream.readline().decode()
+    while stream.readline() not in (b"\r\n", b""):
+        pass
+    return int(status.split()[1])
+
+
+#two subscribers of one pair: both get the current schedules, then one computation per feed change pushes the diff to both
+def test_subscribers_get_snapshot_then_diffs(server):
+    first = connect(server, "/api/transit/stream?pair=lirr:1,lirr:5")
+    assert read_headers(first) == 200
+    event, data = read_event(first)
+    assert event == "schedules" and data["pair"] == "lirr:1,lirr:5" and data["next_schedules"]
+    second = connect(server, "/api/transit/stream?pair=lirr:1,lirr:5")
+    assert read_headers(second) == 200
+    assert read_event(second)[1]["next_schedules"] == data["next_schedules"]
+    assert server.hub.computed == 1
+
+    server.services.feed_poller.refresh_all() #the next recorded version
+    for stream in (first, second):
+        event, update = read_event(stream)
+        assert event == "update" and update["pair"] == "lirr:1,lirr:5"
+        assert update["added"] and update["removed"]
+        assert all(entry["transit_mode"] == "lirr" for entry in update["added"] + update["removed"])
+    assert server.hub.computed == 2
+
+
+def test_bad_requests(server):
+    assert read_headers(connect(server, "/api/transit/stream?pair=lirr:1,nowhere")) == 400
+    assert read_headers(connect(server, "/api/transit/stream")) == 400
+    assert read_headers(connect(server, "/api/other")) == 404
@@ -0,0 +1,106 @@
+import datetime
+
+import pytest
+
+from transit_service.decoding import decode_trip_updates
+from transit_service.feeds import FeedSnapshot
+from transit_service.schedules import Departure, merge_departures
+from transit_service.testing import build_feed, write_gtfs
+from transit_service.timetable import Timetable, build_timetable, realtime_trip_key
+
+NEW_YORK = datetime.timezone(datetime.timedelta(hours=-5)) #EST, the test dates are in March before DST
+
+
+def at(day, clock): #posix time of "2026-03-DD HH:MM" in New York
+    hours, minutes = map(int, clock.split(':'))
+    return int(datetime.datetime(2026, 3, day, tzinfo=NEW_YORK).timestamp()) + hours * 3600 + minutes * 60
+
+
+@pytest.fixture
+def timetable(tmp_path):
+    trips = [
+        ("AFA-Weekday-00_000600_A..N", "A", "WK", [("A01N", "08:00:00", "08:00:00"), ("A03N", "08:10:00", "08:10:00"), ("A05N", "08:20:00", "08:20:00")]),
+        ("AFA-Weekday-00_003600_A..N", "A", "WK", [("A01N", "08:30:00", "08:30:00"), ("A05N", "08:50:00", "08:50:00")]),
+        ("AFA-Weekday-00_006000_A..S", "A", "WK", [("A05S", "08:05:00", "08:05:00"), ("A01S", "08:25:00", "08:25:00")]),
+        ("AFA-Weekday-00_144000_A..N", "A", "WK", [("A01N", "24:30:00", "24:30:00"), ("A05N", "24:50:00", "24:50:00")]),
+        ("AFA-Saturday-00_000600_A..N", "A", "WE", [("A01N", "09:00:00", "09:00:00"), ("A05N", "09:20:00", "09:20:00")]),
+    ]
+    calendar = {"WK": ("1111100", 20260101, 20261231), "WE": ("0000011", 20260101, 20261231)}
+    #no weekday service on Wednesday March 4, weekend service instead
+    write_gtfs(tmp_path / "subway", trips, calendar, [("WK", 20260304, 2), ("WE", 20260304, 1)])
+    write_gtfs(tmp_path / "lirr", [("GO1", "1", "WK", [("1", "07:00:00", "07:00:00"), ("12", "07:40:00", "07:40:00")])], calendar)
+    build_timetable([("subway", str(tmp_path / "subway")), ("lirr", str(tmp_path / "lirr"))], str(tmp_path / "timetable.bin"))
+    return Timetable.open(str(tmp_path / "timetable.bin"))
+
+
+#March 2 2026 is a Monday: weekday trips in the window, in departure order, directions kept apart
+def test_departures_in_window(timetable):
+    subway = timetable.get('subway')
+    departures = subway.find_departures(["A01"], ["A05"], at(2, "07:55"), at(2, "09:00"))
+    assert [(match.trip_id, match.departure, match.arrival) for match in departures] == [
+        ("AFA-Weekday-00_000600_A..N", at(2, "08:00"), at(2, "08:20")),
+        ("AFA-Weekday-00_003600_A..N", at(2, "08:30"), at(2, "08:50"))]
+    assert departures[0].origin_stop == "A01N" and departures[0].agency == "subway"
+    assert subway.find_departures(["A01"], ["A05"], at(2, "07:55"), at(2, "09:00"), limit=1)[0].departure == at(2, "08:00")
+    assert subway.find_departures(["A01N"], ["A05"], at(2, "08:24"), at(2, "08:26")) == []
+    assert timetable.get('lirr').find_departures(["1"], ["12"], at(2, "06:00"), at(2, "08:00"))[0].trip_id == "GO1"
+
+
+#24:30:00 of Monday's service is Tuesday 00:30, Saturday only has weekend trips
+def test_service_days(timetable):
+    subway = timetable.get('subway')
+    late = subway.find_departures(["A01"], ["A05"], at(3, "00:00"), at(3, "01:00"))
+    assert [(match.trip_id, match.departure) for match in late] == [("AFA-Weekday-00_144000_A..N", at(3, "00:30"))]
+    saturday = subway.find_departures(["A01"], ["A05"], at(7, "07:00"), at(7, "10:00"))
+    assert [match.trip_id for match in saturday] == ["AFA-Saturday-00_000600_A..N"]
+
+
+def test_calendar_dates_override_weekdays(timetable):
+    departures = timetable.get('subway').find_departures(["A01"], ["A05"], at(4, "07:00"), at(4, "10:00"))
+    assert [match.trip_id for match in departures] == ["AFA-Saturday-00_000600_A..N"]
+
+
+#realtime times shift the rest of the trip; stops before the first realtime stop are behind the train
+def test_realtime_delays_overlay(timetable):
+    subway = timetable.get('subway')
+    feed = build_feed(at(2, "08:05"), [("000600_A..N", "A", [("A03N", 0, at(2, "08:15")), ("A05N", at(2, "08:25"), 0)])])
+    snapshot = FeedSnapshot("ace", "subway", 1, at(2, "08:05"), at(2, "08:05"), decode_trip_updates(feed.SerializeToString()), None)
+    delays = subway.overlay([snapshot], at(2, "08:05"))
+    assert subway.overlay([snapshot], at(2, "08:05")) is delays #built once per version
+
+    from_a03 = subway.find_departures(["A03"], ["A05"], at(2, "08:00"), at(2, "09:00"), delays=delays)
+    assert [(match.departure, match.arrival) for match in from_a03] == [(at(2, "08:15"), at(2, "08:25"))]
+    from_a01 = subway.find_departures(["A01"], ["A05"], at(2, "07:55"), at(2, "09:00"), delays=delays)
+    assert [match.trip_id for match in from_a01] == ["AFA-Weekday-00_003600_A..N"] #the delayed train already left A01
+
+
+def test_merge_prefers_realtime():
+    realtime = [Departure("subway", "000600_A..N", "A", "A01N", "A05N", 100, 200)]
+    scheduled = [Departure("subway", "AFA-Weekday-00_000600_A..N", "A", "A01N", "A05N", 90, 190),
+                 Departure("subway", "AFA-Weekday-00_003600_A..N", "A", "A01N", "A05N", 150, 250)]
+    merged = merge_departures(realtime, scheduled, 10, realtime_trip_key)
+    assert [match.trip_id for match in merged] == ["000600_A..N", "AFA-Weekday-00_003600_A..N"]
+
+
+def test_rejects_other_files(tmp_path):
+    (tmp_path / "bad.bin").write_bytes(b"x" * 64)
+    with pytest.raises(ValueError):
+        Timetable.open(str(tmp_path / "bad.bin"))
+
+
+#NYCT reuses realtime ids across services: on a Monday the delays go to the Weekday trip, not the Sunday one
+def test_overlay_picks_the_active_service(tmp_path):
+    stops = [("101N", "08:00:00", "08:00:00"), ("103N", "08:05:00", "08:05:00"), ("105N", "08:10:00", "08:10:00")]
+    write_gtfs(tmp_path / "gtfs", [("AFA-Sunday-00_048000_1..N03R", "1", "SU", stops), ("AFA-Weekday-00_048000_1..N03R", "1", "WK", stops)],
+               {"WK": ("1111100", 20260101, 20261231), "SU": ("0000001", 20260101, 20261231)})
+    build_timetable([("subway", str(tmp_path / "gtfs"))], str(tmp_path / "timetable.bin"))
+    subway = Timetable.open(str(tmp_path / "timetable.bin")).get('subway')
+    assert len(subway.trips_for("048000_1..N03R")) == 2
+
+    feed = build_feed(at(2, "08:06"), [("048000_1..N03R", "1", [("103N", 0, at(2, "08:10")), ("105N", at(2, "08:15"), 0)])])
+    snapshot = FeedSnapshot("123456", "subway", 1, at(2, "08:06"), at(2, "08:06"), decode_trip_updates(feed.SerializeToString()), None)
+    delays = subway.overlay([snapshot], at(2, "08:06"))
+    assert [subway.trip_ids[trip] for trip in delays] == ["AFA-Weekday-00_048000_1..N03R"]
+    assert subway.find_departures(["101"], ["105"], at(2, "07:55"), at(2, "09:00"), delays=delays) == [] #already past 101
+    later = subway.find_departures(["103"], ["105"], at(2, "07:55"), at(2, "09:00"), delays=delays)
+    assert [(match.departure, match.arrival) for match in later] == [(at(2, "08:10"), at(2, "08:15"))]
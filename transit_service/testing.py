@@ -0,0 +1,223 @@
+#test and benchmark helpers: synthetic GTFS-realtime feeds, static GTFS directories, upstream captures
+#for replay and a local stub HTTP server that stands in for the MTA feed and BusTime endpoints
+import csv
+import datetime
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+
+from google.transit import gtfs_realtime_pb2
+
+from .replay import CaptureWriter
+
+
+#builds a GTFS-realtime FeedMessage. trips is a list of (trip_id, route_id, stops) where stops
+#is a list of (stop_id, arrival, departure) tuples, 0 leaves the time out
+def build_feed(timestamp, trips):
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "2.0"
+    feed.header.timestamp = timestamp
+    for trip_id, route_id, stops in trips:
+        entity = feed.entity.add()
+        entity.id = trip_id
+        entity.trip_update.trip.trip_id = trip_id
+        entity.trip_update.trip.route_id = route_id
+        for stop_id, arrival, departure in stops:
+            update = entity.trip_update.stop_time_update.add()
+            update.stop_id = stop_id
+            if arrival:
+                update.arrival.time = arrival
+            if departure:
+                update.departure.time = departure
+    return feed
+
+
+#serialized feed with one single-stop trip
+def make_feed(timestamp, trip_id="trip-1"):
+    return build_feed(timestamp, [(trip_id, "A", [("A01N", timestamp + 60, 0)])]).SerializeToString()
+
+
+#synthetic feed shaped like a real subway feed: trip_count trips running along route lines of
+#stops_per_route stops (ids like A01N..A40N / A01S..), each trip serving a random stretch of its line.
+#ACE/BDFM feeds have about 130 trip entities
+def make_synthetic_feed(timestamp, trip_count=130, routes="ACE", stops_per_route=40, seed=0):
+    rng = random.Random(seed)
+    trips = []
+    for number in range(trip_count):
+        route = routes[number % len(routes)]
+        direction = rng.choice("NS")
+        first = rng.randrange(stops_per_route // 2)
+        stop_ids = [f"{route}{index:02d}{direction}" for index in range(first + 1, stops_per_route + 1)]
+        if direction == "S":
+            stop_ids.reverse()
+        start = timestamp + rng.randrange(0, 1800)
+        stops = [(stop_id, start + 90 * position, start + 90 * position + 30) for position, stop_id in enumerate(stop_ids)]
+        trips.append((f"{number:06d}_{route}..{direction}", route, stops))
+    feed = build_feed(timestamp, trips)
+    #real feeds interleave vehicle positions with the trip updates
+    for number in range(trip_count):
+        entity = feed.entity.add()
+        entity.id = f"vehicle-{number}"
+        entity.vehicle.trip.trip_id = trips[number][0]
+        entity.vehicle.current_stop_sequence = 1
+        entity.vehicle.timestamp = timestamp
+    return feed
+
+
+#synthetic commuter rail feed (LIRR / Metro North): numeric stop ids without direction suffixes,
+#trips run from the terminal (stop "1") outbound or back, over stop_count stops. Trips depart
+#every 5 minutes from `timestamp` on, in random order like real feeds
+def make_rail_feed(timestamp, trip_count=300, stop_count=60, seed=0):
+    rng = random.Random(seed)
+    trips = []
+    for number in range(trip_count):
+        stop_ids = [str(stop) for stop in range(1, rng.randrange(stop_count // 3, stop_count) + 1)]
+        if number % 2:
+            stop_ids.reverse()
+        start = timestamp + 300 * number
+        stops = [(stop_id, start + 240 * position, start + 240 * position + 60) for position, stop_id in enumerate(stop_ids)]
+        trips.append((f"{number:05d}", f"{number % 12 + 1}", stops))
+    rng.shuffle(trips)
+    return build_feed(timestamp, trips)
+
+
+#random stations spread over the NYC region
+def random_stations(count, seed=0):
+    rng = random.Random(seed)
+    return [{"station_id": f"S{i}", "name": f"Station {i}", "latitude": rng.uniform(40.5, 41.2),
+             "longitude": rng.uniform(-74.3, -73.2), "gtfs_stops": [f"S{i}"]} for i in range(count)]
+
+
+#a canned response. body may be bytes or a callable(query dict) -> bytes for dynamic answers
+class StubRoute:
+    def __init__(self, body=b'', status=200, delay=0.0, content_type='application/octet-stream'):
+        self.body = body
+        self.status = status
+        self.delay = delay #seconds to wait before answering, simulates a slow upstream
+        self.content_type = content_type
+        self.hits = 0
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' #keep-alive, like the real endpoints
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        route = self.server.routes.get(parts.path)
+        if route is None:
+            self._reply(404, b'not found', 'text/plain')
+            return
+        route.hits += 1
+        if route.delay:
+            time.sleep(route.delay)
+        body = route.body(parse_qs(parts.query)) if callable(route.body) else route.body
+        self._reply(route.status, body, route.content_type)
+
+    def _reply(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): #keep test output quiet
+        pass
+
+
+#usage:
+#    with StubServer() as server:
+#        server.route('/feeds/ace', make_feed(...), delay=0.2)
+#        requests.get(server.url('/feeds/ace'))
+class StubServer:
+    def __init__(self, host='127.0.0.1', port=0):
+        self.httpd = ThreadingHTTPServer((host, port), _StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.routes = {}
+        self._thread = None
+
+    def route(self, path, body=b'', status=200, delay=0.0, content_type='application/octet-stream'):
+        self.httpd.routes[path] = StubRoute(body, status, delay, content_type)
+        return self.httpd.routes[path]
+
+    def url(self, path):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}{path}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='stub-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+#SIRI StopMonitoring answer, visits is a list of (route, journey_id, expected posix timestamp)
+def siri_stop_monitoring(visits):
+    stop_visits = [{"MonitoredVehicleJourney": {
+        "LineRef": f"MTA NYCT_{route}", "PublishedLineName": [route], "DestinationName": [f"{route} terminal"],
+        "FramedVehicleJourneyRef": {"DatedVehicleJourneyRef": journey_id},
+        "MonitoredCall": {"ExpectedArrivalTime": datetime.datetime.fromtimestamp(expected).astimezone().isoformat()},
+    }} for route, journey_id, expected in visits]
+    return {"Siri": {"ServiceDelivery": {"StopMonitoringDelivery": [{"MonitoredStopVisit": stop_visits}]}}}
+
+
+#BusTime on a StubServer. routes is route id -> list of (stop_id, name, lat, lon), visits is stop_id ->
+#list of (route, journey_id, expected) served by StopMonitoring. Returns the stop-monitoring StubRoute
+def serve_bustime(server, routes, visits, agency="MTA NYCT"):
+    as_json = lambda payload: json.dumps(payload).encode()
+    route_list = [{"id": route_id, "shortName": route_id.rpartition('_')[2]} for route_id in routes]
+    server.route(f"/api/where/routes-for-agency/{quote(agency)}.json", as_json({"data": {"list": route_list}}), content_type='application/json')
+    for route_id, stops in routes.items():
+        references = [{"id": stop_id, "name": name, "lat": lat, "lon": lon} for stop_id, name, lat, lon in stops]
+        server.route(f"/api/where/stops-for-route/{quote(route_id)}.json", as_json({"data": {"references": {"stops": references}}}),
+                     content_type='application/json')
+    def stop_monitoring(query):
+        stop_id = next((stop for stop in visits if stop.rpartition('_')[2] == query['MonitoringRef'][0]), None)
+        return as_json(siri_stop_monitoring(visits.get(stop_id, [])))
+    return server.route("/api/siri/stop-monitoring.json", stop_monitoring, content_type='application/json')
+
+
+#writes a small static GTFS directory. trips is a list of (trip_id, route_id, service_id, stops) where
+#stops is a list of (stop_id, arrival, departure) as "HH:MM:SS" strings; calendar is service_id ->
+#(weekdays like "1111100", start YYYYMMDD, end YYYYMMDD), calendar_dates a list of (service_id, date, type)
+def write_gtfs(directory, trips, calendar, calendar_dates=(), timezone="America/New_York"):
+    os.makedirs(directory, exist_ok=True)
+    def write(filename, header, rows):
+        with open(os.path.join(directory, filename), 'w', newline='') as gtfs_file:
+            writer = csv.writer(gtfs_file)
+            writer.writerow(header)
+            writer.writerows(rows)
+    write('agency.txt', ['agency_id', 'agency_name', 'agency_timezone'], [['MTA', 'MTA', timezone]])
+    write('calendar.txt', ['service_id', 'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday', 'start_date', 'end_date'],
+          [[service_id, *days, start, end] for service_id, (days, start, end) in calendar.items()])
+    write('calendar_dates.txt', ['service_id', 'date', 'exception_type'], calendar_dates)
+    write('trips.txt', ['route_id', 'service_id', 'trip_id'], [[route_id, service_id, trip_id] for trip_id, route_id, service_id, _ in trips])
+    write('stop_times.txt', ['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence'],
+          [[trip_id, arrival, departure, stop_id, sequence] for trip_id, _, _, stops in trips
+           for sequence, (stop_id, arrival, departure) in enumerate(stops, 1)])
+    return directory
+
+
+#writes a capture for replay.ReplayAdapter. responses are (offset seconds, url, body) in recorded order,
+#optionally followed by status and content type
+def write_capture(directory, responses):
+    offsets = iter([0.0] + [response[0] for response in responses])
+    writer = CaptureWriter(directory, clock=lambda: next(offsets))
+    for offset, url, body, *rest in responses:
+        status = rest[0] if rest else 200
+        content_type = rest[1] if len(rest) > 1 else 'application/octet-stream'
+        writer.write(url, status, content_type, body)
+    writer.close()
+    return directory
@@ -0,0 +1,455 @@
+#static GTFS timetables: an offline build step compiles stops.txt, trips.txt, stop_times.txt and
+#calendar(_dates).txt of every agency into one file of binary columns. The service maps that file
+#read-only at startup (workers share the pages, no CSV is parsed) and answers "departures from these
+#stops between t1 and t2" with one binary search per stop. Realtime stop_time_updates are laid over
+#the schedule as per-trip delays; trips a realtime feed leaves out, or every trip while a feed is
+#down, still get their scheduled departures
+#    python -m transit_service.timetable --output timetable.bin subway=gtfs_subway.zip lirr=gtfs_lirr.zip metro_north=gtfs_mnr.zip
+import argparse
+import bisect
+import csv
+import datetime
+import heapq
+import io
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import zipfile
+from array import array
+from zoneinfo import ZoneInfo
+
+from .schedules import DEFAULT_SCHEDULE_LIMIT, Departure
+from .stop_index import base_stop_id
+
+logger = logging.getLogger('transit_api')
+
+MAGIC = b'GTFSTT01'
+DEFAULT_TIMEZONE = 'America/New_York'
+DEFAULT_HORIZON = 3 * 3600 #seconds ahead scheduled departures are searched
+MAX_DELAY = 3 * 3600 #a realtime time further than this from the schedule is another run of the trip
+DELAY_LOOKBACK = 1800 #late trips scheduled this long before the window can still leave inside it
+#file: magic, length of the table of contents (JSON: agency -> offset, size, timezone), then one section per agency
+_FILE_HEADER = struct.Struct('<8sI')
+#section: trips, stop_times rows, stops, services, calendar_dates exceptions, bytes of the string table
+_SECTION_HEADER = struct.Struct('<IIIIII')
+#section columns after the header, (name, typecode, length) with T trips, R rows, P stops, S services, E exceptions.
+#rows are stop_times grouped by trip in stop_sequence order; stop_rows lists them again per stop, sorted by
+#departure, with their departures copied alongside in stop_departures for the binary search. Times are
+#seconds since the start of the service day (can pass 24:00:00), dates are YYYYMMDD integers
+_COLUMNS = [
+    ('trip_offsets', 'I', lambda T, R, P, S, E: T + 1),
+    ('trip_services', 'I', lambda T, R, P, S, E: T),
+    ('row_stops', 'I', lambda T, R, P, S, E: R),
+    ('row_arrivals', 'i', lambda T, R, P, S, E: R),
+    ('row_departures', 'i', lambda T, R, P, S, E: R),
+    ('row_trips', 'I', lambda T, R, P, S, E: R),
+    ('stop_offsets', 'I', lambda T, R, P, S, E: P + 1),
+    ('stop_rows', 'I', lambda T, R, P, S, E: R),
+    ('stop_departures', 'i', lambda T, R, P, S, E: R),
+    ('service_days', 'B', lambda T, R, P, S, E: S), #weekday bits, Monday is bit 0
+    ('service_starts', 'i', lambda T, R, P, S, E: S),
+    ('service_ends', 'i', lambda T, R, P, S, E: S),
+    ('exception_services', 'I', lambda T, R, P, S, E: E),
+    ('exception_dates', 'i', lambda T, R, P, S, E: E),
+    ('exception_types', 'B', lambda T, R, P, S, E: E), #1 added, 2 removed
+    ('string_offsets', 'I', lambda T, R, P, S, E: 2 * T + P + S + 1), #trip ids, route ids, stop ids, service ids
+]
+_WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+def _padding(size):
+    return b'\0' * (-size % 8) #keeps every column 8-byte aligned
+
+
+#"25:10:00" -> 90600, None when empty
+def _gtfs_seconds(value):
+    if not value:
+        return None
+    hours, minutes, seconds = value.strip().split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+#the NYCT realtime feeds drop the static trip id's schedule prefix: static
+#AFA23GEN-1038-Sunday-00_000600_1..S03R is realtime 000600_1..S03R. Other ids are used as they are
+def realtime_trip_key(trip_id):
+    head, separator, _ = trip_id.partition('..')
+    if separator and head.count('_') >= 2:
+        return trip_id.split('_', 1)[1]
+    return trip_id
+
+
+def _rows(text_file):
+    with text_file:
+        yield from csv.DictReader(text_file)
+
+
+#rows of a GTFS file from a directory or a zip archive, None when the file isn't there
+def _gtfs_reader(source):
+    if zipfile.is_zipfile(source):
+        archive = zipfile.ZipFile(source)
+        members = {os.path.basename(name): name for name in archive.namelist()}
+
+        def read(filename):
+            if filename not in members:
+                return None
+            return _rows(io.TextIOWrapper(archive.open(members[filename]), encoding='utf-8-sig', newline=''))
+    else:
+        def read(filename):
+            path = os.path.join(source, filename)
+            return _rows(open(path, newline='', encoding='utf-8-sig')) if os.path.exists(path) else None
+    return read
+
+
+#one agency's GTFS (directory or zip) -> (section bytes, timezone)
+def compile_agency(source):
+    read = _gtfs_reader(source)
+    timezone = next((row.get('agency_timezone') for row in read('agency.txt') or ()), None) or DEFAULT_TIMEZONE
+
+    services = {} #service id -> index
+    service_days, service_starts, service_ends = array('B'), array('i'), array('i')
+
+    def service(service_id):
+        if service_id not in services:
+            services[service_id] = len(services)
+            service_days.append(0)
+            service_starts.append(0)
+            service_ends.append(0)
+        return services[service_id]
+
+    for row in read('calendar.txt') or ():
+        index = service(row['service_id'])
+        service_days[index] = sum(1 << day for day, name in enumerate(_WEEKDAYS) if row.get(name, '0').strip() == '1')
+        service_starts[index], service_ends[index] = int(row['start_date']), int(row['end_date'])
+    exceptions = sorted((service(row['service_id']), int(row['date']), int(row['exception_type']))
+                        for row in read('calendar_dates.txt') or ())
+
+    trips = {} #trip id -> (route id, service index)
+    for row in read('trips.txt'):
+        trips[row['trip_id']] = (row.get('route_id', ''), service(row['service_id']))
+
+    stop_codes = {} #stop id -> code
+    stop_times = {} #trip id -> [(stop_sequence, stop code, arrival, departure)]
+    for row in read('stop_times.txt'):
+        arrival, departure = _gtfs_seconds(row.get('arrival_time')), _gtfs_seconds(row.get('departure_time'))
+        if row['trip_id'] not in trips or (arrival is None and departure is None): #untimed stop, nothing to schedule
+            continue
+        code = stop_codes.setdefault(row['stop_id'], len(stop_codes))
+        arrival = departure if arrival is None else arrival
+        stop_times.setdefault(row['trip_id'], []).append((int(row['stop_sequence']), code, arrival,
+                                                          arrival if departure is None else departure))
+
+    trip_ids, route_ids = [], []
+    columns = {name: array(typecode) for name, typecode, _ in _COLUMNS}
+    columns['trip_offsets'].append(0)
+    for trip_id, stops in stop_times.items():
+        route_id, service_index = trips[trip_id]
+        trip_ids.append(trip_id)
+        route_ids.append(route_id)
+        columns['trip_services'].append(service_index)
+        stops.sort()
+        for _, code, arrival, departure in stops:
+            columns['row_stops'].append(code)
+            columns['row_arrivals'].append(arrival)
+            columns['row_departures'].append(departure)
+            columns['row_trips'].append(len(trip_ids) - 1)
+        columns['trip_offsets'].append(len(columns['row_stops']))
+
+    row_stops, row_departures = columns['row_stops'], columns['row_departures']
+    by_stop = sorted(range(len(row_stops)), key=lambda row: (row_stops[row], row_departures[row]))
+    columns['stop_rows'] = array('I', by_stop)
+    columns['stop_departures'] = array('i', (row_departures[row] for row in by_stop))
+    counts = [0] * (len(stop_codes) + 1)
+    for code in row_stops:
+        counts[code + 1] += 1
+    for code in range(len(stop_codes)):
+        counts[code + 1] += counts[code]
+    columns['stop_offsets'] = array('I', counts)
+    columns['service_days'], columns['service_starts'], columns['service_ends'] = service_days, service_starts, service_ends
+    for service_index, date, kind in exceptions:
+        columns['exception_services'].append(service_index)
+        columns['exception_dates'].append(date)
+        columns['exception_types'].append(kind)
+
+    strings = [value.encode('utf-8') for value in trip_ids + route_ids + list(stop_codes) + list(services)]
+    offsets = columns['string_offsets']
+    offsets.append(0)
+    for value in strings:
+        offsets.append(offsets[-1] + len(value))
+    string_table = b''.join(strings)
+
+    parts = [_SECTION_HEADER.pack(len(trip_ids), len(row_stops), len(stop_codes), len(services), len(exceptions), len(string_table))]
+    for name, _, _ in _COLUMNS:
+        data = bytes(columns[name])
+        parts += [data, _padding(len(data))]
+    parts.append(string_table)
+    return b''.join(parts), timezone
+
+
+#compiles every (agency, GTFS directory or zip) into one timetable file, written atomically
+def build_timetable(sources, output):
+    sections, contents, offset = [], {}, 0
+    for agency, source in sources:
+        data, timezone = compile_agency(source)
+        data += _padding(len(data))
+        contents[agency] = {"offset": offset, "size": len(data), "timezone": timezone} #offset from the first section
+        sections.append(data)
+        offset += len(data)
+        logger.info("Compiled %s timetable from %s: %s bytes", agency, source, len(data))
+    toc = json.dumps(contents).encode()
+    toc += b' ' * (-(_FILE_HEADER.size + len(toc)) % 8)
+    temporary = f"{output}.tmp{os.getpid()}"
+    with open(temporary, 'wb') as timetable_file:
+        timetable_file.write(_FILE_HEADER.pack(MAGIC, len(toc)))
+        timetable_file.write(toc)
+        for data in sections:
+            timetable_file.write(data)
+    os.replace(temporary, output)
+
+
+#strings of the string table, decoded when asked for so opening a timetable decodes nothing
+class _Strings:
+    def __init__(self, offsets, data, start, count):
+        self.offsets = offsets
+        self.data = data
+        self.start = start
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        index += self.start
+        return str(self.data[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+
+
+#one agency's section of a timetable file, the columns are memoryviews into the mapping
+class AgencyTimetable:
+    def __init__(self, agency, view, timezone=DEFAULT_TIMEZONE):
+        self.agency = agency
+        self.timezone = ZoneInfo(timezone)
+        trips, rows, stops, services, exceptions, strings_size = _SECTION_HEADER.unpack_from(view)
+        offset = _SECTION_HEADER.size
+        for name, typecode, length in _COLUMNS:
+            size = struct.calcsize(typecode) * length(trips, rows, stops, services, exceptions)
+            setattr(self, name, view[offset:offset + size].cast(typecode))
+            offset += size + len(_padding(size))
+        data = view[offset:offset + strings_size]
+        self.trip_ids = _Strings(self.string_offsets, data, 0, trips)
+        self.route_ids = _Strings(self.string_offsets, data, trips, trips)
+        self.stop_ids = [str(stop_id) for stop_id in _Strings(self.string_offsets, data, 2 * trips, stops)]
+        self.stops = {} #base stop id -> stop codes, like StopIndex.stops
+        for code, stop_id in enumerate(self.stop_ids):
+            self.stops.setdefault(base_stop_id(stop_id), []).append(code)
+        self._exceptions = {} #date -> [(service, type)]
+        for service, date, kind in zip(self.exception_services, self.exception_dates, self.exception_types):
+            self._exceptions.setdefault(date, []).append((service, kind))
+        self._lock = threading.Lock()
+        self._active = {} #date -> active flag per service
+        self._trip_keys = None #realtime trip key -> trips, built on the first overlay
+        self._overlay = (None, {}) #(realtime versions, delays) of the last overlay built
+
+    def __len__(self):
+        return len(self.trip_ids)
+
+    #stop codes for stop id patterns, matched like StopIndex.lookup: "A01" is A01, A01N and A01S, "A01N" only A01N
+    def stop_codes(self, patterns):
+        codes = []
+        for pattern in dict.fromkeys(patterns):
+            base = base_stop_id(pattern)
+            codes.extend(code for code in self.stops.get(base, ()) if base == pattern or self.stop_ids[code] == pattern)
+        return codes
+
+    #posix time of a service day's 00:00:00, GTFS measures it as noon minus 12h so DST days come out right
+    def day_start(self, date):
+        return int(datetime.datetime.combine(date, datetime.time(12), tzinfo=self.timezone).timestamp()) - 12 * 3600
+
+    #active flag per service on a date: calendar.txt weekdays and date range, then calendar_dates.txt
+    def active_services(self, date):
+        active = self._active.get(date)
+        if active is None:
+            day, bit = int(date.strftime('%Y%m%d')), 1 << date.weekday()
+            active = bytearray(start <= day <= end and bool(days & bit)
+                               for days, start, end in zip(self.service_days, self.service_starts, self.service_ends))
+            for service, kind in self._exceptions.get(day, ()):
+                active[service] = kind == 1
+            with self._lock:
+                if len(self._active) > 16:
+                    self._active.clear()
+                self._active[date] = active
+        return active
+
+    #service days whose trips can run between start and end (posix), as (date, day start): trips of
+    #the day before run past midnight
+    def service_days_between(self, start, end):
+        first = datetime.datetime.fromtimestamp(start, self.timezone).date() - datetime.timedelta(days=1)
+        last = datetime.datetime.fromtimestamp(end, self.timezone).date()
+        days = []
+        while first <= last:
+            days.append((first, self.day_start(first)))
+            first += datetime.timedelta(days=1)
+        return days
+
+    #(row, day start) of every scheduled departure at the given stop codes between start and end (posix)
+    def departures(self, codes, start, end):
+        stop_offsets, stop_rows, stop_departures = self.stop_offsets, self.stop_rows, self.stop_departures
+        row_trips, trip_services = self.row_trips, self.trip_services
+        for date, day in self.service_days_between(start, end):
+            active = self.active_services(date)
+            low, high = start - day, end - day
+            for code in codes:
+                first, last = stop_offsets[code], stop_offsets[code + 1]
+                position = bisect.bisect_left(stop_departures, low, first, last)
+                while position < last and stop_departures[position] <= high:
+                    row = stop_rows[position]
+                    if active[trip_services[row_trips[row]]]:
+                        yield row, day
+                    position += 1
+
+    #static trips for a realtime trip id, empty for trips the schedule doesn't have (ex: added trips). NYCT
+    #reuses one realtime id across its Weekday, Saturday and Sunday trips, so there can be several
+    def trips_for(self, realtime_trip_id):
+        if self._trip_keys is None:
+            keys = {}
+            for trip in range(len(self.trip_ids)):
+                keys.setdefault(realtime_trip_key(self.trip_ids[trip]), []).append(trip)
+            self._trip_keys = keys
+        return self._trip_keys.get(realtime_trip_key(realtime_trip_id), ())
+
+    #realtime delays per static trip from feed snapshots: trip -> (day start, position of the first stop with
+    #a realtime time, delay per stop of the trip). The delay at a stop is realtime minus scheduled time at the
+    #last stop with a realtime time; stops before the first one are behind the train (realtime feeds drop the
+    #stops a train has passed). Built once per set of snapshot versions
+    def overlay(self, snapshots, now):
+        versions = tuple((snapshot.name, snapshot.version) for snapshot in snapshots)
+        built_for, delays = self._overlay
+        if built_for == versions:
+            return delays
+        delays = {}
+        service_days = self.service_days_between(now, now)
+        for snapshot in snapshots:
+            columns = snapshot.feed
+            for realtime_trip, trip_id in enumerate(columns.trip_ids):
+                trips = self.trips_for(trip_id)
+                if trips:
+                    found = self._trip_delays(trips, columns, realtime_trip, service_days)
+                    if found is not None:
+                        delays[found[0]] = found[1]
+        self._overlay = (versions, delays)
+        return delays
+
+    #(trip, delays) for the realtime trip: of the static trips and service days it may be, the run whose
+    #service is active that day and whose schedule the realtime times are closest to
+    def _trip_delays(self, trips, columns, realtime_trip, service_days):
+        times = {} #stop id -> realtime departure (or arrival)
+        for row in columns.rows(realtime_trip):
+            time = columns.departures[row] or columns.arrivals[row]
+            if time:
+                times[columns.stop_id(row)] = time
+        best = None #(distance, trip, day, anchor row)
+        for trip in trips:
+            first, last = self.trip_offsets[trip], self.trip_offsets[trip + 1]
+            anchor = next(((row, times[self.stop_ids[self.row_stops[row]]]) for row in range(first, last)
+                           if self.stop_ids[self.row_stops[row]] in times), None)
+            if anchor is None:
+                continue
+            scheduled = self.row_departures[anchor[0]]
+            for date, day in service_days:
+                distance = abs(anchor[1] - day - scheduled)
+                if distance <= MAX_DELAY and (best is None or distance < best[0]) and self.active_services(date)[self.trip_services[trip]]:
+                    best = (distance, trip, day, anchor[0])
+        if best is None:
+            return None
+        _, trip, day, anchor_row = best
+        first, last = self.trip_offsets[trip], self.trip_offsets[trip + 1]
+        delays, delay = array('i'), 0
+        for row in range(first, last):
+            time = times.get(self.stop_ids[self.row_stops[row]])
+            if time:
+                delay = time - day - self.row_departures[row]
+            delays.append(delay)
+        return trip, (day, anchor_row - first, delays)
+
+    #the `limit` earliest scheduled departures from an origin stop to a later destination stop that leave
+    #between start and end, as schedules.Departure. With `delays` (see overlay) the times are the
+    #expected ones, trips running late from before the window included and trips past the origin left out
+    def find_departures(self, origin_patterns, destination_patterns, start, end, limit=DEFAULT_SCHEDULE_LIMIT, delays=None):
+        origin_codes = self.stop_codes(origin_patterns)
+        destination_codes = set(self.stop_codes(destination_patterns))
+        if not origin_codes or not destination_codes or limit <= 0:
+            return []
+        delays = delays or {}
+        trip_offsets, row_trips, row_stops = self.trip_offsets, self.row_trips, self.row_stops
+        row_arrivals, row_departures = self.row_arrivals, self.row_departures
+        seen, candidates = set(), []
+        for row, day in self.departures(origin_codes, start - (DELAY_LOOKBACK if delays else 0), end):
+            trip = row_trips[row]
+            trip_delays = delays.get(trip)
+            if trip_delays is not None and trip_delays[0] == day and row - trip_offsets[trip] < trip_delays[1]:
+                continue #already left the origin
+            if (trip, day) in seen:
+                continue
+            destination = next((later for later in range(row + 1, trip_offsets[trip + 1]) if row_stops[later] in destination_codes), None)
+            if destination is None:
+                continue
+            seen.add((trip, day))
+            departure, arrival = day + row_departures[row], day + row_arrivals[destination]
+            if trip_delays is not None and trip_delays[0] == day:
+                first = trip_offsets[trip]
+                departure += trip_delays[2][row - first]
+                arrival += trip_delays[2][destination - first]
+            if start <= departure <= end:
+                candidates.append(Departure(self.agency, self.trip_ids[trip], self.route_ids[trip], self.stop_ids[row_stops[row]],
+                                            self.stop_ids[row_stops[destination]], departure, arrival))
+        return heapq.nsmallest(limit, candidates, key=lambda match: (match.departure, match.arrival))
+
+
+#a timetable file: agency -> AgencyTimetable over one shared mapping
+class Timetable:
+    def __init__(self, agencies, buffer=None):
+        self.agencies = agencies
+        self.buffer = buffer #keeps the mapping alive
+        self.nbytes = len(buffer) if buffer is not None else 0
+
+    #bytes-like (bytes, mmap) -> Timetable
+    @classmethod
+    def load(cls, buffer):
+        view = memoryview(buffer)
+        magic, toc_size = _FILE_HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError("not a timetable file")
+        start = _FILE_HEADER.size + toc_size
+        contents = json.loads(bytes(view[_FILE_HEADER.size:start]))
+        agencies = {agency: AgencyTimetable(agency, view[start + entry['offset']:start + entry['offset'] + entry['size']], entry['timezone'])
+                    for agency, entry in contents.items()}
+        return cls(agencies, buffer)
+
+    #maps a timetable file read-only
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as timetable_file:
+            mapped = mmap.mmap(timetable_file.fileno(), 0, access=mmap.ACCESS_READ) #stays valid after close
+        return cls.load(mapped)
+
+    def get(self, agency):
+        return self.agencies.get(agency)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile static GTFS feeds into a timetable file")
+    parser.add_argument('sources', nargs='+', help="agency=GTFS directory or zip, ex: subway=gtfs_subway.zip")
+    parser.add_argument('--output', default='timetable.bin')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    sources = []
+    for source in args.sources:
+        agency, _, path = source.rpartition('=')
+        sources.append((agency or 'subway', path))
+    build_timetable(sources, args.output)
+    print(f"Wrote {args.output} ({os.path.getsize(args.output)} bytes)")
+
+
+if __name__ == '__main__':
+    main()